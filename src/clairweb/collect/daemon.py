@@ -26,20 +26,29 @@ Main module for the server and command line script.
 
 # import os
 from os import path
-# from datetime import datetime, timedelta
+from datetime import timedelta
 import time
-# from random import randint
+import math
+import random
+import heapq
 import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # import dateutil.rrule
-# import pandas as pd
-#import numpy as np
+import pandas as pd
+import numpy as np
 from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
 
-from collect.get_ebay import EbayConnector
-from collect.models import SearchTask, ListingFoundBy
+from collect.get_ebay import EbayConnector, EbayPartialError
+from collect.models import SearchTask, ListingFoundBy, Event
 import econdata.models
-from libclair.dataframes import write_frame, make_data_frame
+from econdata.prices import mark_listings_changed, read_listing_times
+from libclair.dataframes import write_frame_bulk, make_data_frame
 # from clair.coredata import SearchTask, UpdateTask, DataStore
 # from clair.textprocessing import RecognizerController
 
@@ -52,6 +61,74 @@ from libclair.dataframes import write_frame, make_data_frame
 # logging.Formatter.converter = time.gmtime
 
 
+class KnownListings(object):
+    """
+    Set of the IDs of the listings, that are stored in the database with 
+    their final information. Thread safe.
+    
+    These listings have the status "ended" or "canceled", they can't change
+    anymore. Search tasks don't need to download their details again.
+    
+    The ``Listing`` table is the persistent storage. The set is a copy of 
+    the IDs in memory, that is read again after ``refresh_interval``. 
+    Only ``refresh`` accesses the database.
+    
+    Parameters
+    ----------
+    
+    refresh_interval : timedelta
+        The IDs are read again from the database after this time.
+        
+    timer : function
+        Returns the current time in seconds. For testing.
+    """
+    final_states = ['ended', 'canceled']
+    "Status of listings that can't change anymore."
+    
+    def __init__(self, refresh_interval=timedelta(hours=1), 
+                 timer=time.monotonic):
+        self.refresh_interval = refresh_interval
+        self.timer = timer
+        self.refresh_time = None
+        self._ids = set()
+        self._lock = threading.Lock()
+    
+    def refresh(self, force=False):
+        """
+        Read the IDs of the final listings from the database, if the 
+        ``refresh_interval`` has passed (or ``force`` is ``True``).
+        """
+        now = self.timer()
+        if not force and self.refresh_time is not None and \
+                now - self.refresh_time < self.refresh_interval.total_seconds():
+            return
+        ids = set(econdata.models.Listing.objects
+                  .filter(status__in=self.final_states)
+                  .values_list('id', flat=True))
+        with self._lock:
+            self._ids = ids
+            self.refresh_time = now
+    
+    def add(self, listings):
+        """
+        Add the listings whose status is final. 
+        ``listings`` is a ``pandas.DataFrame`` with columns "id" and "status".
+        """
+        ids = listings.loc[listings['status'].isin(self.final_states), 'id']
+        with self._lock:
+            self._ids.update(ids)
+    
+    def is_known(self, ids):
+        """
+        Test if listings are known and final. 
+        Returns an array of ``bool``, one for each ID in ``ids``.
+        """
+        with self._lock:
+            return np.array([lid in self._ids for lid in ids], dtype=bool)
+    
+    def __len__(self):
+        return len(self._ids)
+
 
 class DaemonMain(object):
     """Main object for downloading listings from the Internet."""
@@ -63,111 +140,190 @@ class DaemonMain(object):
        "EBAY-PH", "EBAY-PL", "EBAY-SG", "EBAY-US", }
     "Legal values for Ebay's global ID."
 
-    def __init__(self):
-        base_dir = settings.BASE_DIR
-        self.connector = EbayConnector(path.join(base_dir, 'ebay-sdk.apikey'))
-    
-#     def compute_next_due_time(self, curr_time, recurrence_pattern, 
-#                               add_random=False):
-#         """
-#         Compute next due time for recurrent tasks.
-#         
-#         Parameters
-#         ----------
-#         
-#         curr_time : datetime
-#             Start time of the recurrence. Current time should be used.
-#             
-#         recurrence_pattern: str 
-#             How often should the task be executed? One of:
-#                 * "m", "month", "monthly"
-#                 * "w", "week", "weekly"
-#                 * "d", "day", "daily"
-#                 * "h", "hour", "hourly"
-#         
-#         add_random: bool
-#             If ``True``, add a random amount of time to the computed due time,
-#             to avoid load spikes. 
-#             If ``False``, the computed times are at the start of the interval,
-#             for example at 00:00 o'clock for "daily" recurrence.
-#             
-#         Returns
-#         -------
-#         datetime
-#             The new due time
-#         """
-#         bymonth = None; bymonthday = None; byweekday = None; byhour = None
-#         byminute = 0; bysecond = 0
-#         
-#         recurrence_pattern = recurrence_pattern.lower()
-#         if recurrence_pattern in ["m", "month", "monthly"]:
-#             freq = dateutil.rrule.MONTHLY
-#             byhour = 0
-#             bymonthday = 1
-#             rand_max = 15 * 24 * 60 * 60 #sec - 15 days
-#         elif recurrence_pattern in ["w", "week", "weekly"]:
-#             freq = dateutil.rrule.WEEKLY
-#             byhour = 0
-#             byweekday = 0
-#             rand_max = 3.5 * 24 * 60 * 60 #sec - 3.5 days
-#         elif recurrence_pattern in ["d", "day", "daily"]:
-#             freq = dateutil.rrule.DAILY
-#             byhour = 0
-#             rand_max = 12 * 60 * 60 #sec - 12 hours
-#         elif recurrence_pattern in ["h", "hour", "hourly"]:
-#             freq = dateutil.rrule.HOURLY
-#             rand_max = 30 * 60 #sec - 30 minutes
-#         else:
-#             raise ValueError("Unkown recurrence_pattern: " + 
-#                              str(recurrence_pattern))
-#         
-#         rrule = dateutil.rrule.rrule(freq=freq, dtstart=curr_time, count=2, 
-#                                      bymonth=bymonth, bymonthday=bymonthday, 
-#                                      byweekday=byweekday, byhour=byhour, 
-#                                      byminute=byminute, bysecond=bysecond,
-#                                      cache=True)
-#         new_time = rrule.after(curr_time)
-#         
-#         #Add add_random component.
-#         if add_random:
-#             rand_secs = randint(0, rand_max)
-#             new_time += timedelta(seconds=rand_secs)
-#         
-#         return new_time
-#     
-#         
-#     def compute_next_wakeup_time(self):
-#         """
-#         Compute time when application needs to wake up to execute next task.
-#          
-#         Loops over all tasks in ``self.tasks``.
-#          
-#         Returns
-#         -------
-#          
-#         datetime, float
-#          
-#         * Time when next task is due
-#         * Number of seconds to sleep until the next task is due.
-#         """
-#         wakeup_time = datetime(9999, 12, 31) #The last possible month
-#         for task in self.data.tasks:
-#             wakeup_time = min(task.due_time, wakeup_time)
-#              
-#         sleep_interval = wakeup_time - datetime.utcnow()
-#         sleep_sec = max(sleep_interval.total_seconds(), 0.) 
-#          
-#         return wakeup_time, sleep_sec
+    n_threads = 8
+    "Maximum number of search tasks that are executed in parallel."
+    max_tasks_per_site = 2
+    "Maximum number of search tasks that are executed in parallel on one Ebay site."
+    jitter = 0.1
+    """
+    Maximum random delay of a task's next execution, as fraction of its 
+    recurrence. Spreads tasks with equal recurrence, to avoid load spikes.
+    """
+    max_sleep = 600
+    "Maximum time (seconds) between two scans of the event table for new tasks."
+    final_update_bucket = timedelta(hours=1)
+    "Listings that end in the same time interval are updated together."
+    final_update_delay = timedelta(minutes=30)
+    "Listings are updated this long after their time bucket has ended."
+    final_update_max_age = timedelta(days=7)
+    "Listings that have ended longer ago are not updated anymore."
+    final_update_server = 'EBAY-US'
+    "Ebay site for updating listings, that were not found by a search task."
+    final_update_retry_delay = timedelta(minutes=10)
+    "Delay of the first retry of a failed update; doubles after each failure."
+    final_update_max_attempts = 5
+    "Listings whose update failed this often get the status 'canceled'."
+
+    def __init__(self, connector=None):
+        """
+        Parameters
+        ----------
+        
+        connector : EbayConnector
+            Connection to Ebay. ``None``: create a connector with the keyfile
+            ``ebay-sdk.apikey`` in the base directory.
+        """
+        if connector is None:
+            base_dir = settings.BASE_DIR
+            connector = EbayConnector(path.join(base_dir, 'ebay-sdk.apikey'))
+        self.connector = connector
+        self.known_listings = KnownListings()
+        # Heap of ``(due_time, event_id, event)``; the next event is first.
+        self.event_heap = []
+        # Accumulated duration (seconds) of the stages of the search tasks.
+        self.stage_times = defaultdict(float)
+        self.stage_times_lock = threading.Lock()
+
+    @contextmanager
+    def measure_stage(self, stage):
+        """
+        Add the duration of the ``with`` block to ``self.stage_times[stage]``.
+        Can be used from several threads.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.stage_times_lock:
+                self.stage_times[stage] += duration
+
+    def compute_next_due_time(self, due_time, recurrence, now):
+        """
+        Compute next due time for recurrent tasks.
+        
+        The next due time is one ``recurrence`` after the previous due time,
+        so that the task doesn't drift. If this time has already passed, 
+        the task is due immediately. A random delay of up to 
+        ``self.jitter * recurrence`` is added.
+        
+        Parameters
+        ----------
+        
+        due_time : datetime
+            Previous due time of the task.
+            
+        recurrence: timedelta 
+            How often should the task be executed.
+        
+        now: datetime
+            Current time.
+            
+        Returns
+        -------
+        datetime
+            The new due time
+        """
+        assert isinstance(recurrence, timedelta)
+        next_time = max(due_time + recurrence, now)
+        jitter_sec = random.uniform(0, self.jitter * recurrence.total_seconds())
+        return next_time + timedelta(seconds=jitter_sec)
+
+    def create_search_events(self):
+        """
+        Create an ``Event`` for each search task that has none. 
+        The new events are due immediately.
+        """
+        now = timezone.now()
+        tasks = SearchTask.objects.filter(event__isnull=True)
+        Event.objects.bulk_create([Event(due_time=now, search_task=task) 
+                                   for task in tasks])
+
+    def read_events(self):
+        """
+        Read the events of the search tasks into the heap ``self.event_heap``.
+        Creates events for new search tasks.
+        """
+        self.create_search_events()
+        events = Event.objects.filter(search_task__isnull=False)\
+                              .select_related('search_task', 
+                                              'search_task__product')
+        self.event_heap = [(event.due_time, event.id, event) 
+                           for event in events]
+        heapq.heapify(self.event_heap)
+
+    def compute_next_wakeup_time(self):
+        """
+        Compute time when application needs to wake up to execute next task,
+        or the next update of listings.
+        
+        Sleeps at most ``self.max_sleep`` seconds, to find new tasks.
+         
+        Returns
+        -------
+         
+        datetime, float
+         
+        * Time when next task is due
+        * Number of seconds to sleep until the next task is due.
+        """
+        now = timezone.now()
+        wakeup_time = now + timedelta(seconds=self.max_sleep)
+        if self.event_heap:
+            wakeup_time = min(self.event_heap[0][0], wakeup_time)
+        update_time = Event.objects.filter(listing__isnull=False)\
+                                   .aggregate(Min('due_time'))['due_time__min']
+        if update_time is not None:
+            wakeup_time = min(update_time, wakeup_time)
+             
+        sleep_interval = wakeup_time - now
+        sleep_sec = max(sleep_interval.total_seconds(), 0.) 
+         
+        return wakeup_time, sleep_sec
 
     def execute_search_task(self, task):
         """Search for new listings. Executes a search task."""
         assert isinstance(task, SearchTask)
-        logging.debug("Executing search task: '{id}'".format(id=task.id))
         start_time = time.time()
+        self.known_listings.refresh()
+        result = self.download_search_task(task)
+        if result is None:
+            return []
+        listings_upd, known_ids = result
+        listing_ids = self.store_search_results(task, listings_upd, known_ids)
+        
+        end_time = time.time()
+        delta_sec = end_time - start_time
+        logging.info('Downloaded {num} listings in {dur} sec.'
+                     .format(num=len(listings_upd), dur=delta_sec))
+        return listing_ids
+
+    def download_search_task(self, task):
+        """
+        Search for new listings, and download their details from Ebay. 
+        
+        The details are only downloaded for new listings, and for listings 
+        that can still change. Listings in ``self.known_listings`` are 
+        stored with their final information already.
+        
+        Doesn't access the database; can run in parallel in several threads.
+        
+        Returns
+        -------
+        
+        pandas.DataFrame, list[str]
+        
+        * The new and changeable listings, with all details.
+        * The IDs of the found listings, that were known already.
+        
+        Returns ``None`` if the task is invalid.
+        """
+        assert isinstance(task, SearchTask)
+        logging.debug("Executing search task: '{id}'".format(id=task.id))
         
         if task.server not in self.all_ebay_global_ids:
             logging.error('Invalid server ID: "{sid}"'.format(sid=task.server))
-            return []
+            return None
 
         # Get the keywords from the product if a product is given. 
         if task.query_string:
@@ -177,178 +333,356 @@ class DaemonMain(object):
         else:
             logging.error('No keywords to search for.\n'
                           '``task.query_string`` and product are empty.')
-            return []
+            return None
         
         #Get new listings from server
-        listings_found = self.connector.find_listings(
-                                    keywords=query_string, 
-                                    n_listings=task.n_listings, 
-                                    ebay_site=task.server,
-                                    price_min=task.price_min, 
-                                    price_max=task.price_max, 
-                                    currency=task.currency,
-                                    time_from=None,
-                                    time_to=None)
+        with self.measure_stage('find'):
+            listings_found = self.connector.find_listings(
+                                        keywords=query_string, 
+                                        n_listings=task.n_listings, 
+                                        ebay_site=task.server,
+                                        price_min=task.price_min, 
+                                        price_max=task.price_max, 
+                                        currency=task.currency,
+                                        time_from=None,
+                                        time_to=None)
         #Fill in all details of the new listings
-        listings_upd = self.connector.update_listings(listings_found, task.server)
+        is_known = self.known_listings.is_known(listings_found['id'])
+        known_ids = list(listings_found.loc[is_known, 'id'])
+        listings_new = listings_found[~is_known]
+        if len(listings_new) > 0:
+            with self.measure_stage('update'):
+                try:
+                    listings_upd = self.connector.update_listings(listings_new, 
+                                                                  task.server)
+                except EbayPartialError as err:
+                    # The missing listings are found again by the next search.
+                    logging.warning('Search task {id}: {err}'
+                                    .format(id=task.id, err=str(err)))
+                    listings_upd = err.listings
+        else:
+            listings_upd = listings_new
+        logging.debug('Search task {id}: skipped {n} known listings.'
+                      .format(id=task.id, n=len(known_ids)))
+        return listings_upd, known_ids
+
+    def store_search_results(self, task, listings_upd, known_ids=()):
+        """
+        Store the listings that were found by a search task in the database.
+        
+        ``known_ids`` are the IDs of found listings, that are already stored.
+        Returns the IDs of all found listings.
+        """
         #Store the listings
-        write_frame(listings_upd, econdata.models.Listing)
+        if len(listings_upd) > 0:
+            with self.measure_stage('write listings'):
+                self.write_listings(listings_upd)
+        listing_ids = list(listings_upd["id"]) + list(known_ids)
 
         # Store which listing has been found by which task
-        found_by = make_data_frame(ListingFoundBy, len(listings_upd))
-        found_by['task'] = task.id
-        found_by['listing'] = listings_upd['id'].values
-        write_frame(found_by, ListingFoundBy, fieldnames=['task', 'listing'], idnames=['task', 'listing'])
+        with self.measure_stage('found by'):
+            found_by = make_data_frame(ListingFoundBy, len(listing_ids))
+            found_by['task'] = task.id
+            found_by['listing'] = listing_ids
+            write_frame_bulk(found_by, ListingFoundBy, 
+                             fieldnames=['task', 'listing'], 
+                             idnames=['task', 'listing'])
+        return listing_ids
 
-        end_time = time.time()
-        delta_sec = end_time - start_time
-        logging.info('Downloaded {num} listings in {dur} sec.'
-                     .format(num=len(listings_upd), dur=delta_sec))
-        return list(listings_upd["id"])
-
-#     def execute_update_task(self, task):
-#         """
-#         Download the complete information of known listings. 
-#         Executes an update task.
-#         Tries to recognize products in updated tasks.
-#         """
-#         assert isinstance(task, UpdateTask)
-#         logging.debug("Executing update task: '{id}'".format(id=task.id))
-#         
-#         #Download the tasks
-#         lst_update = self.data.listings.ix[task.listings]
-#         lst_update = self.connector.update_listings(lst_update)
-#         lst_update["server"] = task.server
-# #        lst_update["final_price"] = True #Use as flag, just to be sure
-#         self.data.merge_listings(lst_update)
-#         
-#         #Recognize products
-#         self.recognizers.recognize_products(lst_update.index, 
-#                                             self.data.listings)
-#         return list(lst_update["id"])
-#         
-#         
-#     def execute_tasks(self):
-#         """
-#         Execute the due tasks in ``self.tasks``.
-#         
-#         Removes single shot tasks.
-#         """
-#         logging.info("Executing due tasks.")
-#         now = datetime.utcnow()
-#         dead_tasks = []
-#         for itask, task in enumerate(self.data.tasks):
-#             #Test is task due
-#             if task.due_time > now:
-#                 continue
-#             
-#             logging.info("Executing task: {}".format(task.id))
-#             #Search for new listings
-#             if isinstance(task, SearchTask):
-#                 self.execute_search_task(task)
-#             #Update known listings
-#             elif isinstance(task, UpdateTask):
-#                 self.execute_update_task(task)
-#             else:
-#                 raise TypeError("Unknown task type:" + str(type(task)) + 
-#                                 "\ntask:\n" + str(task))
-#             
-#             #Mark non-recurrent tasks for removal
-#             if task.recurrence_pattern is None:
-#                 dead_tasks.append(itask)
-#             #Compute new due time for recurrent tasks
-#             else:
-#                 task.due_time = self.compute_next_due_time(
-#                             datetime.utcnow(), task.recurrence_pattern, True)
-# 
-#         #Remove dead (non recurrent) tasks, after they have been executed.
-#         dead_tasks.reverse()
-#         for itask in dead_tasks:
-#             del self.data.tasks[itask]    
-#     
-#     
-#     def create_final_update_tasks(self):
-#         """
-#         Create tasks that update the listing information shortly after the 
-#         auctions end. We want to know the final price of each auction.
-#         20 auctions are updated at once.
-#         """
-#         logging.info("Creating update tasks, to get final prices.")
-#         if len(self.data.listings) == 0:
-#             return
-# 
-#         #Create administration information if it doesn't exist
-#         try:
-#             self.data.listings["final_update_pending"]
-#         except KeyError:
-#             self.data.listings["final_update_pending"] = 0.0
-#         
-#         #Get listings where final price is unknown and 
-#         #    where no final update is pending.
-#         #Note! Three-valued logic: 1., 0., nan
-#         where_no_final = ((self.data.listings["final_price"] != True) &
-#                           (self.data.listings["final_update_pending"] != True))
-#         no_final = self.data.listings[where_no_final]
-#         no_final = no_final.sort("time")
-#         if len(no_final) == 0:
-#             return
-#         
-#         #group listings into groups of 20 (max for Ebay get-items request)
-#         n_group = 20
-#         elem_nums = list(range(len(no_final)))
-#         group_nums =[int(ne / n_group) for ne in elem_nums]
-#         groups = no_final.groupby(group_nums)
-#         
-#         #Create one update task for each group
-#         update_tasks = []
-#         id_start = "update-"
-#         for i, group in groups:
-#             latest_time = group["time"].max()
-#             due_time = latest_time + timedelta(minutes=30)
-#             listing_ids = group["id"]
-#             task = UpdateTask(id=id_start + due_time.isoformat() + "-" + str(i), 
-#                               due_time=due_time, 
-#                               server=None, recurrence_pattern=None, 
-#                               listings=listing_ids)
-# #            print task
-#             update_tasks.append(task)
-#             
-#         self.data.add_tasks(update_tasks)
-#         
-#         #Remember the listings for which update tasks were just created
-#         self.data.listings["final_update_pending"][where_no_final] = True
-# 
-# 
-#     def run_daemon(self, nloops=-1):
-#         """
-#         Simple main loop that downloads listings.
-#         To run a daemon from the command line call::
-#             
-#             CommandLineHandler.daemon_main()
-#         
-#         Parameters
-#         ----------
-#         nloops : int 
-#             Number of cycles in the main loop. -1 means: loop infinitely.
-#         """
-#         #Only load listings from one month in past and one month in future
-#         date_start = datetime.utcnow() - timedelta(days=30)
-#         date_end = datetime.utcnow() + timedelta(days=30)
-#         self.data.read_data(self.data_dir, date_start, date_end)
-#         
-#         self.recognizers.read_recognizers(self.data_dir)
-#         self.create_final_update_tasks()
-#         
-#         while nloops:
-#             #sleep until a task is due
-#             next_due_time, sleep_secs = self.compute_next_wakeup_time()
-#             logging.info("Sleeping until: {}".format(next_due_time))
-#             time.sleep(sleep_secs)
-# 
-#             self.execute_tasks()
-#             self.create_final_update_tasks()
-#             self.data.write_listings()
-#             self.data.write_tasks()
-#             
-#             nloops -= 1
+    def write_listings(self, listings):
+        """
+        Write listings into the database, and mark them as changed.
+        
+        The times of the listings are read before the write; updates can 
+        change the time of a listing. The prices and cached statistics of 
+        the old and of the new intervals are recomputed.
+        """
+        old_times = read_listing_times(listings['id'])
+        write_frame_bulk(listings, econdata.models.Listing)
+        mark_listings_changed(listings['id'], old_times)
+        self.known_listings.add(listings)
+
+    def execute_final_updates(self, now=None):
+        """
+        Download the final information of ended listings, especially the 
+        final prices. Executes the update events, that are due.
+        
+        The due events are found with a single query on the indexed 
+        ``Event.due_time``. The listings of all due events of an Ebay site 
+        are updated together, in batches of 20 listings. Listings that Ebay
+        doesn't return anymore get the status "canceled". The events of 
+        listings, that could not be downloaded or are still active, are 
+        postponed, see ``postpone_final_updates``.
+        
+        Parameters
+        ----------
+        
+        now : datetime
+            Execute the events that are due at this time. 
+            ``None``: use the current time.
+            
+        Returns
+        -------
+        
+        list[str]
+            IDs of the updated listings.
+        """
+        now = now or timezone.now()
+        due = pd.DataFrame(
+                list(Event.objects.filter(listing__isnull=False, 
+                                          due_time__lte=now)
+                                  .values_list('id', 'server', 'attempts', 
+                                               'listing__id', 
+                                               'listing__site', 
+                                               'listing__id_site')),
+                columns=['event', 'server', 'attempts', 'id', 'site', 
+                         'id_site'])
+        if len(due) == 0:
+            return []
+        logging.info("Updating {n} ended listings.".format(n=len(due)))
+        
+        listing_ids = []
+        for server, group in due.groupby('server'):
+            failed = set()
+            try:
+                listings_upd = self.connector.update_listings(
+                                    group[['id', 'site', 'id_site']], server)
+            except EbayPartialError as err:
+                logging.warning('Updating listings from {sid}: {err}'
+                                .format(sid=server, err=str(err)))
+                listings_upd = err.listings
+                failed = set(group.loc[group['id_site'].isin(err.failed_ids), 
+                                       'id'])
+            except Exception as err: #IGNORE:W0703
+                # The events are postponed, the update is repeated later.
+                logging.error('Updating listings from {sid} failed: {err}'
+                              .format(sid=server, err=repr(err)))
+                self.postpone_final_updates(group, now)
+                continue
+            self.write_listings(listings_upd)
+            missing = set(group['id']) - set(listings_upd['id']) - failed
+            self.cancel_listings(missing)
+            # Only the events of finished listings are done. Listings that 
+            # are still active are updated again later, like failures.
+            finished = set(listings_upd.loc[listings_upd['status'].isin(
+                                    KnownListings.final_states), 'id'])
+            is_done = group['id'].isin(finished | missing)
+            self.postpone_final_updates(group[~is_done], now)
+            Event.objects.filter(id__in=list(group.loc[is_done, 'event']))\
+                         .delete()
+            listing_ids += list(listings_upd['id'])
+        
+        return listing_ids
+
+    def postpone_final_updates(self, failed, now):
+        """
+        Postpone the update events of listings that could not be downloaded,
+        or that are still active.
+        
+        Each failure increments ``Event.attempts``, and the event is due again
+        after ``final_update_retry_delay * 2 ** (attempts - 1)`` 
+        (exponential back-off). After ``final_update_max_attempts`` failures
+        the listing gets the status "canceled" and its event is deleted, so 
+        that a listing which Ebay can't deliver doesn't use the call budget 
+        forever.
+        
+        Parameters
+        ----------
+        
+        failed : pd.DataFrame
+            The postponed events, with columns "event", "attempts", "id".
+            
+        now : datetime
+            Time of the failure.
+        """
+        attempts = failed['attempts'] + 1
+        given_up = attempts >= self.final_update_max_attempts
+        if given_up.any():
+            logging.warning('Giving up updating {n} listings after {a} '
+                            'attempts.'.format(n=given_up.sum(), 
+                                               a=self.final_update_max_attempts))
+            self.cancel_listings(failed.loc[given_up, 'id'])
+            Event.objects.filter(id__in=list(failed.loc[given_up, 'event']))\
+                         .delete()
+        retried = failed[~given_up]
+        for n_attempts, group in retried.groupby(attempts[~given_up]):
+            n_attempts = int(n_attempts)
+            delay = self.final_update_retry_delay * 2 ** (n_attempts - 1)
+            Event.objects.filter(id__in=list(group['event']))\
+                         .update(attempts=n_attempts, due_time=now + delay)
 
+    def cancel_listings(self, ids):
+        """Give listings, that can't be updated, the status "canceled"."""
+        ids = list(ids)
+        if not ids:
+            return
+        econdata.models.Listing.objects.filter(id__in=ids)\
+                                       .update(status='canceled')
+        self.known_listings.add(pd.DataFrame({'id': ids, 
+                                              'status': 'canceled'}))
+
+    def execute_tasks(self, now=None):
+        """
+        Execute the due search tasks in ``self.event_heap``.
+        
+        The tasks are executed in parallel by ``self.n_threads`` threads; at
+        most ``self.max_tasks_per_site`` tasks access the same Ebay site at 
+        the same time. The threads only download listings, the results are 
+        stored in the database by the calling thread. 
+        
+        After a task has been executed its event gets a new due time, 
+        see ``compute_next_due_time``. 
+        
+        Parameters
+        ----------
+        
+        now : datetime
+            Execute the events that are due at this time. 
+            ``None``: use the current time.
+            
+        Returns
+        -------
+        
+        list[str]
+            IDs of the listings that were found.
+        """
+        now = now or timezone.now()
+        waiting = deque()
+        while self.event_heap and self.event_heap[0][0] <= now:
+            waiting.append(heapq.heappop(self.event_heap)[2])
+        if not waiting:
+            return []
+        logging.info("Executing {n} due tasks.".format(n=len(waiting)))
+        self.known_listings.refresh()
+        
+        listing_ids = []
+        running = {}
+        n_running_site = defaultdict(int)
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            while waiting or running:
+                # Start waiting tasks, if their site has free capacity.
+                deferred = deque()
+                while waiting and len(running) < self.n_threads:
+                    event = waiting.popleft()
+                    server = event.search_task.server
+                    if n_running_site[server] >= self.max_tasks_per_site:
+                        deferred.append(event)
+                        continue
+                    n_running_site[server] += 1
+                    future = executor.submit(self.download_search_task, 
+                                             event.search_task)
+                    running[future] = event
+                waiting.extendleft(reversed(deferred))
+                
+                # Store the results of the finished tasks.
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    event = running.pop(future)
+                    task = event.search_task
+                    n_running_site[task.server] -= 1
+                    try:
+                        result = future.result()
+                        if result is not None:
+                            listing_ids += self.store_search_results(
+                                                        task, *result)
+                    except Exception as err: #IGNORE:W0703
+                        logging.error('Search task {id} failed: {err}'
+                                      .format(id=task.id, err=repr(err)))
+                    self.reschedule_event(event)
+        
+        return listing_ids
+
+    def reschedule_event(self, event):
+        """Compute the next due time of an event, and put it into the heap."""
+        event.due_time = self.compute_next_due_time(
+                event.due_time, event.search_task.recurrence, timezone.now())
+        event.save(update_fields=['due_time'])
+        heapq.heappush(self.event_heap, (event.due_time, event.id, event))
+
+    def create_final_update_events(self, now=None):
+        """
+        Create events that update the listing information shortly after the 
+        listings end. We want to know the final price of each auction.
+        
+        Listings whose status is not "ended" or "canceled" are put into time 
+        buckets by their end time, ``self.final_update_bucket`` wide. When a 
+        bucket has ended, an update event is created for each of its listings. All 
+        listings of a bucket, from the same Ebay site, are due at the same 
+        time: ``self.final_update_delay`` after the end of the bucket. 
+        Therefore they are downloaded together, in full batches of 20 
+        listings (the maximum for ``GetMultipleItems``).
+        
+        The events also mark the pending updates: listings that have an 
+        event get no second one.
+        
+        Parameters
+        ----------
+        
+        now : datetime
+            Current time. ``None``: use the current time.
+            
+        Returns
+        -------
+        
+        int
+            Number of created events.
+        """
+        now = pd.Timestamp(now or timezone.now())
+        bucket = pd.Timedelta(self.final_update_bucket)
+        bucket_start = now.floor(bucket)
+        time_start = bucket_start - pd.Timedelta(self.final_update_max_age)
+        qset = econdata.models.Listing.objects\
+                .filter(event__isnull=True, time__gte=time_start, 
+                        time__lt=bucket_start)\
+                .exclude(status__in=['ended', 'canceled'])
+        listings = pd.DataFrame(list(qset.values_list('id', 'time')), 
+                                columns=['id', 'time'])
+        if len(listings) == 0:
+            return 0
+        
+        # The Ebay site of the search task that found the listing.
+        task_servers = dict(SearchTask.objects.values_list('id', 'server'))
+        listing_servers = {
+                listing: task_servers.get(task, self.final_update_server)
+                for listing, task in ListingFoundBy.objects
+                        .filter(listing__in=qset.values('id'))
+                        .values_list('listing', 'task')}
+        listings['server'] = listings['id'].map(listing_servers)\
+                                           .fillna(self.final_update_server)
+        listings['time'] = pd.to_datetime(listings['time'], utc=True)
+        listings['due_time'] = listings['time'].dt.floor(bucket) + bucket \
+                               + pd.Timedelta(self.final_update_delay)
+        
+        Event.objects.bulk_create(
+                [Event(due_time=due_time, listing_id=lid, server=server)
+                 for lid, due_time, server 
+                 in zip(listings['id'], listings['due_time'].dt.to_pydatetime(), 
+                        listings['server'])])
+        n_batches = listings.groupby(['server', 'due_time'])['id']\
+                            .count().map(lambda n: math.ceil(n / 20)).sum()
+        logging.info("Created {n} final update events, in {b} batches."
+                     .format(n=len(listings), b=n_batches))
+        return len(listings)
+
+    def run_daemon(self, nloops=-1):
+        """
+        Simple main loop that downloads listings.
+        
+        Parameters
+        ----------
+        nloops : int 
+            Number of cycles in the main loop. -1 means: loop infinitely.
+        """
+        while nloops:
+            self.read_events()
+            self.execute_tasks()
+            self.create_final_update_events()
+            self.execute_final_updates()
+            logging.info('Ebay API usage: {}'.format(self.connector.metrics()))
+            
+            #sleep until a task is due
+            next_due_time, sleep_secs = self.compute_next_wakeup_time()
+            logging.info("Sleeping until: {}".format(next_due_time))
+            time.sleep(sleep_secs)
+            
+            nloops -= 1
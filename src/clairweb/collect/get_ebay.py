@@ -28,6 +28,11 @@ import os.path
 import math
 import json
 import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pprint import pformat
 
@@ -35,7 +40,9 @@ import pandas as pd
 from ebaysdk.finding import Connection as FConnection
 from ebaysdk.shopping import Connection as SConnection
 import ebaysdk.exception
+import requests
 import requests.exceptions
+from requests.adapters import HTTPAdapter
 
 from libclair.dataframes import make_data_frame
 from libclair.textprocessing import HtmlTool
@@ -47,6 +54,25 @@ class EbayError(Exception):
     pass
 
 
+class EbayPartialError(EbayError):
+    """
+    Some batches of listings could not be downloaded from Ebay.
+    
+    Attributes
+    ----------
+    
+    listings : pandas.DataFrame
+        The listings that were downloaded successfully.
+        
+    failed_ids : list[str]
+        Ebay's IDs (``id_site``) of the listings that could not be downloaded.
+    """
+    def __init__(self, message, listings, failed_ids):
+        super().__init__(message)
+        self.listings = listings
+        self.failed_ids = failed_ids
+
+
 def to_str_list(list_or_str):
     """
     Convert list of strings to long comma separated string.
@@ -61,6 +87,463 @@ def to_str_list(list_or_str):
 
 
 
+def make_listings_frame(rows):
+    """
+    Create a ``pandas.DataFrame`` of listings from a list of rows.
+    
+    Each row is a ``dict`` ``{column_label: value}``. Missing values get the 
+    column's default value. The values are accumulated column by column, and
+    each column is put into the data frame in one step.
+    """
+    listings = make_data_frame(Listing, len(rows))
+    columns = {}
+    for i, row in enumerate(rows):
+        for col, value in row.items():
+            if col not in columns:
+                columns[col] = listings[col].tolist()
+            columns[col][i] = value
+    for col, values in columns.items():
+        listings[col] = values
+    return listings
+
+
+class RateLimiter(object):
+    """
+    Limit the rate of calls to a remote API with a token bucket. Thread safe.
+    
+    ``wait`` blocks until the next call is allowed. The bucket is refilled 
+    with ``calls_per_second`` tokens per second, and holds at most ``burst``
+    tokens; each call takes one token. With ``burst=1`` the calls are spaced
+    at least ``1 / calls_per_second`` seconds apart.
+    
+    The rate adapts to the server: ``slow_down`` halves the rate when the 
+    server is overloaded, ``speed_up`` increases it again after each 
+    successful call, up to the configured rate.
+    
+    Limiters can be nested: a call must wait for the ``parent`` limiter too. 
+    For example the limiters of all Ebay sites share the limiter of the 
+    application key.
+    
+    Parameters
+    ----------
+    
+    calls_per_second : float
+        Maximum number of calls per second. ``None``: no limit.
+        
+    burst : int
+        Maximum number of calls, that can be made without waiting.
+        
+    parent : RateLimiter
+        Limiter that is checked before this limiter. ``None``: no parent.
+        
+    timer : function
+        Returns the current time in seconds. For testing.
+        
+    sleep : function
+        Waits for a number of seconds. For testing.
+    """
+    decrease_factor = 0.5
+    "The rate is multiplied by this factor when the server is overloaded."
+    increase_fraction = 0.02
+    "Fraction of the maximum rate, that is added after a successful call."
+    min_fraction = 0.05
+    "The rate is never reduced below this fraction of the maximum rate."
+
+    def __init__(self, calls_per_second=None, burst=1, parent=None, 
+                 timer=time.monotonic, sleep=time.sleep):
+        assert isinstance(calls_per_second, (float, int, type(None)))
+        assert isinstance(burst, int) and burst >= 1
+        assert isinstance(parent, (RateLimiter, type(None)))
+        self.max_calls_per_second = calls_per_second
+        self.calls_per_second = calls_per_second
+        self.burst = burst
+        self.parent = parent
+        self.timer = timer
+        self.sleep = sleep
+        self._tokens = burst
+        self._last_time = None
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Wait until the next call is allowed."""
+        if self.parent is not None:
+            self.parent.wait()
+        if not self.calls_per_second:
+            return
+        with self._lock:
+            now = self.timer()
+            if self._last_time is not None:
+                self._tokens = min(self.burst, self._tokens + 
+                                   (now - self._last_time) * self.calls_per_second)
+            self._last_time = now
+            # A negative number of tokens reserves future calls.
+            self._tokens -= 1
+            wait_time = max(-self._tokens / self.calls_per_second, 0.)
+        if wait_time > 0:
+            self.sleep(wait_time)
+
+    def slow_down(self):
+        """Reduce the rate, because the server is overloaded."""
+        if not self.max_calls_per_second:
+            return
+        with self._lock:
+            self.calls_per_second = max(
+                        self.calls_per_second * self.decrease_factor, 
+                        self.max_calls_per_second * self.min_fraction)
+
+    def speed_up(self):
+        """Increase the rate a little, after a successful call."""
+        if not self.max_calls_per_second:
+            return
+        with self._lock:
+            self.calls_per_second = min(
+                        self.calls_per_second + 
+                        self.max_calls_per_second * self.increase_fraction,
+                        self.max_calls_per_second)
+
+
+class CallBudget(object):
+    """
+    Count the calls to Ebay's API, and limit their total number. Thread safe.
+    
+    Ebay limits the number of calls per application and day. All connectors
+    of an application should share one budget. Failed calls and retries 
+    are counted too; they consume the quota like successful calls.
+    
+    The budget is reset automatically when a new period starts. Periods 
+    start at multiples of ``period`` seconds since the epoch; for days this
+    is midnight UTC.
+    
+    Parameters
+    ----------
+    
+    max_calls : int
+        Maximum number of calls per period. ``None``: no limit.
+        
+    period : float
+        Length of a period in seconds. Default: one day.
+        
+    timer : function
+        Returns the current time in seconds since the epoch. For testing.
+    """
+    def __init__(self, max_calls=None, period=24 * 60 * 60., timer=time.time):
+        assert isinstance(max_calls, (int, type(None)))
+        assert isinstance(period, (int, float)) and period > 0
+        self.max_calls = max_calls
+        self.period = period
+        self.timer = timer
+        self.n_calls = 0
+        self.n_errors = 0
+        self.n_retries = 0
+        self._period_index = self._current_period()
+        self._lock = threading.Lock()
+
+    def _current_period(self):
+        return math.floor(self.timer() / self.period)
+
+    def _roll_over(self):
+        """Reset the counters if a new period has started. Needs the lock."""
+        period_index = self._current_period()
+        if period_index != self._period_index:
+            self._period_index = period_index
+            self.n_calls = 0
+            self.n_errors = 0
+            self.n_retries = 0
+
+    def spend(self):
+        """
+        Record one call. Raises ``EbayError`` when the budget is exhausted.
+        """
+        with self._lock:
+            self._roll_over()
+            if self.max_calls is not None and self.n_calls >= self.max_calls:
+                raise EbayError('Budget of {} calls to Ebay is exhausted.'
+                                .format(self.max_calls))
+            self.n_calls += 1
+
+    def record_error(self, is_retried):
+        """Record a failed call, and whether it is repeated."""
+        with self._lock:
+            self._roll_over()
+            self.n_errors += 1
+            self.n_retries += int(is_retried)
+
+    def n_remaining(self):
+        """Return the number of remaining calls. ``None``: no limit."""
+        with self._lock:
+            self._roll_over()
+            if self.max_calls is None:
+                return None
+            return max(self.max_calls - self.n_calls, 0)
+
+    def reset(self):
+        """Start a new period with the full budget."""
+        with self._lock:
+            self._period_index = self._current_period()
+            self.n_calls = 0
+            self.n_errors = 0
+            self.n_retries = 0
+
+
+class RetryPolicy(object):
+    """
+    Decide which failed calls to Ebay are repeated, and how long to wait.
+    
+    Network errors, and the HTTP status codes in ``retryable_status`` are 
+    transient; these calls are repeated up to ``max_retries`` times. The 
+    delay before retry ``i`` is random between 0 and 
+    ``base_delay * 2**i`` seconds (exponential backoff with full jitter), 
+    but at most ``max_delay`` seconds.
+    
+    Parameters
+    ----------
+    
+    max_retries : int
+        Maximum number of times a call is repeated.
+        
+    base_delay : float
+        Maximum delay before the first retry, in seconds.
+        
+    max_delay : float
+        Maximum delay before any retry, in seconds.
+    """
+    retryable_status = {429, 500, 502, 503, 504}
+    "HTTP status codes of transient errors."
+    throttle_status = {429, 503}
+    "HTTP status codes that show that the server is overloaded."
+
+    def __init__(self, max_retries=3, base_delay=1., max_delay=60.):
+        assert isinstance(max_retries, int) and max_retries >= 0
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def status_code(err):
+        """Return the HTTP status code of an error. ``None``: no response."""
+        return getattr(getattr(err, 'response', None), 'status_code', None)
+
+    def is_retryable(self, err):
+        """Return ``True`` if the failed call should be repeated."""
+        status = self.status_code(err)
+        return status is None or status in self.retryable_status
+
+    def is_throttled(self, err):
+        """Return ``True`` if the server is overloaded."""
+        return self.status_code(err) in self.throttle_status
+
+    def delay(self, i_retry):
+        """Return the random delay before retry number ``i_retry`` (from 0)."""
+        return random.uniform(0, min(self.base_delay * 2**i_retry, 
+                                     self.max_delay))
+
+
+def call_ebay_api(connection_pool, api_name, ebay_site, verb, data, 
+                  rate_limiter, call_budget, retry_policy):
+    """
+    Call a function of Ebay's API, and repeat the call on transient errors.
+    
+    Every attempt waits for ``rate_limiter``, and is counted by 
+    ``call_budget``. When the server is overloaded, the rate limiter slows 
+    down. Raises the error of the last attempt, when all attempts failed.
+    
+    Returns
+    -------
+    
+    ebaysdk.response.Response
+    """
+    for i_retry in range(retry_policy.max_retries + 1):
+        call_budget.spend()
+        rate_limiter.wait()
+        try:
+            with connection_pool.connection(api_name, ebay_site) as api:
+                response = api.execute(verb, data)
+        except (ebaysdk.exception.ConnectionError, 
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as err:
+            is_retried = i_retry < retry_policy.max_retries and \
+                         retry_policy.is_retryable(err)
+            call_budget.record_error(is_retried)
+            if retry_policy.is_throttled(err):
+                rate_limiter.slow_down()
+            if not is_retried:
+                raise
+            delay = retry_policy.delay(i_retry)
+            logging.warning('Calling {verb} on {site} failed, retry in '
+                            '{d:.1f} sec. Error: {err}'
+                            .format(verb=verb, site=ebay_site, d=delay, 
+                                    err=str(err)))
+            time.sleep(delay)
+        else:
+            rate_limiter.speed_up()
+            return response
+
+
+def create_connection(connection_class, keyfile, ebay_site, options):
+    """
+    Create a connection object of the ``ebaysdk`` library.
+    
+    ``options`` are additional arguments for the connection, for example 
+    ``{'domain': 'localhost:8080', 'https': False}`` to connect to a local 
+    test server. ``https`` must be set after the creation, because the 
+    finding API's connection ignores the argument.
+    """
+    options = dict(options or {})
+    https = options.pop('https', None)
+    api = connection_class(config_file=keyfile, siteid=ebay_site, **options)
+    if https is not None:
+        api.config.set('https', https, force=True)
+    return api
+
+
+class KeepAliveSession(requests.Session):
+    """
+    HTTP session that keeps its sockets open.
+    
+    The connections of ``ebaysdk`` close their session after every request; 
+    this session ignores ``close``. Call ``shutdown`` to really close it.
+    """
+    def close(self):
+        pass
+    
+    def shutdown(self):
+        """Close the session and its sockets."""
+        super().close()
+
+
+class ConnectionPool(object):
+    """
+    Pool of reusable connections to Ebay's APIs. Thread safe.
+    
+    The connections are objects of the ``ebaysdk`` library; one connection 
+    can only be used by one thread at a time. The pool keeps up to 
+    ``pool_size`` idle connections for each API and Ebay site. The 
+    connections keep their HTTP sockets open (keep-alive), so that 
+    subsequent calls don't need to open new (TLS) connections.
+    
+    Health checks: Connections that raised an error are closed. Connections
+    that were idle for longer than ``max_idle_time`` are closed too, because
+    the server has likely closed their sockets.
+    
+    Parameters
+    ----------
+    
+    keyfile : str
+        Name of the configuration file for the ``python-ebay`` library,
+        that contains the (secret) access keys for the Ebay API.
+        
+    connection_options : dict
+        Additional arguments for the ``ebaysdk`` connections. 
+        See ``create_connection``.
+        
+    pool_size : int
+        Maximum number of idle connections for each API and site.
+        
+    max_idle_time : float
+        Idle connections are closed after this time, in seconds.
+        
+    timer : function
+        Returns the current time in seconds. For testing.
+    """
+    connection_classes = {'finding': FConnection, 'shopping': SConnection}
+    "The APIs, and their connection classes."
+
+    def __init__(self, keyfile, connection_options=None, pool_size=10, 
+                 max_idle_time=30., timer=time.monotonic):
+        assert isinstance(keyfile, (str, type(None)))
+        assert isinstance(connection_options, (dict, type(None)))
+        assert isinstance(pool_size, int) and pool_size >= 1
+        
+        self.keyfile = keyfile
+        self.connection_options = connection_options
+        self.pool_size = pool_size
+        self.max_idle_time = max_idle_time
+        self.timer = timer
+        self.n_created = 0
+        # {(api_name, ebay_site): [(connection, time_returned), ...]}
+        self._idle = {}
+        self._lock = threading.Lock()
+    
+    def create(self, api_name, ebay_site):
+        """Create a new connection with a keep-alive HTTP session."""
+        api = create_connection(self.connection_classes[api_name], 
+                                self.keyfile, ebay_site, 
+                                self.connection_options)
+        session = KeepAliveSession()
+        # No retries of the transport layer: ``RetryPolicy`` repeats failed 
+        # calls, and counts them.
+        session.mount('http://', HTTPAdapter(max_retries=0))
+        session.mount('https://', HTTPAdapter(max_retries=0))
+        api.session = session
+        with self._lock:
+            self.n_created += 1
+        return api
+    
+    def get(self, api_name, ebay_site):
+        """
+        Take a connection out of the pool. Creates a new connection if there 
+        is no healthy idle connection.
+        """
+        assert api_name in self.connection_classes
+        expired = []
+        api = None
+        with self._lock:
+            idle = self._idle.get((api_name, ebay_site), [])
+            while idle:
+                api_idle, time_returned = idle.pop()
+                if self.timer() - time_returned <= self.max_idle_time:
+                    api = api_idle
+                    break
+                expired.append(api_idle)
+        for api_idle in expired:
+            api_idle.session.shutdown()
+        if api is None:
+            api = self.create(api_name, ebay_site)
+        return api
+    
+    def put(self, api_name, ebay_site, api):
+        """Return a connection to the pool."""
+        with self._lock:
+            idle = self._idle.setdefault((api_name, ebay_site), [])
+            if len(idle) < self.pool_size:
+                idle.append((api, self.timer()))
+                return
+        api.session.shutdown()
+    
+    @contextmanager
+    def connection(self, api_name, ebay_site):
+        """
+        Context manager that lends a connection from the pool. The connection
+        is closed if an exception is raised; it is returned to the pool 
+        otherwise.
+        
+        Usage::
+        
+            with pool.connection('shopping', 'EBAY-US') as api:
+                response = api.execute(...)
+        """
+        api = self.get(api_name, ebay_site)
+        try:
+            yield api
+        except BaseException:
+            api.session.shutdown()
+            raise
+        self.put(api_name, ebay_site, api)
+    
+    def n_idle(self, api_name, ebay_site):
+        """Return the number of idle connections for an API and site."""
+        with self._lock:
+            return len(self._idle.get((api_name, ebay_site), []))
+    
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for api, _ in connections:
+                api.session.shutdown()
+
+
 class EbayFindingAPIConnector(object):
     """
     Abstraction for Ebay's finding API. 
@@ -93,16 +576,39 @@ class EbayFindingAPIConnector(object):
     ebay_name : str
         String that will be put into the ``df['site']`` field of the dataframe. 
         For example ``'ebay'``.
+        
+    n_threads : int
+        Number of pages that are downloaded in parallel.
+        
+    rate_limiter : RateLimiter
+        Limits the rate of calls to Ebay. ``None``: no limit.
+        
+    connection_pool : ConnectionPool
+        Supplies the connections to Ebay. ``None``: create a private pool.
+        
+    call_budget : CallBudget
+        Counts the calls to Ebay, and limits their number.
+        
+    retry_policy : RetryPolicy
+        Decides which failed calls are repeated.
     """
-    def __init__(self, keyfile, ebay_site, ebay_name):
+    def __init__(self, keyfile, ebay_site, ebay_name, n_threads=1, 
+                 rate_limiter=None, connection_pool=None, call_budget=None,
+                 retry_policy=None):
         assert isinstance(keyfile, (str, type(None)))
         assert os.path.isfile(keyfile) 
         assert isinstance(ebay_site, str)
         assert isinstance(ebay_name, str)
+        assert isinstance(n_threads, int) and n_threads >= 1
 
         self.keyfile = keyfile
         self.ebay_site = ebay_site
         self.ebay_name = ebay_name
+        self.n_threads = n_threads
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.connection_pool = connection_pool or ConnectionPool(keyfile)
+        self.call_budget = call_budget or CallBudget()
+        self.retry_policy = retry_policy or RetryPolicy()
 
     def find_listings(self, keywords, n_listings, 
                       price_min=None, price_max=None, currency="USD",
@@ -126,8 +632,11 @@ class EbayFindingAPIConnector(object):
             Number of listings that Ebay should return. Might return fewer or
             slightly more listings.
             
-            Currently limited to 100 listings, the maximum number of listings 
-            in one page.
+            Ebay returns at most 100 listings per page. The first page is 
+            downloaded alone, it contains the number of available pages. 
+            The remaining pages are downloaded by ``self.n_threads`` threads 
+            in parallel. If one of the remaining pages can't be downloaded, 
+            the listings of the other pages are returned.
             
         price_min : float
             Minimum price for listings, that are returned.
@@ -176,19 +685,46 @@ class EbayFindingAPIConnector(object):
         n_pages = math.ceil(n_listings / max_per_page)
         n_per_page = round(n_listings / n_pages)
         
-        # Call Ebay repeatedly and concatenate results
-        listings = make_data_frame(Listing, 0)
-        for i_page in range(1, int(n_pages + 1)):
+        def get_page(i_page):
             resp = self._call_find_api(keywords, n_per_page, i_page,
                                         price_min, price_max, currency, 
                                         time_from, time_to)
-            listings_part = self._parse_find_response(resp)
-            # Stop searching when Ebay returns an empty result.
-            if len(listings_part) == 0:
-                break
-            listings = listings.append(listings_part, ignore_index=True,
-                                       verify_integrity=False)
-
+            return resp, self._parse_find_response(resp)
+        
+        def get_page_partial(i_page):
+            # Keep the other pages, if a page fails.
+            try:
+                return get_page(i_page)
+            except EbayError as err:
+                logging.warning('Skipping page {p} of search "{kw}": {err}'
+                                .format(p=i_page, kw=keywords, err=str(err)))
+                return None, make_data_frame(Listing, 0)
+        
+        # The first page contains the number of available pages.
+        resp, listings_part = get_page(1)
+        listings_parts = [make_data_frame(Listing, 0), listings_part]
+        try:
+            n_pages = min(n_pages, int(resp['paginationOutput']['totalPages']))
+        except (KeyError, TypeError, ValueError):
+            logging.debug('Missing field "paginationOutput.totalPages".')
+        
+        # Download the remaining pages in parallel.
+        pages = range(2, int(n_pages + 1))
+        if len(listings_part) == 0:
+            pages = []
+        if self.n_threads > 1 and len(pages) > 1:
+            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                listings_parts += [part for _, part in 
+                                   executor.map(get_page_partial, pages)]
+        else:
+            for i_page in pages:
+                resp, listings_part = get_page_partial(i_page)
+                # Stop searching when Ebay returns an empty result.
+                if resp is not None and len(listings_part) == 0:
+                    break
+                listings_parts.append(listings_part)
+
+        listings = pd.concat(listings_parts, ignore_index=True)
         return listings
 
     def _call_find_api(self, keywords, n_per_page, i_page,
@@ -226,18 +762,22 @@ class EbayFindingAPIConnector(object):
             itemFilters += [{'name': 'EndTimeTo', 
                              'value': time_to.strftime("%Y-%m-%dT%H:%M:%S.000Z")}]
         try:
-            api = FConnection(config_file=self.keyfile, siteid=self.ebay_site)
-            response = api.execute('findItemsAdvanced', 
-                                   {'keywords': keywords, 'descriptionSearch': 'true',
-                                    'paginationInput': {'entriesPerPage': n_per_page,
-                                                        'pageNumber': i_page},
-                                    'itemFilter': itemFilters,
-                                    })
+            response = call_ebay_api(
+                        self.connection_pool, 'finding', self.ebay_site, 
+                        'findItemsAdvanced', 
+                        {'keywords': keywords, 'descriptionSearch': 'true',
+                         'paginationInput': {'entriesPerPage': n_per_page,
+                                             'pageNumber': i_page},
+                         'itemFilter': itemFilters,
+                         },
+                        self.rate_limiter, self.call_budget, self.retry_policy)
         except (ebaysdk.exception.ConnectionError, 
-                requests.exceptions.ConnectionError)  as err:
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout)  as err:
             err_text = 'Finding items on Ebay failed! Error: ' + str(err)
             logging.error(err_text)
-            logging.debug(err.response.dict())
+            if isinstance(err, ebaysdk.exception.ConnectionError):
+                logging.debug(err.response.dict())
             raise EbayError(err_text)
 
 #         #TODO: react on the following status information
@@ -271,61 +811,66 @@ class EbayFindingAPIConnector(object):
         https://developer.ebay.com/devzone/finding/CallRef/findItemsAdvanced.html#Output
         """
 #         pprint(resp_dict)
-        eb_items = resp_dict['searchResult']['item']
-        listings = make_data_frame(Listing, len(eb_items))
-        for i, item in enumerate(eb_items):
+        # Empty results have no field "item".
+        eb_items = resp_dict['searchResult'].get('item', [])
+        rows = []
+        for item in eb_items:
+            # Fields are collected in ``row`` until an error occurs.
+            row = {}
+            rows.append(row)
             try:
                 "The ID that uniquely identifies the item listing."
                 eb_id = item['itemId']
 #                 print('itemId: ' + eb_id)
-                listings.loc[i, 'id_site'] = eb_id
-                listings.loc[i, 'title'] = item['title']
-                listings.loc[i, 'item_url'] = item['viewItemURL']
+                row['id_site'] = eb_id
+                row['title'] = item['title']
+                row['item_url'] = item['viewItemURL']
                 # https://developer.ebay.com/devzone/finding/CallRef/Enums/conditionIdList.html
-                listings.loc[i, 'condition'] = self.convert_condition(item['condition']['conditionId'])
-                listings.loc[i, 'time'] = pd.Timestamp(item['listingInfo']['endTime']).to_datetime64()
+                row['condition'] = self.convert_condition(item['condition']['conditionId'])
+                row['time'] = pd.Timestamp(item['listingInfo']['endTime']).to_datetime64()
                 # String describing location. For example: 'Pensacola,FL,USA'.
-                listings.loc[i, 'location'] = item['location']
+                row['location'] = item['location']
                 # ISO currency codes. https://en.wikipedia.org/wiki/ISO_4217
                 # EUR: Euro; GBP: British Pound; USD: US Dollar. 
-                listings.loc[i, 'currency'] = item_currency = item['sellingStatus']['convertedCurrentPrice']['_currencyId']
-                listings.loc[i, 'price'] = item['sellingStatus']['convertedCurrentPrice']['value']
+                row['currency'] = item_currency = item['sellingStatus']['convertedCurrentPrice']['_currencyId']
+                row['price'] = item['sellingStatus']['convertedCurrentPrice']['value']
                 try:
                     # https://en.wikipedia.org/wiki/ISO_3166-1_alpha-2
                     # List of country codes, to which the item can be delivered. For example: 
                     # ['US', 'CA', 'GB', 'AU', 'NO'] or 'Worldwide' or 'US'.
-                    listings.loc[i, 'shipping_locations'] = to_str_list(item['shippingInfo']['shipToLocations'])
+                    row['shipping_locations'] = to_str_list(item['shippingInfo']['shipToLocations'])
                     eb_shipping_currency = item['shippingInfo']['shippingServiceCost']['_currencyId']
                     assert eb_shipping_currency == item_currency, \
                             'Prices in a listing must be of the same currency.'
-                    listings.loc[i, 'shipping_price'] = item['shippingInfo']['shippingServiceCost']['value']
+                    row['shipping_price'] = item['shippingInfo']['shippingServiceCost']['value']
                 except KeyError as err:
                     logging.debug('Missing field in "shippingInfo": ' + str(err))
 
                 # https://developer.ebay.com/devzone/finding/CallRef/types/ItemFilterType.html
-                listings.loc[i, 'listing_type'] = ltype = self.convert_listing_type(item['listingInfo']['listingType'])
+                row['listing_type'] = ltype = self.convert_listing_type(item['listingInfo']['listingType'])
                 # https://developer.ebay.com/devzone/finding/CallRef/types/SellingStatus.html
                 sstate_raw = item['sellingStatus']['sellingState']
-                listings.loc[i, 'status'] = sstate = self.convert_selling_state(sstate_raw)
+                row['status'] = sstate = self.convert_selling_state(sstate_raw)
 
                 if ltype in ['fixed-price', 'classified']:
-                    listings.loc[i, 'is_real'] = True
+                    row['is_real'] = True
                 elif ltype == 'auction' and sstate == 'ended':
-                    listings.loc[i, 'is_real'] = True
+                    row['is_real'] = True
                 else:
-                    listings.loc[i, 'is_real'] = False
+                    row['is_real'] = False
                 
                 if sstate_raw == 'EndedWithSales':
-                    listings.loc[i, 'is_sold'] = True
+                    row['is_sold'] = True
                 elif sstate_raw == 'EndedWithoutSales':
-                    listings.loc[i, 'is_sold'] = False
+                    row['is_sold'] = False
                 else:
-                    listings.loc[i, 'is_sold'] = None
+                    row['is_sold'] = None
 
             except (KeyError, AssertionError) as err:
                 logging.error('Error while parsing Ebay find result: ' + repr(err))
                 logging.debug(pformat(item))
 
+        listings = make_listings_frame(rows)
         listings['site'] = self.ebay_name
         return listings
 
@@ -477,16 +1022,39 @@ class EbayShoppingAPIConnector(object):
     ebay_name : str
         String that will be put into the ``df['site']`` field of the dataframe. 
         For example ``'ebay'``.
+        
+    n_threads : int
+        Number of batches of 20 listings that are downloaded in parallel.
+        
+    rate_limiter : RateLimiter
+        Limits the rate of calls to Ebay. ``None``: no limit.
+        
+    connection_pool : ConnectionPool
+        Supplies the connections to Ebay. ``None``: create a private pool.
+        
+    call_budget : CallBudget
+        Counts the calls to Ebay, and limits their number.
+        
+    retry_policy : RetryPolicy
+        Decides which failed calls are repeated.
     """
-    def __init__(self, keyfile, ebay_site, ebay_name):
+    def __init__(self, keyfile, ebay_site, ebay_name, n_threads=1, 
+                 rate_limiter=None, connection_pool=None, call_budget=None,
+                 retry_policy=None):
         assert isinstance(keyfile, (str, type(None)))
         assert os.path.isfile(keyfile) 
         assert isinstance(ebay_site, str)
         assert isinstance(ebay_name, str)
+        assert isinstance(n_threads, int) and n_threads >= 1
 
         self.keyfile = keyfile
         self.ebay_site = ebay_site
         self.ebay_name = ebay_name
+        self.n_threads = n_threads
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.connection_pool = connection_pool or ConnectionPool(keyfile)
+        self.call_budget = call_budget or CallBudget()
+        self.retry_policy = retry_policy or RetryPolicy()
 
     def update_listings(self, listings, ebay_site):
         """
@@ -495,6 +1063,11 @@ class EbayShoppingAPIConnector(object):
         Retrieves all columns in listing (as opposed to 
         ``EbayFindingAPIConnector.find_listings``.)
         
+        Ebay returns 20 listings per call. These batches are downloaded 
+        by ``self.n_threads`` threads in parallel. If some batches can't be
+        downloaded, ``EbayPartialError`` is raised, which contains the 
+        listings of the other batches.
+        
         Argument
         --------
         
@@ -521,14 +1094,37 @@ class EbayShoppingAPIConnector(object):
         # Remove duplicate IDs
         ids = list(set(ids))
       
-        # Download information in chunks of 20 listings.
-        listings = make_data_frame(Listing, 0)
-        for i_start in range(0, len(ids), 20):
-            resp = self._call_shopping_api(ids[i_start:i_start + 20], ebay_site)
-            listings_part = self._parse_shopping_response(resp)
-            listings = listings.append(listings_part, ignore_index=True,
-                                       verify_integrity=False)
+        # Download information in batches of 20 listings.
+        batches = [ids[i_start:i_start + 20] 
+                   for i_start in range(0, len(ids), 20)]
+        def get_batch(batch_ids):
+            # Keep the other batches, if a batch fails.
+            try:
+                resp = self._call_shopping_api(batch_ids, ebay_site)
+                return self._parse_shopping_response(resp), None
+            except EbayError as err:
+                return None, err
+        
+        if self.n_threads > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                results = list(executor.map(get_batch, batches))
+        else:
+            results = [get_batch(batch_ids) for batch_ids in batches]
         
+        listings_parts = [make_data_frame(Listing, 0)]
+        listings_parts += [part for part, _ in results if part is not None]
+        listings = pd.concat(listings_parts, ignore_index=True)
+        
+        errors = [err for _, err in results if err is not None]
+        if errors and len(errors) == len(batches):
+            raise errors[0]
+        elif errors:
+            failed_ids = [id_ for batch_ids, (_, err) in zip(batches, results) 
+                          if err is not None for id_ in batch_ids]
+            raise EbayPartialError(
+                    '{n} of {m} batches failed. Error: {err}'
+                    .format(n=len(errors), m=len(batches), err=str(errors[0])),
+                    listings, failed_ids)
         return listings
 
     def _call_shopping_api(self, ids, ebay_site):
@@ -536,16 +1132,20 @@ class EbayShoppingAPIConnector(object):
         Call Ebay's shopping API to get complete information about a listing. 
         """
         try:
-            api = SConnection(config_file=self.keyfile, siteid=ebay_site)
-            response = api.execute('GetMultipleItems', 
-                                   {'IncludeSelector': 'Description,Details,ItemSpecifics,ShippingCosts',
-                                    'ItemID': ids})
+            response = call_ebay_api(
+                        self.connection_pool, 'shopping', ebay_site, 
+                        'GetMultipleItems', 
+                        {'IncludeSelector': 'Description,Details,ItemSpecifics,ShippingCosts',
+                         'ItemID': ids},
+                        self.rate_limiter, self.call_budget, self.retry_policy)
         except (ebaysdk.exception.ConnectionError, 
-                requests.exceptions.ConnectionError) as err:
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as err:
             err_text = 'Downloading full item information from Ebay failed! ' \
                        'Error: ' + str(err)
             logging.error(err_text)
-            logging.debug(err.response.dict())
+            if isinstance(err, ebaysdk.exception.ConnectionError):
+                logging.debug(err.response.dict())
             raise EbayError(err_text)
 
 #         #TODO: react on the following status information
@@ -580,38 +1180,44 @@ class EbayShoppingAPIConnector(object):
         """
 #         pprint(resp)
         items = resp['Item']
-        listings = make_data_frame(Listing, len(items))
-        for i, item in enumerate(items):
+        # A response with a single item contains no list.
+        if isinstance(items, dict):
+            items = [items]
+        rows = []
+        for item in items:
+            # Fields are collected in ``row`` until an error occurs.
+            row = {}
+            rows.append(row)
             try:
                 # ID --------------------------------------------------
-                listings.loc[i, 'id_site'] = item['ItemID']
+                row['id_site'] = item['ItemID']
                 # Product description --------------------------------------------------
-                listings.loc[i, 'title'] = item['Title']
-                listings.loc[i, 'description'] = HtmlTool.to_nice_text(item['Description'])
+                row['title'] = item['Title']
+                row['description'] = HtmlTool.to_nice_text(item['Description'])
                 try:
-                    listings.loc[i, 'prod_spec'] = self.convert_ItemSpecifics(item['ItemSpecifics'])
+                    row['prod_spec'] = self.convert_ItemSpecifics(item['ItemSpecifics'])
                 except KeyError as err:
                     logging.debug("Missing field 'ItemSpecifics': " + str(err))
-                listings.loc[i, 'condition'] = self.convert_condition(item['ConditionID'])
+                row['condition'] = self.convert_condition(item['ConditionID'])
                 # Price -----------------------------------------------------------
-                listings.loc[i, 'time'] = pd.Timestamp(item['EndTime']).to_datetime64()
-                listings.loc[i, 'currency'] = item['ConvertedCurrentPrice']['_currencyID']
-                listings.loc[i, 'price'] = item['ConvertedCurrentPrice']['value']
+                row['time'] = pd.Timestamp(item['EndTime']).to_datetime64()
+                row['currency'] = item['ConvertedCurrentPrice']['_currencyID']
+                row['price'] = item['ConvertedCurrentPrice']['value']
                 try:
-                    listings.loc[i, 'shipping_price'] = item['ShippingCostSummary']['ShippingServiceCost']['value']
+                    row['shipping_price'] = item['ShippingCostSummary']['ShippingServiceCost']['value']
                     shipping_currency = item['ShippingCostSummary']['ShippingServiceCost']['_currencyID']
-                    assert shipping_currency == listings.loc[i, 'currency'], \
+                    assert shipping_currency == row['currency'], \
                             'Prices in a listing must be of the same currency.'
                 except KeyError as err:
                     logging.debug("Missing field in 'ShippingCostSummary': " + str(err))
                 # Listing Data -----------------------------------------------------------
-                listings.loc[i, 'location'] = item['Location'] + ', ' + item['Country']
-                listings.loc[i, 'shipping_locations'] = to_str_list(item['ShipToLocations'])
-                listings.loc[i, 'seller'] = item['Seller']['UserID']
-                listings.loc[i, 'item_url'] = item['ViewItemURLForNaturalSearch']
+                row['location'] = item['Location'] + ', ' + item['Country']
+                row['shipping_locations'] = to_str_list(item['ShipToLocations'])
+                row['seller'] = item['Seller']['UserID']
+                row['item_url'] = item['ViewItemURLForNaturalSearch']
                 # Status values -----------------------------------------------------------
-                listings.loc[i, 'status'] = status = self.convert_listing_status_shp(item['ListingStatus'])
-                listings.loc[i, 'listing_type'] = lstype = self.convert_listing_type_shp(item['ListingType'])
+                row['status'] = status = self.convert_listing_status_shp(item['ListingStatus'])
+                row['listing_type'] = lstype = self.convert_listing_type_shp(item['ListingType'])
                 quantitySold = int(item['QuantitySold'])
                 
                 # is_real - If True: One could really buy the item for this price.
@@ -621,7 +1227,7 @@ class EbayShoppingAPIConnector(object):
                     is_real = True
                 else:
                     is_real = False
-                listings.loc[i, 'is_real'] = is_real
+                row['is_real'] = is_real
 
                 # is_sold - Successful sale if ``True``.
                 if lstype == 'fixed-price' and quantitySold >= 1:
@@ -630,11 +1236,11 @@ class EbayShoppingAPIConnector(object):
                     is_sold = True
                 else:
                     is_sold = False
-                listings.loc[i, 'is_sold'] = is_sold
+                row['is_sold'] = is_sold
 
                 if is_sold:
                     try:
-                        listings.loc[i, 'buyer'] = item['HighBidder']['UserID']
+                        row['buyer'] = item['HighBidder']['UserID']
                     except KeyError as err:
                         logging.debug("Missing field in 'HighBidder': " + str(err))
 
@@ -642,8 +1248,8 @@ class EbayShoppingAPIConnector(object):
                 logging.error('Error while parsing Ebay shopping API result: ' + repr(err))
                 logging.info(pformat(item))
 
+        listings = make_listings_frame(rows)
         listings['site'] = self.ebay_name
-        
         return listings
 
     @staticmethod
@@ -802,7 +1408,10 @@ class EbayConnector(object):
     internal_site_name = 'ebay'
     "Value for the dataframe's 'site' field, to show that the listings come from Ebay."
 
-    def __init__(self, keyfile):
+    def __init__(self, keyfile, n_threads=1, calls_per_second=None, 
+                 site_limits=None, connection_options=None, max_calls=None,
+                 pool_size=10, burst=1, key_calls_per_second=None, 
+                 key_burst=1, max_retries=3, retry_delay=1.):
         """
         Parameters
         -------------
@@ -810,11 +1419,109 @@ class EbayConnector(object):
         keyfile : str
             Name of the configuration file for the ``python-ebay`` library,
             that contains the (secret) access keys for the Ebay API.
+            
+        n_threads : int
+            Default for the number of parallel calls to one Ebay site.
+            
+        calls_per_second : float
+            Default for the maximum rate of calls to one Ebay site. 
+            ``None``: no limit.
+            
+        site_limits : dict
+            Limits for individual Ebay sites, that override the defaults. 
+            For example: 
+            ``{'EBAY-DE': {'n_threads': 2, 'calls_per_second': 1, 'burst': 5}}``
+            
+        connection_options : dict
+            Additional arguments for the connections of the ``ebaysdk`` 
+            library. See ``create_connection``.
+            
+        max_calls : int
+            Maximum number of calls to Ebay, for all sites together. 
+            ``None``: no limit. See ``CallBudget``.
+            
+        pool_size : int
+            Maximum number of idle connections for each API and site. 
+            See ``ConnectionPool``.
+            
+        burst : int
+            Default for the number of calls to one Ebay site, that can be 
+            made without waiting. See ``RateLimiter``.
+            
+        key_calls_per_second : float
+            Maximum rate of calls for the application key, to all sites 
+            together. For example ``5000 / 86400`` spreads a daily quota of 
+            5000 calls over the day. ``None``: no limit.
+            
+        key_burst : int
+            Number of calls with the application key, that can be made 
+            without waiting.
+            
+        max_retries : int
+            Maximum number of times a failed call is repeated. 
+            See ``RetryPolicy``.
+            
+        retry_delay : float
+            Maximum delay before the first retry, in seconds. The delay 
+            doubles with each retry.
         """
         assert isinstance(keyfile, (str, type(None)))
         assert os.path.isfile(keyfile) 
+        assert isinstance(site_limits, (dict, type(None)))
+        assert isinstance(connection_options, (dict, type(None)))
 
         self.keyfile = keyfile
+        self.n_threads = n_threads
+        self.calls_per_second = calls_per_second
+        self.site_limits = site_limits or {}
+        self.burst = burst
+        self.key_rate_limiter = RateLimiter(key_calls_per_second, key_burst)
+        self.rate_limiters = {}
+        self.call_budget = CallBudget(max_calls)
+        self.retry_policy = RetryPolicy(max_retries, retry_delay)
+        self.connection_pool = ConnectionPool(keyfile, connection_options, 
+                                              pool_size)
+        self._lock = threading.Lock()
+
+    def get_site_limits(self, ebay_site):
+        """
+        Return the number of threads and the rate limiter for an Ebay site.
+        
+        All connectors to the same site share one rate limiter. The 
+        limiters of all sites share the limiter of the application key.
+        """
+        limits = self.site_limits.get(ebay_site, {})
+        n_threads = limits.get('n_threads', self.n_threads)
+        with self._lock:
+            if ebay_site not in self.rate_limiters:
+                self.rate_limiters[ebay_site] = RateLimiter(
+                    limits.get('calls_per_second', self.calls_per_second),
+                    limits.get('burst', self.burst), self.key_rate_limiter)
+            rate_limiter = self.rate_limiters[ebay_site]
+        return n_threads, rate_limiter
+
+    def metrics(self):
+        """
+        Return the consumption of the call quota, and the current rates.
+        
+        Returns
+        -------
+        
+        dict
+            * ``'n_calls'``: Number of calls to Ebay, including failed calls.
+            * ``'n_errors'``: Number of failed calls.
+            * ``'n_retries'``: Number of repeated calls.
+            * ``'n_remaining'``: Remaining calls of the budget, or ``None``.
+            * ``'calls_per_second'``: Current maximum rate for each site.
+        """
+        with self._lock:
+            rates = {site: limiter.calls_per_second 
+                     for site, limiter in self.rate_limiters.items()}
+        return {'n_calls': self.call_budget.n_calls, 
+                'n_errors': self.call_budget.n_errors,
+                'n_retries': self.call_budget.n_retries,
+                'n_remaining': self.call_budget.n_remaining(),
+                'calls_per_second': rates}
 
     def find_listings(self, keywords, n_listings, ebay_site,
                       price_min=None, price_max=None, currency="USD",
@@ -838,8 +1545,8 @@ class EbayConnector(object):
             Number of listings that Ebay should return. Might return fewer or
             slightly more listings.
             
-            Currently limited to 100 listings, the maximum number of listings 
-            in one page.
+            Ebay returns at most 100 listings per page, several pages are 
+            downloaded in parallel. See ``get_site_limits``.
             
         ebay_site : str
             Ebay site (country) where the search is executed. 
@@ -890,7 +1597,11 @@ class EbayConnector(object):
         assert isinstance(time_from, (datetime, pd.Timestamp, type(None)))
         assert isinstance(time_to,   (datetime, pd.Timestamp, type(None)))
 
-        fapic = EbayFindingAPIConnector(self.keyfile, ebay_site, self.internal_site_name)
+        n_threads, rate_limiter = self.get_site_limits(ebay_site)
+        fapic = EbayFindingAPIConnector(self.keyfile, ebay_site, 
+                                        self.internal_site_name, n_threads, 
+                                        rate_limiter, self.connection_pool,
+                                        self.call_budget, self.retry_policy)
         listings = fapic.find_listings(keywords, n_listings, 
                                       price_min, price_max, currency, 
                                       time_from, time_to)
@@ -909,6 +1620,10 @@ class EbayConnector(object):
         
         Retrieves all columns in listing (as opposed to ``find_listings``.)
         
+        Raises ``EbayPartialError`` if only some listings could be 
+        downloaded. It contains the downloaded listings, in the same format 
+        as the return value.
+        
         Argument
         --------
         
@@ -925,9 +1640,23 @@ class EbayConnector(object):
         assert isinstance(listings, pd.DataFrame)
         assert ebay_site in self.all_ebay_global_ids
         
+        n_threads, rate_limiter = self.get_site_limits(ebay_site)
         sapic = EbayShoppingAPIConnector(self.keyfile, ebay_site, 
-                                         self.internal_site_name)
-        listings = sapic.update_listings(listings, ebay_site)
+                                         self.internal_site_name, n_threads, 
+                                         rate_limiter, self.connection_pool,
+                                         self.call_budget, self.retry_policy)
+        try:
+            listings = sapic.update_listings(listings, ebay_site)
+        except EbayPartialError as err:
+            err.listings = self.prepare_updated_listings(err.listings)
+            raise
+        return self.prepare_updated_listings(listings)
+
+    def prepare_updated_listings(self, listings):
+        """
+        Create the IDs of listings from the shopping API, and remove 
+        incomplete and duplicate listings.
+        """
         listings.dropna(subset=['time'], inplace=True)
         self.create_ids(listings)
         listings.drop_duplicates(['id'], keep='first', inplace=True)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collect', '0004_auto_20170520_2219'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='event',
+            name='due_time',
+            field=models.DateTimeField(db_index=True, verbose_name='Time when event should be executed.'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='server',
+            field=models.CharField(blank=True, choices=[('EBAY-AT', 'EBAY-AT'), ('EBAY-AU', 'EBAY-AU'), ('EBAY-CH', 'EBAY-CH'), ('EBAY-DE', 'EBAY-DE'), ('EBAY-ENC', 'EBAY-ENC'), ('EBAY-ES', 'EBAY-ES'), ('EBAY-FR', 'EBAY-FR'), ('EBAY-FRB', 'EBAY-FRB'), ('EBAY-FRC', 'EBAY-FRC'), ('EBAY-GB', 'EBAY-GB'), ('EBAY-HK', 'EBAY-HK'), ('EBAY-IE', 'EBAY-IE'), ('EBAY-IN', 'EBAY-IN'), ('EBAY-IT', 'EBAY-IT'), ('EBAY-MOT', 'EBAY-MOT'), ('EBAY-MY', 'EBAY-MY'), ('EBAY-NL', 'EBAY-NL'), ('EBAY-NLB', 'EBAY-NLB'), ('EBAY-PH', 'EBAY-PH'), ('EBAY-PL', 'EBAY-PL'), ('EBAY-SG', 'EBAY-SG'), ('EBAY-US', 'EBAY-US')], default='', max_length=64, verbose_name='The server from which the listing should be updated.'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collect', '0005_event_server'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='attempts',
+            field=models.IntegerField(default=0, verbose_name='Number of failed attempts to execute the event.'),
+        ),
+    ]
@@ -100,15 +100,23 @@ class Event(models.Model):
             "Internal unique ID of each scheduled event.",
             primary_key=True)
     due_time = models.DateTimeField(
-            "Time when event should be executed.",)
+            "Time when event should be executed.",
+            db_index=True)
     listing = models.ForeignKey(
             econdata.models.Listing,
             verbose_name="The listing that should be updated.",
             on_delete=models.CASCADE, blank=True, null=True,)
+    server = models.CharField(
+            "The server from which the listing should be updated.",
+            max_length=64, choices=SearchTask.SERVER_CHOICES, 
+            blank=True, default='')
     search_task = models.ForeignKey(
             SearchTask,
             verbose_name="The search task that should be executed.",
             on_delete=models.CASCADE, blank=True, null=True,)
+    attempts = models.IntegerField(
+            "Number of failed attempts to execute the event.",
+            default=0)
 
     def __str__(self):
         return "{id}, {due}".format(
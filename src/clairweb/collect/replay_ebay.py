@@ -0,0 +1,365 @@
+###############################################################################
+#    Clair - Project to discover prices on e-commerce sites.                  #
+#                                                                             #
+#    Copyright (C) 2017 by Eike Welk                                          #
+#    eike.welk@gmx.net                                                        #
+#                                                                             #
+#    License: GPL Version 3                                                   #
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+"""
+Local stand-in for Ebay's finding and shopping API.
+
+The server replays responses that were recorded from Ebay with
+``RecordingConnectionPool``, or creates synthetic responses. It is used to
+test and benchmark the collection pipeline without connecting to Ebay::
+
+    with EbayReplayServer(recordings='recordings/', latency=0.2) as server:
+        connector = EbayConnector(server.write_keyfile('/tmp'),
+                                  connection_options=server.connection_options())
+        listings = connector.find_listings('Nikon D90', 100, 'EBAY-US')
+"""
+
+import os.path
+import re
+import glob
+import time
+import random
+import zlib
+import itertools
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from collect.get_ebay import ConnectionPool
+
+
+FIND_ITEM_XML = """
+<item>
+  <itemId>{item_id}</itemId>
+  <title>Nikon D90 listing {item_id}</title>
+  <viewItemURL>http://www.ebay.com/itm/{item_id}</viewItemURL>
+  <location>Pensacola,FL,USA</location>
+  <condition><conditionId>3000</conditionId></condition>
+  <listingInfo>
+    <endTime>2017-06-01T12:00:00.000Z</endTime>
+    <listingType>FixedPrice</listingType>
+  </listingInfo>
+  <sellingStatus>
+    <convertedCurrentPrice currencyId="USD">{price}</convertedCurrentPrice>
+    <sellingState>Active</sellingState>
+  </sellingStatus>
+</item>
+"""
+
+FIND_RESPONSE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<findItemsAdvancedResponse xmlns="http://www.ebay.com/marketplace/search/v1/services">
+  <ack>Success</ack>
+  <searchResult count="{n_items}">{items}</searchResult>
+  <paginationOutput>
+    <pageNumber>{i_page}</pageNumber>
+    <totalPages>{n_pages}</totalPages>
+  </paginationOutput>
+</findItemsAdvancedResponse>
+"""
+
+SHOPPING_ITEM_XML = """
+<Item>
+  <ItemID>{item_id}</ItemID>
+  <Title>Nikon D90 listing {item_id}</Title>
+  <Description>&lt;p&gt;Nice camera.&lt;/p&gt;</Description>
+  <ConditionID>3000</ConditionID>
+  <EndTime>2017-06-01T12:00:00.000Z</EndTime>
+  <ConvertedCurrentPrice currencyID="USD">{price}</ConvertedCurrentPrice>
+  <ShippingCostSummary>
+    <ShippingServiceCost currencyID="USD">5.0</ShippingServiceCost>
+  </ShippingCostSummary>
+  <Location>Pensacola, FL</Location>
+  <Country>US</Country>
+  <ShipToLocations>Worldwide</ShipToLocations>
+  <Seller><UserID>seller</UserID></Seller>
+  <ViewItemURLForNaturalSearch>http://www.ebay.com/itm/{item_id}</ViewItemURLForNaturalSearch>
+  <ListingStatus>Active</ListingStatus>
+  <ListingType>FixedPriceItem</ListingType>
+  <QuantitySold>0</QuantitySold>
+</Item>
+"""
+
+SHOPPING_RESPONSE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<GetMultipleItemsResponse xmlns="urn:ebay:apis:eBLBaseComponents">
+  <Ack>Success</Ack>{items}
+</GetMultipleItemsResponse>
+"""
+
+ERROR_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<{verb}Response>
+  <ack>Failure</ack>
+  <Ack>Failure</Ack>
+  <Errors>
+    <ShortMessage>Service Unavailable</ShortMessage>
+    <ErrorCode>503</ErrorCode>
+    <SeverityCode>Error</SeverityCode>
+  </Errors>
+</{verb}Response>
+"""
+
+
+class EbayReplayServer(object):
+    """
+    Local HTTP server that imitates Ebay's finding and shopping API.
+
+    Finding API (``findItemsAdvanced``): A recorded response is returned,
+    that has the same keywords and page number as the request. Otherwise a
+    recorded response with the same page number is returned. Without
+    recordings, the server creates ``n_pages`` pages with ``n_per_page``
+    listings for every search. The IDs of these listings depend on the
+    keywords.
+
+    Shopping API (``GetMultipleItems``): Returns the recorded items, for
+    the requested IDs. Without recordings, the server creates an item for
+    every requested ID. Like Ebay, the server omits unknown IDs.
+
+    Each request is delayed by ``latency`` seconds, a fraction
+    ``error_rate`` of the requests fails with HTTP status 503.
+
+    The server records statistics: the number of requests for each API call
+    (``n_requests``), the number of failed requests, the maximal number of
+    concurrent requests, the times of the requests, and the number of
+    opened connections.
+
+    Parameters
+    ----------
+
+    recordings : str
+        Directory with responses that were recorded by
+        ``RecordingConnectionPool``. ``None``: create synthetic responses.
+
+    n_pages : int
+        Number of pages of synthetic search results.
+
+    n_per_page : int
+        Number of listings per page of synthetic search results.
+
+    latency : float
+        Delay of each request, in seconds.
+
+    error_rate : float
+        Fraction of requests, that fail. Between 0 and 1.
+
+    seed : int
+        Seed of the random number generator for the errors.
+    """
+    def __init__(self, recordings=None, n_pages=1, n_per_page=100,
+                 latency=0., error_rate=0., seed=None):
+        assert 0 <= error_rate <= 1
+        assert n_per_page < 1000, 'Listing IDs would not be unique.'
+
+        self.n_pages = n_pages
+        self.n_per_page = n_per_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.n_requests = {'findItemsAdvanced': 0, 'GetMultipleItems': 0}
+        self.n_errors = 0
+        self.n_active = 0
+        self.max_active = 0
+        self.n_connections = 0
+        self.request_times = []
+        self.lock = threading.Lock()
+        # {(keywords, page_number): response}, {page_number: [response, ...]}
+        self.find_responses = {}
+        self.find_pages = {}
+        # {item_id: item_xml}
+        self.shopping_items = {}
+        self.recordings = recordings
+        if recordings is not None:
+            self.load_recordings(recordings)
+
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with server.lock:
+                    server.n_connections += 1
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                status, response = server.handle(body.decode('utf-8'))
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('localhost', 0), Handler)
+        self.domain = 'localhost:{}'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    def load_recordings(self, dirname):
+        """Read the responses that were recorded by ``RecordingConnectionPool``."""
+        for fname in sorted(glob.glob(os.path.join(dirname, '*.response.xml'))):
+            with open(fname, encoding='utf-8') as f:
+                response = f.read()
+            if 'findItemsAdvancedResponse' in response:
+                request_fname = fname.replace('.response.xml', '.request.xml')
+                with open(request_fname, encoding='utf-8') as f:
+                    keywords, i_page = self.parse_find_request(f.read())
+                self.find_responses[(keywords, i_page)] = response
+                self.find_pages.setdefault(i_page, []).append(response)
+            elif 'GetMultipleItemsResponse' in response:
+                for item in re.findall('<Item>.*?</Item>', response, re.DOTALL):
+                    item_id = re.search('<ItemID>(.*?)</ItemID>', item).group(1)
+                    self.shopping_items[item_id] = item
+
+    @staticmethod
+    def parse_find_request(request):
+        """Return the keywords and the page number of a search request."""
+        keywords = re.search('<keywords>(.*?)</keywords>', request, re.DOTALL)
+        i_page = re.search('<pageNumber>(\\d+)</pageNumber>', request)
+        return (keywords.group(1) if keywords else '',
+                int(i_page.group(1)) if i_page else 1)
+
+    def handle(self, request):
+        """
+        Create the response for a request to the finding or shopping API.
+        Returns the HTTP status and the response's body.
+        """
+        verb = 'GetMultipleItems' if 'GetMultipleItemsRequest' in request \
+               else 'findItemsAdvanced'
+        with self.lock:
+            self.request_times.append(time.monotonic())
+            self.n_requests[verb] += 1
+            self.n_active += 1
+            self.max_active = max(self.n_active, self.max_active)
+            is_error = self.random.random() < self.error_rate
+            if is_error:
+                self.n_errors += 1
+        time.sleep(self.latency)
+
+        if is_error:
+            status, response = 503, ERROR_XML.format(verb=verb)
+        elif verb == 'GetMultipleItems':
+            status, response = 200, self.get_multiple_items(request)
+        else:
+            status, response = 200, self.find_items_advanced(request)
+        with self.lock:
+            self.n_active -= 1
+        return status, response.encode('utf-8')
+
+    def get_multiple_items(self, request):
+        "Response of the shopping API."
+        item_ids = re.findall('<ItemID>(.*?)</ItemID>', request)
+        if self.recordings is not None:
+            items = ''.join(self.shopping_items[item_id] for item_id in item_ids
+                            if item_id in self.shopping_items)
+        else:
+            items = ''.join(SHOPPING_ITEM_XML.format(item_id=item_id, price=20)
+                            for item_id in item_ids)
+        return SHOPPING_RESPONSE_XML.format(items=items)
+
+    def find_items_advanced(self, request):
+        "Response of the finding API."
+        keywords, i_page = self.parse_find_request(request)
+        if self.recordings is not None:
+            response = self.find_responses.get((keywords, i_page))
+            if response is None and i_page in self.find_pages:
+                with self.lock:
+                    response = self.random.choice(self.find_pages[i_page])
+            if response is not None:
+                return response
+            return FIND_RESPONSE_XML.format(n_items=0, items='', i_page=i_page,
+                                            n_pages=len(self.find_pages))
+
+        n_items = self.n_per_page if i_page <= self.n_pages else 0
+        id_start = zlib.crc32(keywords.encode('utf-8')) % 100000 * 10**7 \
+                   + i_page * 1000
+        items = ''.join(FIND_ITEM_XML.format(item_id=id_start + i, price=10 + i)
+                        for i in range(n_items))
+        return FIND_RESPONSE_XML.format(n_items=n_items, items=items,
+                                        i_page=i_page, n_pages=self.n_pages)
+
+    def start(self):
+        """Start serving requests in a background thread."""
+        self.thread.start()
+
+    def stop(self):
+        """Stop the server and close its socket."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def write_keyfile(self, dirname):
+        "Write a configuration file for ``ebaysdk``, with a dummy key."
+        keyfile = os.path.join(str(dirname), 'ebay-sdk.apikey')
+        with open(keyfile, 'w') as f:
+            f.write('svcs.ebay.com:\n    appid: dummy-app-id\n'
+                    'open.api.ebay.com:\n    appid: dummy-app-id\n')
+        return keyfile
+
+    def connection_options(self):
+        "Arguments for ``ebaysdk`` to connect to this server."
+        # The keyfile can't contain a section for "localhost:<port>".
+        return {'domain': self.domain, 'https': False,
+                'appid': 'dummy-app-id'}
+
+
+class RecordingConnectionPool(ConnectionPool):
+    """
+    Connection pool that saves the requests and responses of all successful
+    calls to Ebay, for ``EbayReplayServer``.
+
+    Each call is stored in two files in ``directory``:
+    ``{number}-{verb}.request.xml`` and ``{number}-{verb}.response.xml``.
+
+    Usage::
+
+        connector = EbayConnector(keyfile)
+        connector.connection_pool = RecordingConnectionPool('recordings/',
+                                                            keyfile)
+
+    The other arguments are the same as for ``ConnectionPool``.
+    """
+    def __init__(self, directory, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.directory = directory
+        self._counter = itertools.count(1)
+        self._counter_lock = threading.Lock()
+
+    @contextmanager
+    def connection(self, api_name, ebay_site):
+        with super().connection(api_name, ebay_site) as api:
+            yield api
+            self.save(api)
+
+    def save(self, api):
+        """Write the last request and response of a connection into files."""
+        with self._counter_lock:
+            number = next(self._counter)
+        fname = os.path.join(self.directory,
+                             '{n:05d}-{verb}'.format(n=number, verb=api.verb))
+        body = api.request.body
+        with open(fname + '.request.xml', 'wb') as f:
+            f.write(body.encode('utf-8') if isinstance(body, str) else body)
+        with open(fname + '.response.xml', 'wb') as f:
+            f.write(api.response.content)
@@ -0,0 +1,112 @@
+###############################################################################
+#    Clair - Project to discover prices on e-commerce sites.                  #
+#                                                                             #
+#    Copyright (C) 2017 by Eike Welk                                          #
+#    eike.welk@gmx.net                                                        #
+#                                                                             #
+#    License: GPL Version 3                                                   #
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+"""
+Throughput benchmark of the daemon's search tasks.
+
+The benchmark is not collected by a plain ``pytest`` run. Run it
+explicitly::
+
+    pytest -s collect/test/bench_daemon.py
+
+``DaemonMain.execute_search_task`` runs end to end: find listings, update
+their details, write them into the database, and write ``ListingFoundBy``.
+Ebay is replaced by ``EbayReplayServer``. To replay responses that were
+recorded with ``RecordingConnectionPool``, put their directory into the
+environment variable ``CLAIR_RECORDINGS``.
+"""
+
+import os
+import time
+
+import pytest #contains `skip`, `fail`, `raises`, `config` #IGNORE:W0611
+
+
+N_TASKS = 10
+"Number of search tasks, with different keywords."
+
+N_LISTINGS = 200
+"Number of listings that each search task finds."
+
+LATENCY = 0.05
+"Delay of each response of the replay server, in seconds."
+
+ERROR_RATE = 0.02
+"Fraction of the requests to the replay server that fail."
+
+RETRY_DELAY = 0.1
+"Maximum delay before the first retry of a failed request, in seconds."
+
+RECORDINGS = os.environ.get('CLAIR_RECORDINGS')
+"Directory with recorded responses. ``None``: synthetic responses."
+
+
+@pytest.mark.django_db
+def test_execute_search_task(tmpdir):
+    """Listings/second, API calls per listing, and time per stage."""
+    from datetime import timedelta
+    from collect.daemon import DaemonMain
+    from collect.get_ebay import EbayConnector, EbayError
+    from collect.models import SearchTask
+    from collect.replay_ebay import EbayReplayServer
+
+    tasks = [SearchTask.objects.create(
+                        recurrence=timedelta(hours=1), server='EBAY-US',
+                        n_listings=N_LISTINGS,
+                        query_string='Nikon D{}'.format(90 + i))
+             for i in range(N_TASKS)]
+
+    n_listings, n_failed = 0, 0
+    with EbayReplayServer(recordings=RECORDINGS, n_pages=N_LISTINGS // 100,
+                          n_per_page=100, latency=LATENCY,
+                          error_rate=ERROR_RATE, seed=42) as server:
+        connector = EbayConnector(
+                        server.write_keyfile(tmpdir), n_threads=4,
+                        connection_options=server.connection_options(),
+                        retry_delay=RETRY_DELAY)
+        m = DaemonMain(connector)
+        start = time.perf_counter()
+        for task in tasks:
+            try:
+                n_listings += len(m.execute_search_task(task))
+            except EbayError:
+                n_failed += 1
+        duration = time.perf_counter() - start
+    n_calls = sum(server.n_requests.values())
+
+    print()
+    print('execute_search_task, {n} tasks, {f} failed, latency {l} s:'
+          .format(n=N_TASKS, f=n_failed, l=LATENCY))
+    print('    throughput:        {r:8.1f} listings/s'
+          .format(r=n_listings / duration))
+    print('    API calls:         {c:8.3f} per listing ({f} find, {u} update)'
+          .format(c=n_calls / max(n_listings, 1),
+                  f=server.n_requests['findItemsAdvanced'],
+                  u=server.n_requests['GetMultipleItems']))
+    print('    failed API calls:  {e:8d}, {r} retried'
+          .format(e=server.n_errors, r=connector.metrics()['n_retries']))
+    for stage in ['find', 'update', 'write listings', 'found by']:
+        print('    {s:18} {t:8.3f} s'.format(s=stage + ':',
+                                            t=m.stage_times[stage]))
+    print('    total:             {t:8.3f} s'.format(t=duration))
+
+    assert n_listings > 0
+    assert connector.call_budget.n_calls == n_calls
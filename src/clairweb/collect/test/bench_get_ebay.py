@@ -0,0 +1,121 @@
+###############################################################################
+#    Clair - Project to discover prices on e-commerce sites.                  #
+#                                                                             #
+#    Copyright (C) 2017 by Eike Welk                                          #
+#    eike.welk@gmx.net                                                        #
+#                                                                             #
+#    License: GPL Version 3                                                   #
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+"""
+Benchmarks for module ``get_ebay``.
+
+The benchmarks are not collected by a plain ``pytest`` run. Run them
+explicitly::
+
+    pytest -s collect/test/bench_get_ebay.py
+
+The responses are recorded from ``EbayReplayServer``, no connection to
+Ebay is needed.
+"""
+
+import time
+import logging
+
+import pytest #contains `skip`, `fail`, `raises`, `config` #IGNORE:W0611
+
+
+N_REPEAT = 20
+"Number of times each response is parsed."
+
+
+def record_responses(tmpdir):
+    """
+    Call the replay server, and return the response of the finding API
+    (100 listings) and the shopping API (20 listings) as ``dict``.
+    """
+    from collect.get_ebay import (ConnectionPool, EbayFindingAPIConnector,
+                                  EbayShoppingAPIConnector)
+    from collect.replay_ebay import EbayReplayServer
+
+    with EbayReplayServer(n_pages=1, n_per_page=100) as stub:
+        keyfile = stub.write_keyfile(tmpdir)
+        pool = ConnectionPool(keyfile, stub.connection_options())
+        fapic = EbayFindingAPIConnector(keyfile, 'EBAY-US', 'ebay',
+                                        connection_pool=pool)
+        sapic = EbayShoppingAPIConnector(keyfile, 'EBAY-US', 'ebay',
+                                         connection_pool=pool)
+        find_resp = fapic._call_find_api('Nikon D90', 100, 1)
+        shopping_resp = sapic._call_shopping_api(
+                                [str(1000 + i) for i in range(20)], 'EBAY-US')
+        pool.close()
+    return fapic, find_resp, sapic, shopping_resp
+
+
+def make_listings_frame_loc(rows):
+    """
+    The previous algorithm of the parsers, for comparison.
+    Fills the data frame cell by cell with ``.loc``.
+    """
+    from libclair.dataframes import make_data_frame
+    from econdata.models import Listing
+
+    listings = make_data_frame(Listing, len(rows))
+    for i, row in enumerate(rows):
+        for col, value in row.items():
+            listings.loc[i, col] = value
+    return listings
+
+
+def benchmark(func, arg, n_items):
+    """Return items/second of ``func(arg)``, best of ``N_REPEAT`` runs."""
+    duration = float('inf')
+    for _ in range(N_REPEAT):
+        start = time.perf_counter()
+        func(arg)
+        duration = min(time.perf_counter() - start, duration)
+    return n_items / duration
+
+
+def test_parse_responses(tmpdir):
+    """Items/second of the parsers, and of the two algorithms to fill the frame."""
+    from collect.get_ebay import make_listings_frame
+
+    fapic, find_resp, sapic, shopping_resp = record_responses(tmpdir)
+    # Don't measure the logging.
+    logging.disable(logging.DEBUG)
+    try:
+        listings_find = fapic._parse_find_response(find_resp)
+        listings_shopping = sapic._parse_shopping_response(shopping_resp)
+        r_find = benchmark(fapic._parse_find_response, find_resp, 100)
+        r_shopping = benchmark(sapic._parse_shopping_response,
+                               shopping_resp, 20)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    rows = listings_find.drop(columns=['site']).to_dict('records')
+    r_loc = benchmark(make_listings_frame_loc, rows, len(rows))
+    r_columns = benchmark(make_listings_frame, rows, len(rows))
+
+    print()
+    print('Parse recorded responses:')
+    print('    finding API:   {r:10.0f} items/s'.format(r=r_find))
+    print('    shopping API:  {r:10.0f} items/s'.format(r=r_shopping))
+    print('Fill data frame, {n} rows:'.format(n=len(rows)))
+    print('    old (.loc):    {r:10.0f} rows/s'.format(r=r_loc))
+    print('    new (columns): {r:10.0f} rows/s'.format(r=r_columns))
+    print('    speedup:       {s:10.1f}'.format(s=r_columns / r_loc))
+    assert len(listings_find) == 100
+    assert len(listings_shopping) == 20
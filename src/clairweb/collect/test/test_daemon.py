@@ -126,6 +126,348 @@ def test_MainObj_execute_tasks():
 
     print("Finished!")
 
+
+
+class FakeConnector(object):
+    """
+    Replaces ``EbayConnector`` for testing the scheduler. 
+    Returns a few listings after a delay, and records the number of 
+    concurrent searches on each site. Listings in ``failed_ids`` can't be
+    updated, listings in ``missing_ids`` are not returned by "Ebay", 
+    listings in ``active_ids`` have not ended yet.
+    """
+    def __init__(self, delay=0.05, n_listings=3):
+        import threading
+        from collections import defaultdict
+        self.delay = delay
+        self.n_listings = n_listings
+        self.n_active = defaultdict(int)
+        self.max_active_site = defaultdict(int)
+        self.max_active = 0
+        self.keywords = []
+        self.updates = []
+        self.missing_ids = set()
+        self.failed_ids = set()
+        self.active_ids = set()
+        self.lock = threading.Lock()
+
+    def find_listings(self, keywords, n_listings, ebay_site, **kwargs):
+        import pandas as pd
+        from libclair.dataframes import make_data_frame
+        from econdata.models import Listing
+        with self.lock:
+            self.keywords.append(keywords)
+            self.n_active[ebay_site] += 1
+            self.max_active_site[ebay_site] = max(
+                    self.n_active[ebay_site], self.max_active_site[ebay_site])
+            self.max_active = max(sum(self.n_active.values()), self.max_active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.n_active[ebay_site] -= 1
+        
+        listings = make_data_frame(Listing, self.n_listings)
+        listings['id_site'] = [keywords + '-' + str(i) 
+                               for i in range(self.n_listings)]
+        listings['id'] = '2017-06-01-ebay-' + listings['id_site']
+        listings['site'] = 'ebay'
+        listings['title'] = 'Listing ' + listings['id_site']
+        listings['time'] = pd.Timestamp('2017-06-01 12:00', tz='UTC')
+        return listings
+
+    def update_listings(self, listings, ebay_site):
+        from collect.get_ebay import EbayPartialError
+        self.updates.append((ebay_site, len(listings)))
+        listings = listings[~listings['id'].isin(self.missing_ids)].copy()
+        listings['status'] = 'ended'
+        listings.loc[listings['id_site'].isin(self.active_ids), 
+                     'status'] = 'active'
+        failed = listings['id_site'].isin(self.failed_ids)
+        if failed.any():
+            raise EbayPartialError('Failed', listings[~failed], 
+                                   list(listings.loc[failed, 'id_site']))
+        return listings
+
+
+@pytest.mark.django_db
+def test_MainObj_execute_tasks_concurrent():
+    """Test executing many search tasks in parallel, with DaemonMain.execute_tasks"""
+    from datetime import timedelta
+    from django.utils import timezone
+    from collect.daemon import DaemonMain
+    from collect.models import SearchTask, Event, ListingFoundBy
+    
+    sites = ['EBAY-US', 'EBAY-DE', 'EBAY-GB', 'EBAY-FR']
+    n_tasks = 40
+    hour = timedelta(hours=1)
+    SearchTask.objects.bulk_create(
+            [SearchTask(recurrence=hour, server=sites[i % 4], n_listings=10,
+                        query_string='task-{}'.format(i)) 
+             for i in range(n_tasks)])
+    # One task has no keywords, it must be rescheduled anyway.
+    SearchTask.objects.create(recurrence=hour, server='EBAY-US', n_listings=10)
+    
+    connector = FakeConnector(delay=0.2)
+    m = DaemonMain(connector)
+    m.n_threads = 6
+    m.max_tasks_per_site = 2
+    m.read_events()
+    assert Event.objects.count() == n_tasks + 1
+    now = timezone.now()
+    listing_ids = m.execute_tasks(now)
+    print('max parallel searches: {}'.format(connector.max_active))
+    
+    # All tasks were executed once, in parallel, within the limits.
+    assert sorted(connector.keywords) == \
+           sorted('task-{}'.format(i) for i in range(n_tasks))
+    assert len(listing_ids) == n_tasks * connector.n_listings
+    assert ListingFoundBy.objects.count() == n_tasks * connector.n_listings
+    assert max(connector.max_active_site.values()) <= 2
+    assert 1 < connector.max_active <= 6
+    
+    # The events are rescheduled, one hour later with jitter.
+    for event in Event.objects.all():
+        assert now + hour <= event.due_time <= now + 1.1 * hour + (timezone.now() - now)
+    assert len(m.event_heap) == n_tasks + 1
+    assert m.execute_tasks(now) == []
+    wakeup_time, sleep_sec = m.compute_next_wakeup_time()
+    assert sleep_sec == m.max_sleep
+    m.max_sleep = 7200
+    wakeup_time, sleep_sec = m.compute_next_wakeup_time()
+    assert wakeup_time == min(e.due_time for e in Event.objects.all())
+    
+    # Missed due times don't accumulate.
+    next_time = m.compute_next_due_time(now - 5 * hour, hour, now)
+    assert now <= next_time <= now + 0.1 * hour
+
+
+
+@pytest.mark.django_db
+def test_MainObj_final_updates():
+    """
+    Test DaemonMain.create_final_update_events and 
+    DaemonMain.execute_final_updates
+    """
+    from datetime import datetime, timedelta, timezone as tz
+    from collect.daemon import DaemonMain
+    from collect.models import SearchTask, Event, ListingFoundBy
+    from econdata.models import Listing
+    
+    def create_listing(lid, time, status='active'):
+        return Listing(id=lid, site='ebay', id_site=lid, title=lid, 
+                       time=time, status=status)
+    
+    t_de = SearchTask.objects.create(recurrence=timedelta(hours=1), 
+                                     server='EBAY-DE', n_listings=10)
+    t_us = SearchTask.objects.create(recurrence=timedelta(hours=1), 
+                                     server='EBAY-US', n_listings=10)
+    now = datetime(2017, 6, 2, 12, 20, tzinfo=tz.utc)
+    listings = []
+    # 45 listings from Ebay Germany, ending between 10:00 and 11:00.
+    for i in range(45):
+        listings.append(create_listing('de-{}'.format(i), 
+                    datetime(2017, 6, 2, 10, i, tzinfo=tz.utc)))
+    # 5 listings from Ebay USA, and one that no task found.
+    for i in range(5):
+        listings.append(create_listing('us-{}'.format(i), 
+                    datetime(2017, 6, 2, 11, 10, tzinfo=tz.utc)))
+    listings.append(create_listing('unknown', 
+                    datetime(2017, 6, 2, 11, 20, tzinfo=tz.utc)))
+    # Listings that need no update, or no update yet.
+    listings.append(create_listing('ended', 
+                    datetime(2017, 6, 2, 10, 30, tzinfo=tz.utc), 'ended'))
+    listings.append(create_listing('current-bucket', 
+                    datetime(2017, 6, 2, 12, 10, tzinfo=tz.utc)))
+    listings.append(create_listing('old', 
+                    datetime(2017, 5, 20, 12, 10, tzinfo=tz.utc)))
+    listings.append(create_listing('no-time', None))
+    Listing.objects.bulk_create(listings)
+    ListingFoundBy.objects.bulk_create(
+            [ListingFoundBy(task=t_de.id, listing='de-{}'.format(i)) 
+             for i in range(45)] +
+            [ListingFoundBy(task=t_us.id, listing='us-{}'.format(i)) 
+             for i in range(5)])
+    
+    connector = FakeConnector()
+    connector.missing_ids = {'de-3'}
+    m = DaemonMain(connector)
+    assert m.create_final_update_events(now) == 51
+    # Pending updates are not planned twice.
+    assert m.create_final_update_events(now) == 0
+    
+    events = Event.objects.filter(listing__isnull=False)
+    assert {(e.server, e.due_time) for e in events} == {
+            ('EBAY-DE', datetime(2017, 6, 2, 11, 30, tzinfo=tz.utc)), 
+            ('EBAY-US', datetime(2017, 6, 2, 12, 30, tzinfo=tz.utc))}
+    assert events.filter(server='EBAY-DE').count() == 45
+    
+    # The listings from Germany are due, they are updated together.
+    listing_ids = m.execute_final_updates(now)
+    assert connector.updates == [('EBAY-DE', 45)]
+    assert len(listing_ids) == 44
+    assert Listing.objects.filter(status='ended').count() == 45
+    assert Listing.objects.get(id='de-3').status == 'canceled'
+    assert Event.objects.count() == 6
+    assert m.execute_final_updates(now) == []
+    
+    wakeup_time, _ = m.compute_next_wakeup_time()
+    assert wakeup_time == datetime(2017, 6, 2, 12, 30, tzinfo=tz.utc)
+    # A listing that can't be downloaded is updated later.
+    connector.failed_ids = {'us-1'}
+    m.execute_final_updates(now + timedelta(minutes=15))
+    assert connector.updates[1:] == [('EBAY-US', 6)]
+    event = Event.objects.get()
+    assert event.listing.id == 'us-1'
+    assert event.attempts == 1
+    assert event.due_time == now + timedelta(minutes=25)
+    assert Listing.objects.get(id='us-1').status == 'active'
+    assert m.execute_final_updates(now + timedelta(minutes=20)) == []
+    connector.failed_ids = set()
+    assert m.execute_final_updates(now + timedelta(minutes=25)) == ['us-1']
+    assert Event.objects.count() == 0
+    assert m.create_final_update_events(now) == 0
+
+
+@pytest.mark.django_db
+def test_MainObj_final_updates_back_off():
+    """
+    Test that DaemonMain.execute_final_updates postpones failed updates 
+    exponentially, and cancels listings after too many failures.
+    """
+    from datetime import datetime, timedelta, timezone as tz
+    from collect.daemon import DaemonMain
+    from collect.models import Event
+    from econdata.models import Listing
+    
+    class FailingConnector(FakeConnector):
+        def update_listings(self, listings, ebay_site):
+            self.updates.append((ebay_site, len(listings)))
+            raise RuntimeError('Ebay is down.')
+    
+    now = datetime(2017, 6, 2, 12, 0, tzinfo=tz.utc)
+    Listing.objects.bulk_create(
+            [Listing(id=lid, site='ebay', id_site=lid, title=lid, time=now, 
+                     status='active') for lid in ['l-0', 'l-1']])
+    Event.objects.bulk_create(
+            [Event(due_time=now, listing_id=lid, server='EBAY-US') 
+             for lid in ['l-0', 'l-1']])
+    
+    connector = FailingConnector()
+    m = DaemonMain(connector)
+    m.final_update_retry_delay = timedelta(minutes=10)
+    m.final_update_max_attempts = 3
+    # The whole batch fails: the events are postponed by 10, then 20 minutes.
+    assert m.execute_final_updates(now) == []
+    assert {(e.attempts, e.due_time) for e in Event.objects.all()} == \
+           {(1, now + timedelta(minutes=10))}
+    assert m.execute_final_updates(now + timedelta(minutes=5)) == []
+    assert len(connector.updates) == 1
+    now += timedelta(minutes=10)
+    m.execute_final_updates(now)
+    assert {(e.attempts, e.due_time) for e in Event.objects.all()} == \
+           {(2, now + timedelta(minutes=20))}
+    # After the last attempt the listings are canceled, no events remain.
+    m.execute_final_updates(now + timedelta(minutes=20))
+    assert connector.updates == [('EBAY-US', 2)] * 3
+    assert Event.objects.count() == 0
+    assert set(Listing.objects.values_list('status', flat=True)) == \
+           {'canceled'}
+    assert m.known_listings.is_known(['l-0', 'l-1']).all()
+    
+    # A listing that is still active keeps its event, it is postponed.
+    # The event of the ended listing is deleted.
+    Listing.objects.update(status='active')
+    Event.objects.bulk_create(
+            [Event(due_time=now, listing_id=lid, server='EBAY-US') 
+             for lid in ['l-0', 'l-1']])
+    connector = FakeConnector()
+    connector.active_ids = {'l-1'}
+    m = DaemonMain(connector)
+    m.final_update_retry_delay = timedelta(minutes=10)
+    assert sorted(m.execute_final_updates(now)) == ['l-0', 'l-1']
+    event = Event.objects.get()
+    assert event.listing_id == 'l-1'
+    assert (event.attempts, event.due_time) == \
+           (1, now + timedelta(minutes=10))
+    assert m.create_final_update_events(now) == 0
+
+
+@pytest.mark.django_db
+def test_MainObj_write_listings():
+    """
+    Test that DaemonMain.write_listings invalidates the price statistics 
+    of the old and of the new day of a listing whose time changes.
+    """
+    from datetime import datetime, timezone as tz
+    import pandas as pd
+    from collect.daemon import DaemonMain
+    from econdata.models import Listing, PriceStatisticsDay, ChangedListing
+    
+    Listing.objects.create(id='l1', site='ebay', id_site='l1', title='l1', 
+                           time=datetime(2017, 6, 1, 12, tzinfo=tz.utc))
+    PriceStatisticsDay.objects.bulk_create(
+            [PriceStatisticsDay(day=datetime(2017, 6, d, tzinfo=tz.utc), 
+                                n_listings=1) for d in [1, 2, 3]])
+    
+    m = DaemonMain(FakeConnector())
+    m.write_listings(pd.DataFrame(
+            {'id': ['l1'], 'site': ['ebay'], 'id_site': ['l1'], 
+             'title': ['l1'], 'status': ['ended'],
+             'time': [pd.Timestamp('2017-06-02 12:00', tz='UTC')]}))
+    assert Listing.objects.get(id='l1').time == \
+           datetime(2017, 6, 2, 12, tzinfo=tz.utc)
+    assert list(PriceStatisticsDay.objects.values_list('day', flat=True)) \
+           == [datetime(2017, 6, 3, tzinfo=tz.utc)]
+    assert ChangedListing.objects.filter(listing='l1').count() == 1
+    assert m.known_listings.is_known(['l1']).all()
+
+
+@pytest.mark.django_db
+def test_MainObj_execute_search_task_known_listings():
+    """Test that known listings with final information are not downloaded again."""
+    from datetime import timedelta
+    from collect.daemon import DaemonMain
+    from collect.models import SearchTask, ListingFoundBy
+    from econdata.models import Listing
+    
+    task = SearchTask.objects.create(recurrence=timedelta(hours=1), 
+                                     server='EBAY-DE', n_listings=10, 
+                                     query_string='nikon')
+    # The fake connector finds the listings 'nikon-0' ... 'nikon-4'.
+    Listing.objects.bulk_create([
+            Listing(id='2017-06-01-ebay-nikon-0', site='ebay', 
+                    id_site='nikon-0', title='ended', status='ended'),
+            Listing(id='2017-06-01-ebay-nikon-1', site='ebay', 
+                    id_site='nikon-1', title='active', status='active'),
+            Listing(id='2017-06-01-ebay-nikon-2', site='ebay', 
+                    id_site='nikon-2', title='canceled', status='canceled')])
+    
+    connector = FakeConnector(delay=0, n_listings=5)
+    m = DaemonMain(connector)
+    m.known_listings.refresh()
+    assert len(m.known_listings) == 2
+    listing_ids = m.execute_search_task(task)
+    # Only the active and the new listings are updated.
+    assert connector.updates == [('EBAY-DE', 3)]
+    assert len(listing_ids) == 5
+    assert ListingFoundBy.objects.filter(task=task.id).count() == 5
+    assert Listing.objects.get(id='2017-06-01-ebay-nikon-0').title == 'ended'
+    
+    # All listings are final now, nothing is updated.
+    assert len(m.known_listings) == 5
+    listing_ids = m.execute_search_task(task)
+    assert connector.updates == [('EBAY-DE', 3)]
+    assert len(listing_ids) == 5
+    assert ListingFoundBy.objects.filter(task=task.id).count() == 5
+    
+    # The set is refreshed from the database.
+    Listing.objects.filter(id='2017-06-01-ebay-nikon-4').update(status='active')
+    m.known_listings.refresh(force=True)
+    assert len(m.known_listings) == 4
+    assert list(m.known_listings.is_known(['2017-06-01-ebay-nikon-4', 
+                                           '2017-06-01-ebay-nikon-3'])) \
+           == [False, True]
+
+
     
 # def test_MainObj_create_final_update_tasks():
 #     """Test DaemonMain.create_final_update_tasks"""
@@ -176,6 +518,9 @@ if __name__ == "__main__":
 
 #     test_MainObj_compute_next_due_time()
     test_MainObj_execute_tasks()
+#     test_MainObj_execute_tasks_concurrent()
+#     test_MainObj_final_updates()
+#     test_MainObj_execute_search_task_known_listings()
 #    test_MainObj_create_final_update_tasks()
 #    test_MainObj_main_download_listings()
 #    test_CommandLineHandler_parse_command_line()
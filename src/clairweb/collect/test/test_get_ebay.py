@@ -94,6 +94,311 @@ def test_EbayConnector_update_listings():
     print('Finished.')
 
 
+@pytest.mark.django_db
+def test_EbayConnector_find_listings_parallel(tmpdir):
+    """Test downloading multiple pages in parallel from a local server."""
+    from collect.get_ebay import EbayConnector
+    from collect.replay_ebay import EbayReplayServer
+    
+    n_pages, n_per_page = 6, 20
+    with EbayReplayServer(n_pages=n_pages, n_per_page=n_per_page, 
+                          latency=0.3) as stub:
+        ebc = EbayConnector(stub.write_keyfile(tmpdir), n_threads=3,
+                            site_limits={'EBAY-US': {'calls_per_second': 50}},
+                            connection_options=stub.connection_options())
+        listings = ebc.find_listings(keywords="Nikon D90", 
+                                     n_listings=10 * n_pages * n_per_page,
+                                     ebay_site='EBAY-US')
+    
+    print(listings[["id_site", "title", "price", "currency"]])
+    print('Max parallel requests: {}'.format(stub.max_active))
+    # All listings are downloaded, the number of pages comes from page 1.
+    assert len(listings) == n_pages * n_per_page
+    assert listings['id_site'].is_unique
+    assert len(stub.request_times) == n_pages
+    # Pages 2 to 6 are downloaded in parallel, by at most 3 threads.
+    assert 1 < stub.max_active <= 3
+    # Rate limit: the requests are spaced at least 1/50 s apart. The 
+    # server sees the requests with some jitter.
+    request_times = sorted(stub.request_times)
+    assert request_times[-1] - request_times[0] >= 0.9 * (n_pages - 1) / 50
+    
+    # Single thread, no rate limit
+    with EbayReplayServer(n_pages=3, n_per_page=10, latency=0) as stub:
+        ebc = EbayConnector(stub.write_keyfile(tmpdir), 
+                            connection_options=stub.connection_options())
+        listings = ebc.find_listings(keywords="Nikon D90", n_listings=1000,
+                                     ebay_site='EBAY-US')
+    assert len(listings) == 30
+    assert stub.max_active == 1
+
+
+@pytest.mark.django_db
+def test_EbayConnector_update_listings_parallel(tmpdir):
+    """Test downloading batches of 20 listings in parallel from a local server."""
+    from collect.get_ebay import EbayConnector, EbayError
+    from collect.replay_ebay import EbayReplayServer
+    
+    n_pages, n_per_page = 1, 100
+    with EbayReplayServer(n_pages=n_pages, n_per_page=n_per_page, 
+                          latency=0.2) as stub:
+        ebc = EbayConnector(stub.write_keyfile(tmpdir), n_threads=4,
+                            connection_options=stub.connection_options(),
+                            max_calls=8)
+        listings = ebc.find_listings(keywords="Nikon D90", n_listings=100,
+                                     ebay_site='EBAY-US')
+        stub.max_active, stub.n_connections = 0, 0
+        listings = ebc.update_listings(listings, ebay_site='EBAY-US')
+        
+        print(listings[["id_site", "title", "price", "description"]])
+        print('Max parallel requests: {}, sockets: {}'
+              .format(stub.max_active, stub.n_connections))
+        # 5 batches are downloaded in parallel, by at most 4 threads.
+        assert len(listings) == n_per_page
+        assert listings['id_site'].is_unique
+        assert (listings['description'] == 'Nice camera.').all()
+        assert 1 < stub.max_active <= 4
+        # The connections are pooled, and keep their sockets open.
+        n_connections = stub.n_connections
+        assert 1 < n_connections <= 4
+        assert ebc.connection_pool.n_idle('shopping', 'EBAY-US') == \
+               n_connections
+        ebc.update_listings(listings.iloc[:40], ebay_site='EBAY-US')
+        assert stub.n_connections == n_connections
+        # Only 8 calls are allowed: 1 find, 5 + 2 update, 0 remaining.
+        assert ebc.call_budget.n_calls == 8
+        with pytest.raises(EbayError):
+            ebc.update_listings(listings, ebay_site='EBAY-US')
+
+
+def test_make_listings_frame():
+    """Test creating the data frame from rows, that may be incomplete."""
+    import numpy as np
+    from collect.get_ebay import make_listings_frame
+    
+    rows = [{'id_site': '1', 'title': 'a', 'price': 10., 'is_sold': True}, 
+            {'id_site': '2'}, 
+            {}, 
+            {'id_site': '4', 'price': 40., 'is_sold': None,
+             'time': np.datetime64('2017-06-01T12:00')}]
+    listings = make_listings_frame(rows)
+    print(listings)
+    
+    assert list(listings['id_site'].fillna('')) == ['1', '2', '', '4']
+    assert listings['price'].tolist()[::3] == [10., 40.]
+    assert listings['price'].isnull().tolist() == [False, True, True, False]
+    assert listings['is_sold'].tolist()[0] is True
+    assert listings['time'].isnull().tolist() == [True, True, True, False]
+    assert len(make_listings_frame([])) == 0
+
+
+def test_ConnectionPool(tmpdir):
+    """Test reusing connections and health checks of ``ConnectionPool``."""
+    from collect.get_ebay import ConnectionPool
+    from collect.replay_ebay import EbayReplayServer
+    
+    now = [0.]
+    stub = EbayReplayServer(n_pages=1, n_per_page=1)
+    pool = ConnectionPool(stub.write_keyfile(tmpdir), 
+                          stub.connection_options(), pool_size=2, 
+                          max_idle_time=10, timer=lambda: now[0])
+    
+    # Connections are reused, for the same API and site.
+    with pool.connection('shopping', 'EBAY-US') as api1:
+        pass
+    with pool.connection('shopping', 'EBAY-US') as api2:
+        assert api2 is api1
+        with pool.connection('shopping', 'EBAY-US') as api3:
+            assert api3 is not api1
+        with pool.connection('shopping', 'EBAY-DE') as api4:
+            assert api4 is not api3
+        with pool.connection('finding', 'EBAY-US') as api5:
+            assert api5.config.get('uri') != api1.config.get('uri')
+    assert pool.n_created == 4
+    assert pool.n_idle('shopping', 'EBAY-US') == 2
+    
+    # Only ``pool_size`` idle connections are kept.
+    apis = [pool.get('shopping', 'EBAY-US') for _ in range(3)]
+    for api in apis:
+        pool.put('shopping', 'EBAY-US', api)
+    assert pool.n_idle('shopping', 'EBAY-US') == 2
+    
+    # Connections that raised an error are closed.
+    with pytest.raises(ValueError):
+        with pool.connection('finding', 'EBAY-US') as api:
+            raise ValueError()
+    assert pool.n_idle('finding', 'EBAY-US') == 0
+    
+    # Idle connections expire.
+    now[0] = 11.
+    with pool.connection('shopping', 'EBAY-US') as api:
+        assert api not in apis
+    assert pool.n_idle('shopping', 'EBAY-US') == 1
+    pool.close()
+    assert pool.n_idle('shopping', 'EBAY-US') == 0
+    stub.server.server_close()
+
+
+@pytest.mark.django_db
+def test_EbayReplayServer(tmpdir):
+    """Test recording responses, replaying them, and simulated errors."""
+    import os
+    from collect.get_ebay import EbayConnector, EbayError
+    from collect.replay_ebay import EbayReplayServer, RecordingConnectionPool
+    
+    recordings = tmpdir.mkdir('recordings')
+    with EbayReplayServer(n_pages=2, n_per_page=30) as server:
+        keyfile = server.write_keyfile(tmpdir)
+        ebc = EbayConnector(keyfile, connection_options=server.connection_options())
+        ebc.connection_pool = RecordingConnectionPool(
+                            str(recordings), keyfile, server.connection_options())
+        listings_rec = ebc.find_listings(keywords="Nikon D90", n_listings=200,
+                                         ebay_site='EBAY-US')
+        listings_rec = ebc.update_listings(listings_rec, ebay_site='EBAY-US')
+    # 2 pages of search results, 3 batches of details.
+    assert len(os.listdir(str(recordings))) == 2 * (2 + 3)
+    assert server.n_requests == {'findItemsAdvanced': 2, 'GetMultipleItems': 3}
+    
+    with EbayReplayServer(recordings=str(recordings)) as server:
+        ebc = EbayConnector(server.write_keyfile(tmpdir), 
+                            connection_options=server.connection_options())
+        listings = ebc.find_listings(keywords="Nikon D90", n_listings=200,
+                                     ebay_site='EBAY-US')
+        assert sorted(listings['id_site']) == sorted(listings_rec['id_site'])
+        # Unknown keywords get recorded responses too.
+        listings = ebc.find_listings(keywords="Canon", n_listings=200,
+                                     ebay_site='EBAY-US')
+        assert len(listings) == 60
+        # Unknown listings are omitted, like Ebay does.
+        listings['id_site'] = ['123'] + list(listings['id_site'].iloc[1:])
+        listings = ebc.update_listings(listings, ebay_site='EBAY-US')
+        assert len(listings) == 59
+        assert set(listings['title']) < set(listings_rec['title'])
+    
+    with EbayReplayServer(error_rate=1) as server:
+        ebc = EbayConnector(server.write_keyfile(tmpdir), 
+                            connection_options=server.connection_options(),
+                            max_retries=2, retry_delay=0.01)
+        with pytest.raises(EbayError):
+            ebc.find_listings(keywords="Nikon D90", n_listings=10,
+                              ebay_site='EBAY-US')
+    assert server.n_errors == 3
+
+
+def test_RateLimiter():
+    """Test the token bucket, and the adaptation of the rate."""
+    from collect.get_ebay import RateLimiter
+    
+    # Simulated clock, waiting advances it.
+    clock = [0.]
+    def sleep(seconds):
+        clock[0] += seconds
+    
+    def make_limiter(*args, **kwargs):
+        return RateLimiter(*args, timer=lambda: clock[0], sleep=sleep, 
+                           **kwargs)
+    
+    def measure_calls(limiter, n_calls):
+        clock[0] = 0.
+        times = []
+        for _ in range(n_calls):
+            limiter.wait()
+            times.append(clock[0])
+        return times
+    
+    # The first ``burst`` calls don't wait, the others are spaced.
+    times = measure_calls(make_limiter(20, burst=3), 5)
+    print(times)
+    assert times == pytest.approx([0, 0, 0, 0.05, 0.1])
+    # The limiter of the application key limits too.
+    key_limiter = make_limiter(10)
+    times = measure_calls(make_limiter(1000, parent=key_limiter), 3)
+    assert times == pytest.approx([0, 0.1, 0.2])
+    
+    limiter = RateLimiter(10)
+    for _ in range(10):
+        limiter.slow_down()
+    assert limiter.calls_per_second == 10 * limiter.min_fraction
+    for _ in range(100):
+        limiter.speed_up()
+    assert limiter.calls_per_second == 10
+    unlimited = RateLimiter()
+    unlimited.slow_down()
+    assert unlimited.calls_per_second is None
+
+
+def test_CallBudget():
+    """Test limiting the calls, and the reset at the start of each day."""
+    from collect.get_ebay import CallBudget, EbayError
+    
+    day = 24 * 60 * 60.
+    clock = [100 * day + 10]
+    budget = CallBudget(max_calls=2, timer=lambda: clock[0])
+    budget.spend()
+    budget.record_error(is_retried=True)
+    budget.spend()
+    assert budget.n_remaining() == 0
+    with pytest.raises(EbayError):
+        budget.spend()
+    # Later on the same day the budget is still exhausted.
+    clock[0] = 101 * day - 1
+    with pytest.raises(EbayError):
+        budget.spend()
+    # At midnight the full budget is available again.
+    clock[0] = 101 * day
+    assert budget.n_remaining() == 2
+    assert (budget.n_calls, budget.n_errors, budget.n_retries) == (0, 0, 0)
+    budget.spend()
+    assert budget.n_remaining() == 1
+
+
+@pytest.mark.django_db
+def test_EbayConnector_retries(tmpdir):
+    """Test repeating failed calls, and keeping partial results."""
+    from collect.get_ebay import EbayConnector, EbayPartialError
+    from collect.replay_ebay import EbayReplayServer
+    
+    with EbayReplayServer(n_pages=5, n_per_page=20, error_rate=0.3, 
+                          seed=1) as server:
+        ebc = EbayConnector(server.write_keyfile(tmpdir), n_threads=2,
+                            connection_options=server.connection_options(),
+                            calls_per_second=100, max_retries=10, 
+                            retry_delay=0.01)
+        listings = ebc.find_listings(keywords="Nikon D90", n_listings=500,
+                                     ebay_site='EBAY-US')
+        listings = ebc.update_listings(listings, ebay_site='EBAY-US')
+        metrics = ebc.metrics()
+    print(metrics)
+    # All listings are downloaded, despite the errors.
+    assert len(listings) == 100
+    assert server.n_errors > 0
+    assert metrics['n_errors'] == metrics['n_retries'] == server.n_errors
+    assert metrics['n_calls'] == sum(server.n_requests.values())
+    # Ebay is overloaded, the rate is reduced.
+    assert metrics['calls_per_second']['EBAY-US'] < 100
+    
+    with EbayReplayServer(n_pages=5, n_per_page=20, error_rate=0.5, 
+                          seed=2) as server:
+        ebc = EbayConnector(server.write_keyfile(tmpdir), n_threads=2,
+                            connection_options=server.connection_options(),
+                            max_retries=0)
+        server.error_rate = 0
+        listings = ebc.find_listings(keywords="Nikon D90", n_listings=500,
+                                     ebay_site='EBAY-US')
+        # The listings of the other pages are kept.
+        server.error_rate = 0.5
+        listings_part = ebc.find_listings(keywords="Nikon D90", 
+                                          n_listings=500, ebay_site='EBAY-US')
+        with pytest.raises(EbayPartialError) as exc_info:
+            ebc.update_listings(listings, ebay_site='EBAY-US')
+    err = exc_info.value
+    print(err, len(listings_part), len(err.listings))
+    assert 0 < len(listings_part) < 100
+    assert 0 < len(err.listings) < 100
+    assert len(err.listings) + len(err.failed_ids) == 100
+    assert set(err.listings['id_site']).isdisjoint(err.failed_ids)
+    assert ebc.metrics()['n_retries'] == 0
+
 
 if __name__ == '__main__':
     #One can't use models without this
@@ -101,6 +406,10 @@ if __name__ == '__main__':
     django.setup()
 
 #     test_EbayConnector_find_listings()
+#     test_EbayConnector_find_listings_parallel(".")
+#     test_EbayConnector_update_listings_parallel(".")
+#     test_make_listings_frame()
+#     test_ConnectionPool(".")
     test_EbayConnector_update_listings()
     
     pass #pylint: disable=W0107
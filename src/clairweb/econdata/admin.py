@@ -1,8 +1,35 @@
 from django.contrib import admin
-from .models import Listing, Product, Price, ProductsInListing
+from .models import (Listing, Product, Price, ProductsInListing, 
+                     ChangedListing, PriceStatisticsDay, PriceStatisticsBlock,
+                     DataVersion)
+from .prices import mark_listings_changed, read_listing_times
+
+
+@admin.register(Listing)
+class ListingAdmin(admin.ModelAdmin):
+    "Listings edited here invalidate their prices and price statistics."
+    def save_model(self, request, obj, form, change):
+        # The listing's old time, before it is changed.
+        old_times = read_listing_times([obj.id])
+        super().save_model(request, obj, form, change)
+        mark_listings_changed([obj.id], old_times)
+
+    def delete_model(self, request, obj):
+        old_times = read_listing_times([obj.id])
+        super().delete_model(request, obj)
+        mark_listings_changed([obj.id], old_times)
+
+    def delete_queryset(self, request, queryset):
+        ids = list(queryset.values_list('id', flat=True))
+        old_times = read_listing_times(ids)
+        super().delete_queryset(request, queryset)
+        mark_listings_changed(ids, old_times)
 
 
-admin.site.register(Listing)
 admin.site.register(Product)
 admin.site.register(Price)
-admin.site.register(ProductsInListing)
\ No newline at end of file
+admin.site.register(ProductsInListing)
+admin.site.register(ChangedListing)
+admin.site.register(PriceStatisticsDay)
+admin.site.register(PriceStatisticsBlock)
+admin.site.register(DataVersion)
\ No newline at end of file
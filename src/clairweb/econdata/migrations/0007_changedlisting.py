@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('econdata', '0006_productsinlisting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangedListing',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False, verbose_name='Internal unique ID of each record.')),
+                ('listing', models.CharField(max_length=64, verbose_name='ID of the listing that was written or changed.')),
+            ],
+        ),
+    ]
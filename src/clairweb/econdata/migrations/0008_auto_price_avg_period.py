@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('econdata', '0007_changedlisting'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='price',
+            name='avg_period',
+            field=models.CharField(choices=[('none', 'No averaging was done.'), ('day', 'Average over one day.'), ('week', 'Average over one week.'), ('month', 'Average over one month.'), ('rolling-7d', 'Rolling average over 7 days.'), ('rolling-30d', 'Rolling average over 30 days.')], max_length=16, verbose_name="Time span for taking average. Can be 'day', 'week', 'month', 'rolling-7d', 'rolling-30d'."),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('econdata', '0008_auto_price_avg_period'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceStatisticsDay',
+            fields=[
+                ('day', models.DateTimeField(primary_key=True, serialize=False, verbose_name='Start of the day (midnight, UTC).')),
+                ('n_listings', models.IntegerField(verbose_name='Number of listings used for the statistics.')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PriceStatisticsBlock',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False, verbose_name='Internal unique ID of each record.')),
+                ('products', models.TextField(verbose_name='IDs of the products, JSON list.')),
+                ('gram', models.TextField(verbose_name='Matrix ``A.T * A``, JSON list of non zero entries: ``[[row, column, value], ...]``.')),
+                ('rhs', models.TextField(verbose_name='Vector ``A.T * b``, JSON list.')),
+                ('counts', models.TextField(verbose_name='Number of listings that contain each product, JSON list.')),
+                ('day', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='econdata.PriceStatisticsDay', verbose_name='Day of the listings.')),
+            ],
+        ),
+    ]
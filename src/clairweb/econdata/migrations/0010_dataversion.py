@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('econdata', '0009_pricestatistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name="Name of the data set, for example 'listings'.")),
+                ('version', models.IntegerField(default=0, verbose_name='Version number, increased at each change.')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('econdata', '0010_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changedlisting',
+            name='time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Time of the listing before the change. NULL: new listing, or time unknown.'),
+        ),
+    ]
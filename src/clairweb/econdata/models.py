@@ -23,7 +23,12 @@
 Models (database tables) for economic data.
 For example: Listings, products, prices, and their relations.
 """
+from datetime import timedelta
+
 from django.db import models
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 
 class Listing(models.Model):
@@ -202,9 +207,12 @@ class Price(models.Model):
             ('none',  'No averaging was done.'),
             ('day',   'Average over one day.'),
             ('week',  'Average over one week.'),
-            ('month', 'Average over one month.'),   )
+            ('month', 'Average over one month.'),
+            ('rolling-7d',  'Rolling average over 7 days.'),
+            ('rolling-30d', 'Rolling average over 30 days.'),   )
     avg_period = models.CharField(
-            "Time span for taking average. Can be 'day', 'week', 'month'.",
+            "Time span for taking average. Can be 'day', 'week', 'month', "
+            "'rolling-7d', 'rolling-30d'.",
             max_length=16, choices=AVG_PERIOD_CHOICES)
     avg_num_listings = models.IntegerField(
             "Number of listings used in computation of average.")
@@ -236,4 +244,133 @@ class ProductsInListing(models.Model):
 
     def __str__(self):
         return str(self.id) + ', ' + self.product.name + ', ' + self.listing.title
-    
\ No newline at end of file
+
+
+class ChangedListing(models.Model):
+    """
+    Listings that were written or changed since the prices were computed.
+    The prices of their products must be recomputed.
+    """
+    id = models.AutoField(
+            "Internal unique ID of each record.",
+            primary_key=True)
+    listing = models.CharField(
+            "ID of the listing that was written or changed.",
+            max_length=64)
+    time = models.DateTimeField(
+            "Time of the listing before the change. "
+            "NULL: new listing, or time unknown.",
+            blank=True, null=True)
+
+    def __str__(self):
+        return str(self.id) + ', ' + self.listing
+
+
+class PriceStatisticsDay(models.Model):
+    """
+    Days whose price statistics are stored in ``PriceStatisticsBlock``.
+    Days without usable listings have no blocks.
+    """
+    day = models.DateTimeField(
+            "Start of the day (midnight, UTC).",
+            primary_key=True)
+    n_listings = models.IntegerField(
+            "Number of listings used for the statistics.")
+
+    def __str__(self):
+        return str(self.day) + ', ' + str(self.n_listings)
+
+
+class PriceStatisticsBlock(models.Model):
+    """
+    Sufficient statistics of the price equations, of one connected 
+    component of products, of one day. 
+    See ``libclair.prices.PriceStatistics``.
+    """
+    id = models.AutoField(
+            "Internal unique ID of each record.",
+            primary_key=True)
+    day = models.ForeignKey(
+            PriceStatisticsDay,
+            verbose_name="Day of the listings.",
+            related_name='blocks',
+            on_delete=models.CASCADE)
+    products = models.TextField(
+            "IDs of the products, JSON list.")
+    gram = models.TextField(
+            "Matrix ``A.T * A``, JSON list of non zero entries: "
+            "``[[row, column, value], ...]``.")
+    rhs = models.TextField(
+            "Vector ``A.T * b``, JSON list.")
+    counts = models.TextField(
+            "Number of listings that contain each product, JSON list.")
+
+    def __str__(self):
+        return str(self.day_id) + ', ' + self.products
+
+
+class DataVersion(models.Model):
+    """
+    Version numbers of data sets. The version is increased whenever the 
+    data changes. Results that were computed from the data are valid as 
+    long as the version stays the same.
+    """
+    id = models.CharField(
+            "Name of the data set, for example 'listings'.",
+            max_length=32, primary_key=True)
+    version = models.IntegerField(
+            "Version number, increased at each change.",
+            default=0)
+
+    def __str__(self):
+        return self.id + ', ' + str(self.version)
+
+
+def get_data_version(name='listings'):
+    "Get the current version of a data set."
+    versions = DataVersion.objects.filter(id=name)\
+                                  .values_list('version', flat=True)
+    return versions[0] if versions else 0
+
+
+def bump_data_version(name='listings'):
+    "Increase the version of a data set."
+    n_updated = DataVersion.objects.filter(id=name)\
+                                   .update(version=F('version') + 1)
+    if n_updated == 0:
+        _, created = DataVersion.objects.get_or_create(
+                                        id=name, defaults={'version': 1})
+        if not created:
+            DataVersion.objects.filter(id=name)\
+                               .update(version=F('version') + 1)
+
+
+@receiver([post_save, post_delete], sender=ProductsInListing)
+def mark_listing_changed(sender, instance, **kwargs):
+    "Recompute prices when the products in a listing change."
+    if instance.listing_id is not None:
+        ChangedListing.objects.create(listing=instance.listing_id)
+        times = Listing.objects.filter(id=instance.listing_id)\
+                               .values_list('time', flat=True)
+        for time in times:
+            invalidate_statistics_day(time)
+        bump_data_version()
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_all_statistics(sender, instance, created=True, **kwargs):
+    """
+    Recompute all price statistics when products are created or deleted.
+    Listings with unknown products are not in the statistics.
+    """
+    if created:
+        PriceStatisticsDay.objects.all().delete()
+        bump_data_version()
+
+
+def invalidate_statistics_day(time):
+    "Delete the cached price statistics of the day that contains ``time``."
+    if time is not None:
+        PriceStatisticsDay.objects.filter(day__lte=time, 
+                                          day__gt=time - timedelta(days=1))\
+                                  .delete()
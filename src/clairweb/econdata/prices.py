@@ -0,0 +1,718 @@
+###############################################################################
+#    Clair - Project to discover prices on e-commerce sites.                  #
+#                                                                             #
+#    Copyright (C) 2013 by Eike Welk                                          #
+#    eike.welk@gmx.net                                                        #
+#                                                                             #
+#    License: GPL Version 3                                                   #
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+"""
+Compute prices from the listings in the database, and store them there.
+
+Listings that are written or changed are recorded in ``ChangedListing``.
+``update_prices_incremental`` recomputes only the prices that depend on 
+these listings.
+
+The sufficient statistics of the price equations of each day are cached in 
+``PriceStatisticsDay`` and ``PriceStatisticsBlock``. Average prices of any 
+time range are computed from them by ``compute_average_prices_cached``, 
+without reading listings. Changes of listings invalidate the statistics of 
+their days.
+
+On-demand estimates for a set of products (``estimate_prices``) are kept in 
+an in-memory cache, until the listings change.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from django.db import transaction
+from django.db.models import Count, Max, Q
+
+from econdata.models import (Listing, Product, Price, ProductsInListing, 
+                             ChangedListing, PriceStatisticsDay, 
+                             PriceStatisticsBlock, get_data_version, 
+                             bump_data_version)
+from libclair.dataframes import read_frame
+from libclair.prices import PriceEstimator, PriceStatistics
+from libclair.coredata import make_price_frame, make_price_ids
+
+
+CONDITION_VALUES = {
+    'new': 1.,
+    'new-defects': 0.9,
+    'refurbished': 0.9,
+    'used': 0.7,
+    'used-very-good': 0.8,
+    'used-good': 0.7,
+    'used-acceptable': 0.5,
+    'not-working': 0.1, }
+"""
+Numeric values of ``Listing.condition``, for the price computations. 
+1.0: new/perfect, 0.7: used, 0.0: worthless. Unknown conditions are 
+``PriceEstimator.default_condition``.
+"""
+
+
+def read_listing_times(listing_ids):
+    """
+    Read the times of listings from the database. 
+    
+    Call it before listings are changed or deleted, and give the result to 
+    ``mark_listings_changed``.
+    
+    Returns
+    -------
+    pd.Series
+        The times (UTC), the index contains the listing IDs. Listings that 
+        don't exist, or have no time, are omitted.
+    """
+    times = pd.DataFrame(
+            list(Listing.objects.filter(id__in=list(listing_ids), 
+                                        time__isnull=False)
+                                .values_list('id', 'time')), 
+            columns=['id', 'time'])
+    return pd.Series(pd.DatetimeIndex(pd.to_datetime(times['time'], utc=True)),
+                     index=times['id'])
+
+
+def mark_listings_changed(listing_ids, old_times=None):
+    """
+    Record that listings were written, changed or deleted. 
+    Their prices are recomputed by the next call to 
+    ``update_prices_incremental``.
+    
+    Parameters
+    ----------
+    listing_ids : iterable[str]
+        IDs of the changed listings.
+        
+    old_times : pd.Series
+        Times of the listings before the change, from ``read_listing_times``.
+        The prices and statistics of the intervals and days, that contained 
+        the listings before the change, are recomputed too. 
+    """
+    listing_ids = list(listing_ids)
+    if old_times is None:
+        old_times = pd.Series([], dtype='datetime64[ns, UTC]')
+    ChangedListing.objects.bulk_create(
+                [ChangedListing(listing=lid, time=old_times.get(lid)) 
+                 for lid in listing_ids])
+    invalidate_price_statistics(listing_ids, old_times)
+    bump_data_version()
+
+
+def invalidate_price_statistics(listing_ids, old_times=None):
+    """
+    Delete the cached price statistics of the days of the listings, and of
+    the days in ``old_times``. 
+    They are recomputed by the next call to ``read_price_statistics``.
+    
+    Listings have no signal receiver, that would add queries to each 
+    ``save``. The code that writes or deletes listings must call this 
+    function (usually through ``mark_listings_changed``).
+    """
+    times = read_listing_times(listing_ids)
+    if old_times is not None:
+        times = pd.concat([times, old_times.dropna()])
+    days = set(pd.DatetimeIndex(times).normalize())
+    PriceStatisticsDay.objects.filter(day__in=days).delete()
+
+
+def read_listings_for_prices(queryset, default_condition=0.7):
+    """
+    Read listings and their products from the database, in the format that 
+    ``libclair.prices.PriceEstimator`` needs.
+    
+    Returns
+    -------
+    pd.DataFrame
+        Columns "id", "time", "currency", "price", "sold", "condition", 
+        "products". The index contains the listing IDs.
+    """
+    frame = read_frame(queryset, ['id', 'time', 'currency', 'price', 
+                                  'is_sold', 'condition'])
+    frame.set_index('id', drop=False, inplace=True)
+    frame['sold'] = frame['is_sold'].map({True: 1., False: 0.})
+    frame['condition'] = (frame['condition'].map(CONDITION_VALUES)
+                          .fillna(default_condition))
+    
+    prods_in_listings = ProductsInListing.objects.filter(
+                                        listing__in=queryset.values('id'))
+    prods_in_listings = pd.DataFrame(
+                list(prods_in_listings.values_list('listing_id', 'product_id')),
+                columns=['listing', 'product'])
+    products = prods_in_listings.groupby('listing')['product'].apply(list)
+    frame['products'] = [products.get(lid, []) for lid in frame.index]
+    return frame
+
+
+def find_observed_prices(listings=None, default_condition=0.7):
+    """
+    Create prices from sold listings that contain only one product. 
+    These prices are called 'observed' prices.
+    
+    The listings are found in the database, by counting the products of 
+    each listing (``COUNT(product) = 1``). The data comes from a single 
+    query.
+    
+    Parameters
+    ----------
+    listings : django.db.models.QuerySet
+        Only these listings are searched. If ``None``, all listings are 
+        searched.
+    
+    default_condition : float
+        Condition of listings with unknown condition.
+        
+    Returns
+    -------
+    pd.DataFrame
+        The observed prices, in the format of 
+        ``libclair.prices.PriceEstimator.find_observed_prices``.
+    """
+    prods_in_listings = ProductsInListing.objects.filter(product__isnull=False)
+    if listings is not None:
+        prods_in_listings = prods_in_listings.filter(
+                                        listing__in=listings.values('id'))
+    single_product = prods_in_listings.values('listing_id')\
+                                      .annotate(n_products=Count('product'))\
+                                      .filter(n_products=1)\
+                                      .values('listing_id')
+    observed = prods_in_listings.filter(listing_id__in=single_product, 
+                                        listing__is_sold=True)\
+                                .values_list('listing__price', 
+                                             'listing__currency', 
+                                             'listing__condition', 
+                                             'listing__time', 
+                                             'product_id', 'listing_id')
+    columns = ['price', 'currency', 'condition', 'time', 'product', 'listing']
+    prices = pd.DataFrame(list(observed), columns=columns)
+    prices['price'] = prices['price'].astype(float)
+    prices['condition'] = (prices['condition'].map(CONDITION_VALUES)
+                           .fillna(default_condition))
+    prices['time'] = pd.to_datetime(prices['time'], utc=True)
+    prices['type'] = 'observed'
+    prices['avg_period'] = 'none'
+    prices['avg_num_listings'] = 1
+    prices['id'] = make_price_ids(prices)
+    prices.set_index('id', drop=False, inplace=True, verify_integrity=True)
+    return prices
+
+
+def write_prices(prices):
+    """
+    Write prices, computed by ``PriceEstimator``, into the database, as new
+    records. Average prices are not associated with a listing.
+    """
+    is_average = prices['type'] == 'average'
+    records = [
+        Price(price=price, currency=currency, condition=condition, time=time, 
+              product_id=product, listing_id=None if avg else listing, 
+              price_type=price_type, is_sold=None if avg else True,
+              avg_period=avg_period, avg_num_listings=avg_num_listings)
+        for price, currency, condition, time, product, listing, price_type, 
+            avg_period, avg_num_listings, avg in zip(
+                prices['price'], prices['currency'], prices['condition'], 
+                prices['time'], prices['product'], prices['listing'], 
+                prices['type'], prices['avg_period'], 
+                prices['avg_num_listings'], is_average)]
+    Price.objects.bulk_create(records, batch_size=1000)
+
+
+def update_prices_incremental(estimator=None, avg_periods=('week',)):
+    """
+    Recompute the prices that depend on listings that were written, 
+    changed or deleted since the last call. 
+    
+    Only the (interval, product component) blocks that contain changed 
+    listings are recomputed. Their ``Price`` records are replaced. The 
+    intervals that contained the listings before the change (see 
+    ``ChangedListing.time``) are recomputed too.
+    
+    The changes are forgotten after the prices of all ``avg_periods`` 
+    have been recomputed.
+    
+    Parameters
+    ----------
+    estimator : libclair.prices.PriceEstimator
+        Object that computes the prices. If ``None`` a default object is 
+        created.
+        
+    avg_periods : list[str]
+        Time spans for the averages: "day", "week" or "month". 
+        
+    Returns
+    -------
+    int
+        Number of new price records.
+    """
+    assert isinstance(avg_periods, (list, tuple))
+    if estimator is None:
+        estimator = PriceEstimator()
+    
+    #Process only the changes that exist now. Changes that are recorded 
+    #during the computation are processed by the next call.
+    last_change = ChangedListing.objects.aggregate(Max('id'))['id__max']
+    if last_change is None:
+        return 0
+    changes = ChangedListing.objects.filter(id__lte=last_change)
+    change_times = pd.DataFrame(list(changes.values_list('listing', 'time')),
+                                columns=['id', 'time'])
+    changed_ids = set(change_times['id'])
+    
+    #The changed listings, with their current and previous products. 
+    #The previous products are recorded in the prices of the listing.
+    dirty_listings = read_listings_for_prices(
+                    Listing.objects.filter(id__in=changed_ids, 
+                                           time__isnull=False),
+                    estimator.default_condition)
+    old_products = Price.objects.filter(listing_id__in=changed_ids)\
+                                .values_list('listing_id', 'product_id')
+    old_products = pd.DataFrame(list(old_products), 
+                                columns=['listing', 'product'])\
+                     .groupby('listing')['product'].apply(list)
+    dirty_listings['products'] = [
+                prods + old_products.get(lid, []) 
+                for lid, prods in dirty_listings['products'].items()]
+    
+    #The listings at their times before the change. The products of 
+    #deleted listings are unknown (``None``).
+    moved = change_times.dropna(subset=['time'])
+    moved_listings = pd.DataFrame(
+                {'time': pd.DatetimeIndex(pd.to_datetime(moved['time'], 
+                                                         utc=True)), 
+                 'products': [dirty_listings['products'].get(lid) 
+                              for lid in moved['id']]}, 
+                index=moved['id'])
+    
+    n_prices = 0
+    for avg_period in avg_periods:
+        n_prices += update_prices_period(estimator, avg_period, 
+                                         dirty_listings, moved_listings)
+    changes.delete()
+    
+    logging.info('Recomputed prices of {n} changed listings, periods: {p}. '
+                 '{np} new prices.'
+                 .format(n=len(changed_ids), p=', '.join(avg_periods), 
+                         np=n_prices))
+    return n_prices
+
+
+def update_prices_period(estimator, avg_period, dirty_listings, 
+                         moved_listings):
+    """
+    Recompute the prices of one averaging period, that depend on changed 
+    listings. See ``update_prices_incremental``.
+    
+    Parameters
+    ----------
+    dirty_listings : pd.DataFrame
+        The changed listings, with their current and previous products. 
+        
+    moved_listings : pd.DataFrame
+        The changed listings at their times before the change. Column 
+        "products" is ``None`` if the products are unknown; then all products
+        that have prices in the interval are recomputed.
+        
+    Returns
+    -------
+    int
+        Number of new price records.
+    """
+    offset = estimator.get_period_offset(avg_period)
+    moved_listings = moved_listings.copy()
+    moved_listings['start'] = estimator.find_interval_starts(
+                                    moved_listings['time'], avg_period)
+    for start in set(moved_listings.loc[moved_listings['products'].isnull(), 
+                                        'start']):
+        intv_products = list(set(
+                Price.objects.filter(time__gte=start, time__lt=start + offset,
+                                     avg_period__in=[avg_period, 'none'])
+                             .values_list('product_id', flat=True)))
+        unknown = (moved_listings['start'] == start) & \
+                  moved_listings['products'].isnull()
+        moved_listings.loc[unknown, 'products'] = \
+                            pd.Series([intv_products] * unknown.sum(), 
+                                      index=moved_listings.index[unknown])
+    dirty_listings = pd.concat([dirty_listings[['time', 'products']], 
+                                moved_listings[['time', 'products']]])
+    dirty_listings['time'] = pd.to_datetime(dirty_listings['time'], utc=True)
+    
+    #Read all listings of the intervals that contain changed listings.
+    intv_starts = set(estimator.find_interval_starts(dirty_listings['time'], 
+                                                     avg_period))
+    intvs_filter = Q(pk__in=[])
+    for start in intv_starts:
+        intvs_filter |= Q(time__gte=start, time__lt=start + offset)
+    listings = read_listings_for_prices(Listing.objects.filter(intvs_filter),
+                                        estimator.default_condition)
+    
+    prices, dirty_blocks = estimator.compute_prices_incremental(
+                                    listings, Product.objects.all(), 
+                                    dirty_listings, avg_period)
+    
+    with transaction.atomic():
+        for (start, end), block in dirty_blocks.groupby(['start', 'end']):
+            Price.objects.filter(time__gte=start, time__lt=end, 
+                                 product_id__in=list(block['product']), 
+                                 avg_period__in=[avg_period, 'none'])\
+                         .delete()
+        write_prices(prices)
+    
+    logging.debug('Recomputed {p} prices in {i} intervals, period: {ap}.'
+                  .format(p=len(prices), i=len(intv_starts), ap=avg_period))
+    return len(prices)
+
+
+def to_utc(time):
+    "Convert a naive or time zone aware time to a ``pd.Timestamp`` in UTC."
+    time = pd.Timestamp(time)
+    if time.tzinfo is None:
+        return time.tz_localize('UTC')
+    return time.tz_convert('UTC')
+
+
+def get_product_ids():
+    "IDs of the products whose prices are computed."
+    return sorted(pid for pid in Product.objects.values_list('id', flat=True)
+                  if not pid.startswith('xxx-unknown'))
+
+
+def compute_price_statistics(days, estimator=None):
+    """
+    Compute the price statistics of days from the listings, and store them 
+    in ``PriceStatisticsDay`` and ``PriceStatisticsBlock``. 
+    
+    Parameters
+    ----------
+    days : list[pd.Timestamp]
+        Start (midnight, UTC) of the days.
+        
+    estimator : libclair.prices.PriceEstimator
+        Object that computes the statistics. If ``None`` a default object is 
+        created.
+    """
+    if estimator is None:
+        estimator = PriceEstimator()
+    days = pd.DatetimeIndex(sorted(set(days)))
+    if len(days) == 0:
+        return
+    
+    #Read the listings of all days with one query. Consecutive days are 
+    #combined into one time range.
+    is_gap = (days[1:] - days[:-1]) != pd.Timedelta(days=1)
+    run_starts = np.flatnonzero(np.concatenate([[True], is_gap]))
+    run_ends = np.append(run_starts[1:], len(days)) - 1
+    days_filter = Q(pk__in=[])
+    for i_start, i_end in zip(run_starts, run_ends):
+        days_filter |= Q(time__gte=days[i_start], 
+                         time__lt=days[i_end] + timedelta(days=1))
+    listings = read_listings_for_prices(Listing.objects.filter(days_filter), 
+                                        estimator.default_condition)
+    
+    stat_days = {day: 0 for day in days}
+    blocks = []
+    if len(listings) > 0:
+        stats = estimator.compute_daily_statistics(listings, get_product_ids())
+        stat_days.update(zip(stats.days, stats.n_listings))
+        for day, product_ids, gram, rhs, counts in stats.iter_blocks():
+            rows, cols = np.nonzero(gram)
+            blocks.append(PriceStatisticsBlock(
+                    day_id=day, 
+                    products=json.dumps(list(product_ids)), 
+                    gram=json.dumps([[int(r), int(c), float(gram[r, c])] 
+                                     for r, c in zip(rows, cols)]), 
+                    rhs=json.dumps([float(v) for v in rhs]), 
+                    counts=json.dumps([int(n) for n in counts])))
+    
+    with transaction.atomic():
+        PriceStatisticsDay.objects.filter(day__in=list(days)).delete()
+        PriceStatisticsDay.objects.bulk_create(
+                [PriceStatisticsDay(day=day, n_listings=int(n_listings)) 
+                 for day, n_listings in stat_days.items()])
+        PriceStatisticsBlock.objects.bulk_create(blocks, batch_size=1000)
+    logging.debug('Computed price statistics of {d} days, {b} blocks.'
+                  .format(d=len(days), b=len(blocks)))
+
+
+def read_price_statistics(time_start, time_end, estimator=None):
+    """
+    Read the price statistics of the days in ``[time_start, time_end)`` from
+    the cache. Missing days are computed from the listings, and stored.
+    
+    Parameters
+    ----------
+    time_start, time_end : datetime
+        Start and end of the time range. Times are in UTC.
+        
+    estimator : libclair.prices.PriceEstimator
+        Object that computes missing statistics. If ``None`` a default 
+        object is created.
+        
+    Returns
+    -------
+    libclair.prices.PriceStatistics
+        Statistics of the days that have listings.
+    """
+    day_start = to_utc(time_start).normalize()
+    time_end = to_utc(time_end)
+    days_qs = PriceStatisticsDay.objects.filter(day__gte=day_start, 
+                                                day__lt=time_end)
+    all_days = pd.date_range(day_start, time_end, freq='D', inclusive='left')
+    cached_days = set(pd.Timestamp(day) for day in 
+                      days_qs.values_list('day', flat=True))
+    missing_days = [day for day in all_days if day not in cached_days]
+    if len(missing_days) > 0:
+        compute_price_statistics(missing_days, estimator)
+    
+    day_records = sorted((pd.Timestamp(day), n_listings) for day, n_listings 
+                         in days_qs.filter(n_listings__gt=0)
+                                   .values_list('day', 'n_listings'))
+    days = pd.DatetimeIndex([day for day, _ in day_records], tz='UTC')
+    n_listings = [n for _, n in day_records]
+    block_records = PriceStatisticsBlock.objects.filter(
+                                    day__in=days_qs.filter(n_listings__gt=0))\
+                            .values_list('day_id', 'products', 'gram', 'rhs', 
+                                         'counts')
+    
+    def convert_block(record):
+        day, products, gram_entries, rhs, counts = record
+        products = json.loads(products)
+        gram = np.zeros((len(products), len(products)))
+        for row, col, value in json.loads(gram_entries):
+            gram[row, col] = value
+        return (pd.Timestamp(day), np.asarray(products, dtype=object), gram, 
+                np.asarray(json.loads(rhs)), np.asarray(json.loads(counts)))
+    
+    return PriceStatistics.from_blocks(
+                    get_product_ids(), days, np.asarray(n_listings, dtype=int), 
+                    (convert_block(record) for record in block_records))
+
+
+def compute_average_prices_cached(time_start, time_end, avg_period='week', 
+                                  estimator=None):
+    """
+    Compute average prices from the cached daily price statistics.
+    Listings are only read for days whose statistics are not in the cache.
+    
+    Parameters
+    ----------
+    time_start, time_end : datetime
+        Start and end of the computed periods.
+        
+    avg_period : str
+        "day", "week", "month", or a rolling window like "rolling-30d". 
+        
+    estimator : libclair.prices.PriceEstimator
+        Object that computes the prices. If ``None`` a default object is 
+        created.
+        
+    Returns
+    -------
+    pd.DataFrame
+        The average prices.
+    """
+    if estimator is None:
+        estimator = PriceEstimator()
+    time_start, time_end = to_utc(time_start), to_utc(time_end)
+    #Rolling windows need the days before their end.
+    rolling_days = estimator.parse_rolling_period(avg_period) or 0
+    stats = read_price_statistics(time_start - timedelta(days=rolling_days), 
+                                  time_end, estimator)
+    return estimator.compute_average_prices(stats, avg_period, 
+                                            time_start, time_end)
+
+
+class EstimateCache(object):
+    """
+    Least recently used cache, whose entries expire after some time. 
+    Thread safe.
+    
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of entries. The least recently used entry is removed
+        when the cache is full.
+        
+    ttl : float
+        Time to live of the entries, in seconds.
+        
+    timer : callable
+        Function that returns the current time in seconds.
+    """
+    def __init__(self, max_size=128, ttl=600., timer=time.monotonic):
+        assert max_size > 0
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        "Return the value of ``key``, or ``None`` if it is missing or expired."
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < self.timer():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key, value):
+        "Store ``value`` under ``key``."
+        with self._lock:
+            self._entries[key] = (self.timer() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        "Remove all entries."
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self):
+        return len(self._entries)
+
+
+estimate_cache = EstimateCache()
+"Cache of ``estimate_prices``, shared by all requests of a process."
+
+
+def find_component_listings(product_ids, time_start, time_end, estimator):
+    """
+    Find the listings in a time range, that influence the prices of some 
+    products. 
+    
+    These are the listings of the connected components of the equation 
+    system, that contain the products (see 
+    ``PriceEstimator.find_connected_components``). Solving only a part of 
+    a component would give different prices.
+    
+    Returns
+    -------
+    list[str]
+        IDs of the listings.
+    """
+    pairs = pd.DataFrame(
+                list(ProductsInListing.objects
+                     .filter(listing__time__gte=time_start, 
+                             listing__time__lt=time_end, 
+                             product__isnull=False)
+                     .values_list('listing_id', 'product_id')),
+                columns=['listing', 'product'])
+    if len(pairs) == 0:
+        return []
+    listing_codes, listing_ids = pd.factorize(pairs['listing'])
+    product_codes, all_product_ids = pd.factorize(pairs['product'])
+    matrix = sparse.csr_matrix(
+                    (np.ones(len(pairs)), (listing_codes, product_codes)), 
+                    shape=(len(listing_ids), len(all_product_ids)))
+    _, product_labels, listing_labels = \
+                            estimator.find_connected_components(matrix)
+    labels = product_labels[np.isin(all_product_ids, product_ids)]
+    return list(listing_ids[np.isin(listing_labels, labels)])
+
+
+def estimate_prices(product_ids, time_start, time_end, avg_period='week', 
+                    estimator=None, cache=estimate_cache):
+    """
+    Estimate the prices of some products, from the listings in a time range. 
+    
+    The listings of the connected components, that contain the requested 
+    products, are used (see ``find_component_listings``). Therefore the 
+    prices are the same as the prices that are computed from all listings.
+    The results are cached, with key 
+    ``(products, interval, avg_period, data version)``. The data version 
+    is increased whenever listings are written, so that cached results of 
+    old data are never used.
+    
+    Parameters
+    ----------
+    product_ids : list[str]
+        IDs of the requested products.
+    
+    time_start, time_end : datetime
+        Start and end of the time range. The range is extended to whole 
+        periods: the start is moved back to the start of its period, the 
+        end forward to the end of its period. For rolling windows the 
+        range is extended to whole days.
+        
+    avg_period : str
+        "day", "week", "month", or a rolling window like "rolling-30d".
+        
+    estimator : libclair.prices.PriceEstimator
+        Object that computes the prices. If ``None`` a default object is 
+        created. 
+    
+    cache : EstimateCache, None
+        Cache for the results. No caching if ``None``.
+        
+    Returns
+    -------
+    pd.DataFrame
+        Prices of the requested products, in the format of 
+        ``PriceEstimator.compute_prices``.
+    """
+    if estimator is None:
+        estimator = PriceEstimator()
+    product_ids = tuple(sorted(set(product_ids)))
+    time_start = to_utc(time_start).floor('D')
+    time_end = to_utc(time_end).ceil('D')
+    rolling_days = estimator.parse_rolling_period(avg_period)
+    if rolling_days is None:
+        #Intervals are anchored: weeks start on Monday, months on the 1st.
+        offset = estimator.get_period_offset(avg_period)
+        time_start = offset.rollback(time_start)
+        time_end = offset.rollforward(time_end)
+        read_start = time_start
+    else:
+        #Rolling windows need the days before their end.
+        read_start = time_start - timedelta(days=rolling_days)
+    
+    key = (product_ids, time_start, time_end, avg_period, get_data_version())
+    if cache is not None:
+        prices = cache.get(key)
+        if prices is not None:
+            return prices.copy()
+    
+    listing_ids = find_component_listings(product_ids, read_start, time_end, 
+                                          estimator)
+    listings = read_listings_for_prices(
+                                Listing.objects.filter(id__in=listing_ids), 
+                                estimator.default_condition)
+    if len(listings) > 0:
+        prices = estimator.compute_prices(listings, Product.objects.all(),
+                                          time_start, time_end, avg_period)
+        prices = prices[prices['product'].isin(product_ids)]
+    else:
+        prices = make_price_frame(0)
+    
+    if cache is not None:
+        cache.put(key, prices.copy())
+    return prices
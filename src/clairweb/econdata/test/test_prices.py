@@ -0,0 +1,368 @@
+###############################################################################
+#    Clair - Project to discover prices on e-commerce sites.                  #
+#                                                                             #
+#    Copyright (C) 2013 by Eike Welk                                          #
+#    eike.welk@gmx.net                                                        #
+#                                                                             #
+#    License: GPL Version 3                                                   #
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+"""
+Test module ``econdata.prices``, which computes prices from the listings in
+the database.
+"""
+            
+import os
+
+import pytest #contains `skip`, `fail`, `raises`, `config` #IGNORE:W0611
+import numpy as np
+import pandas as pd
+import django
+
+
+def create_test_data():
+    "Create products and listings in two weeks, in the database."
+    from econdata.models import Listing, Product, ProductsInListing
+    
+    for pid in ['a', 'b', 'c']:
+        Product.objects.create(id=pid, name='Product ' + pid)
+    listing_data = [('l1', '2017-01-03', 10., ['a']),
+                    ('l2', '2017-01-04', 30., ['a', 'b']),
+                    ('l3', '2017-01-05', 20., ['b']),
+                    ('l4', '2017-01-05', 5., ['c']),
+                    ('l5', '2017-01-10', 12., ['a']),
+                    ('l6', '2017-01-11', 34., ['a', 'b']), ]
+    for lid, time, price, prods in listing_data:
+        Listing.objects.create(id=lid, site='ebay', id_site=lid, title=lid, 
+                               time=pd.Timestamp(time, tz='UTC'), 
+                               currency='EUR', price=price, is_sold=True,
+                               condition='new')
+        for pid in prods:
+            ProductsInListing.objects.create(listing_id=lid, product_id=pid)
+    return [lid for lid, _, _, _ in listing_data]
+
+
+@pytest.mark.django_db
+def test_update_prices_incremental():
+    print("Start")
+    from econdata.models import Price, ProductsInListing, ChangedListing
+    from econdata.prices import (mark_listings_changed, 
+                                 update_prices_incremental)
+    
+    #Signals have recorded the new ``ProductsInListing``.
+    listing_ids = create_test_data()
+    ChangedListing.objects.all().delete()
+    assert update_prices_incremental() == 0
+    
+    #Compute all prices.
+    mark_listings_changed(listing_ids)
+    n_prices = update_prices_incremental()
+    print(pd.DataFrame(list(Price.objects.values())).to_string())
+    assert n_prices == Price.objects.count() == 13
+    assert ChangedListing.objects.count() == 0
+    ids_c = set(Price.objects.filter(product_id='c').values_list('id', 
+                                                                 flat=True))
+    ids_week2 = set(Price.objects.filter(time__gte='2017-01-09')
+                                 .values_list('id', flat=True))
+    
+    #Product "b" is removed from listing "l2". Only the component (a, b) 
+    #in the first week is recomputed.
+    ProductsInListing.objects.filter(listing_id='l2', product_id='b').delete()
+    assert ChangedListing.objects.count() == 1
+    n_prices = update_prices_incremental()
+    assert n_prices == 5 #3 observed, 2 average
+    assert Price.objects.count() == 13 - 1
+    assert ids_c == set(Price.objects.filter(product_id='c')
+                             .values_list('id', flat=True))
+    assert ids_week2 == set(Price.objects.filter(time__gte='2017-01-09')
+                                 .values_list('id', flat=True))
+    assert Price.objects.filter(listing_id='l2', product_id='b').count() == 0
+    price_l2 = Price.objects.get(listing_id='l2')
+    assert price_l2.price == 30.
+    assert price_l2.price_type == 'observed'
+
+
+
+@pytest.mark.django_db
+def test_update_prices_incremental_month():
+    print("Start")
+    from econdata.models import Price, ChangedListing
+    from econdata.prices import (mark_listings_changed, 
+                                 update_prices_incremental)
+    
+    listing_ids = create_test_data()
+    ChangedListing.objects.all().delete()
+    mark_listings_changed(listing_ids)
+    assert update_prices_incremental(avg_periods=['week']) == 13
+    
+    #Monthly prices replace the observed prices, but not the weekly prices.
+    mark_listings_changed(listing_ids)
+    n_prices = update_prices_incremental(avg_periods=['month'])
+    print(pd.DataFrame(list(Price.objects.values())).to_string())
+    assert n_prices == 11 #4 observed, 4 estimated, 3 average
+    assert Price.objects.filter(avg_period='none').count() == 4
+    assert Price.objects.filter(avg_period='week').count() == 9
+    avg_prices = Price.objects.filter(avg_period='month', 
+                                      price_type='average')
+    assert avg_prices.count() == 3
+    assert all(p.time.day == 16 for p in avg_prices)
+
+
+@pytest.mark.django_db
+def test_update_prices_incremental_moved():
+    "Test listings that move to another week, or are deleted."
+    print("Start")
+    from econdata.models import Listing, Price, ChangedListing
+    from econdata.prices import (mark_listings_changed, read_listing_times,
+                                 update_prices_incremental)
+    
+    listing_ids = create_test_data()
+    ChangedListing.objects.all().delete()
+    mark_listings_changed(listing_ids)
+    assert update_prices_incremental(avg_periods=['week', 'month']) == 13 + 11
+    assert ChangedListing.objects.count() == 0
+    prices_all = pd.DataFrame(list(Price.objects.values()))
+    print(prices_all.to_string())
+    
+    #Listing "l1" moves from the first week into the second week.
+    old_times = read_listing_times(['l1'])
+    Listing.objects.filter(id='l1').update(time='2017-01-10 12:00Z')
+    mark_listings_changed(['l1'], old_times)
+    assert ChangedListing.objects.get().time == old_times['l1']
+    update_prices_incremental(avg_periods=['week', 'month'])
+    prices_moved = pd.DataFrame(list(Price.objects.values()))
+    print(prices_moved.to_string())
+    #Same prices as a computation from scratch.
+    Price.objects.all().delete()
+    mark_listings_changed(listing_ids)
+    update_prices_incremental(avg_periods=['week', 'month'])
+    prices_new = pd.DataFrame(list(Price.objects.values()))
+    columns = ['product_id', 'time', 'avg_period', 'price_type', 'price']
+    pd.testing.assert_frame_equal(
+            prices_moved[columns].sort_values(columns[:4], ignore_index=True),
+            prices_new[columns].sort_values(columns[:4], ignore_index=True))
+    
+    #A deleted listing removes its prices from its interval.
+    old_times = read_listing_times(['l1'])
+    Listing.objects.filter(id='l1').delete()
+    mark_listings_changed(['l1'], old_times)
+    update_prices_incremental(avg_periods=['week', 'month'])
+    prices_deleted = pd.DataFrame(list(Price.objects.values()))
+    Price.objects.all().delete()
+    mark_listings_changed(listing_ids)
+    update_prices_incremental(avg_periods=['week', 'month'])
+    prices_new = pd.DataFrame(list(Price.objects.values()))
+    pd.testing.assert_frame_equal(
+            prices_deleted[columns].sort_values(columns[:4], 
+                                                ignore_index=True),
+            prices_new[columns].sort_values(columns[:4], ignore_index=True))
+
+
+@pytest.mark.django_db
+def test_find_observed_prices():
+    print("Start")
+    from econdata.models import Listing
+    from econdata.prices import find_observed_prices, read_listings_for_prices
+    from libclair.prices import PriceEstimator
+    
+    create_test_data()
+    Listing.objects.filter(id='l3').update(is_sold=False)
+    
+    prices = find_observed_prices()
+    print(prices.to_string())
+    assert sorted(prices['listing']) == ['l1', 'l4', 'l5']
+    assert list(prices.sort_values('listing')['product']) == ['a', 'c', 'a']
+    assert all(prices['type'] == 'observed')
+    
+    #Same result as the algorithm that works on frames.
+    listings = read_listings_for_prices(Listing.objects.all())
+    prices_fr = PriceEstimator().find_observed_prices(listings)
+    pd.testing.assert_frame_equal(prices.sort_index(), 
+                                  prices_fr.sort_index()[prices.columns])
+    
+    prices = find_observed_prices(Listing.objects.filter(time__lt='2017-01-04'))
+    assert list(prices['listing']) == ['l1']
+
+
+@pytest.mark.django_db
+def test_compute_average_prices_cached():
+    print("Start")
+    from econdata.models import (Listing, Product, ProductsInListing, 
+                                 PriceStatisticsDay, PriceStatisticsBlock)
+    from econdata.prices import (compute_average_prices_cached, 
+                                 read_listings_for_prices, 
+                                 mark_listings_changed)
+    from libclair.prices import PriceEstimator
+    
+    create_test_data()
+    
+    #The first call computes and stores the statistics of all days.
+    prices = compute_average_prices_cached('2017-01-02', '2017-01-16', 'week')
+    print(prices.to_string())
+    assert PriceStatisticsDay.objects.count() == 14
+    assert PriceStatisticsDay.objects.filter(n_listings__gt=0).count() == 5
+    assert PriceStatisticsBlock.objects.count() == 6
+    
+    #Same prices as the computation from the listings.
+    listings = read_listings_for_prices(Listing.objects.all())
+    prices_l = PriceEstimator().compute_prices(listings, 
+                                               Product.objects.all())
+    prices_l = prices_l[prices_l['type'] == 'average']
+    assert sorted(prices['id']) == sorted(prices_l['id'])
+    for pid in prices.index:
+        assert abs(prices.at[pid, 'price'] - prices_l.at[pid, 'price']) < 1e-9
+    
+    #The second call uses only the cache.
+    Listing.objects.filter(id='l1').update(price=1000.)
+    prices_2 = compute_average_prices_cached('2017-01-02', '2017-01-16', 
+                                             'week')
+    assert list(prices_2['price']) == list(prices['price'])
+    
+    #Changes of listings and products invalidate the statistics of the day.
+    mark_listings_changed(['l1'])
+    assert PriceStatisticsDay.objects.count() == 13
+    ProductsInListing.objects.filter(listing_id='l5').delete()
+    assert PriceStatisticsDay.objects.count() == 12
+    #Saving a listing sends no signal; its writer marks it as changed.
+    Listing.objects.get(id='l6').save()
+    assert PriceStatisticsDay.objects.count() == 12
+    mark_listings_changed(['l6'])
+    assert PriceStatisticsDay.objects.count() == 11
+    prices_3 = compute_average_prices_cached('2017-01-02', '2017-01-16', 
+                                             'week')
+    print(prices_3.to_string())
+    assert PriceStatisticsDay.objects.count() == 14
+    #Price of "l1" has changed. Without "l5", the products of "l6" 
+    #can't be separated.
+    assert prices_3.at[prices.index[0], 'price'] > 7.5
+    assert len(prices_3) == 3
+    
+    #New products invalidate all statistics.
+    Product.objects.create(id='d', name='Product d')
+    assert PriceStatisticsDay.objects.count() == 0
+    
+    
+def test_EstimateCache():
+    from econdata.prices import EstimateCache
+    
+    now = [0.]
+    cache = EstimateCache(max_size=2, ttl=10., timer=lambda: now[0])
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    #'b' is least recently used, and removed.
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    #Entries expire.
+    now[0] = 11.
+    assert cache.get('a') is None
+    assert len(cache) == 1
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+@pytest.mark.django_db
+def test_estimate_prices():
+    print("Start")
+    from econdata.models import Listing, get_data_version
+    from econdata.prices import (EstimateCache, estimate_prices, 
+                                 mark_listings_changed)
+    
+    create_test_data()
+    cache = EstimateCache()
+    
+    prices = estimate_prices(['a'], '2017-01-02', '2017-01-16', cache=cache)
+    print(prices.to_string())
+    assert set(prices['product']) == {'a'}
+    assert len(prices[prices['type'] == 'average']) == 2
+    assert cache.misses == 1
+    
+    #The second query comes from the cache.
+    prices_2 = estimate_prices(['a'], '2017-01-02', '2017-01-16', cache=cache)
+    assert cache.hits == 1
+    pd.testing.assert_frame_equal(prices, prices_2)
+    
+    #Writing listings changes the data version. 
+    version = get_data_version()
+    Listing.objects.filter(id='l1').update(price=20.)
+    mark_listings_changed(['l1'])
+    assert get_data_version() == version + 1
+    prices_3 = estimate_prices(['a'], '2017-01-02', '2017-01-16', cache=cache)
+    assert cache.misses == 2
+    assert prices_3['price'].max() > prices['price'].max()
+
+
+@pytest.mark.django_db
+def test_estimate_prices_ranges():
+    "Ranges that are not aligned to periods, and connected components."
+    print("Start")
+    from econdata.models import Listing, Product
+    from econdata.prices import (estimate_prices, read_listings_for_prices,
+                                 find_component_listings)
+    from libclair.prices import PriceEstimator
+    
+    create_test_data()
+    estimator = PriceEstimator()
+    #Listing l3 contains only product b, but b is sold together with a.
+    listing_ids = find_component_listings(
+                        ['a'], pd.Timestamp('2017-01-02', tz='UTC'), 
+                        pd.Timestamp('2017-01-16', tz='UTC'), estimator)
+    assert sorted(listing_ids) == ['l1', 'l2', 'l3', 'l5', 'l6']
+    
+    #The same prices as the prices from all listings.
+    listings = read_listings_for_prices(Listing.objects.all())
+    prices_all = estimator.compute_prices(
+                        listings, Product.objects.all(), 
+                        pd.Timestamp('2017-01-02', tz='UTC'), 
+                        pd.Timestamp('2017-01-16', tz='UTC'))
+    prices_all = prices_all[(prices_all['product'] == 'a') & 
+                            (prices_all['type'] == 'average')]
+    prices = estimate_prices(['a'], '2017-01-02', '2017-01-16', cache=None)
+    avg_prices = prices[prices['type'] == 'average']
+    np.testing.assert_allclose(sorted(avg_prices['price']), 
+                               sorted(prices_all['price']))
+    
+    #The range is extended to whole weeks.
+    for start, end, n_weeks in [('2017-01-03', '2017-01-09', 1), 
+                                ('2017-01-02', '2017-01-12', 2), 
+                                ('2017-01-02T00:00+05:00', '2017-01-09', 1),
+                                ('2017-01-04', '2017-01-04T06:00', 1)]:
+        prices = estimate_prices(['a'], start, end, cache=None)
+        print(start, end, '\n', prices.to_string())
+        assert len(prices[prices['type'] == 'average']) == n_weeks
+    
+    #Rolling windows use the listings before the start of the range.
+    prices = estimate_prices(['a'], '2017-01-09', '2017-01-10', 
+                             avg_period='rolling-7d', cache=None)
+    print(prices.to_string())
+    assert list(prices['avg_num_listings']) == [2]
+
+
+if __name__ == "__main__":
+    #One can't use models without this
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'clairweb.settings'
+    django.setup()
+
+    test_update_prices_incremental()
+    test_update_prices_incremental_month()
+    test_update_prices_incremental_moved()
+    test_find_observed_prices()
+    test_compute_average_prices_cached()
+    test_EstimateCache()
+    test_estimate_prices()
+    test_estimate_prices_ranges()
+    
+    pass #IGNORE:W0107
@@ -0,0 +1,93 @@
+###############################################################################
+#    Clair - Project to discover prices on e-commerce sites.                  #
+#                                                                             #
+#    Copyright (C) 2013 by Eike Welk                                          #
+#    eike.welk@gmx.net                                                        #
+#                                                                             #
+#    License: GPL Version 3                                                   #
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+"""
+Test module ``econdata.views``, the pages and the REST API.
+"""
+            
+import os
+
+import pytest #contains `skip`, `fail`, `raises`, `config` #IGNORE:W0611
+import pandas as pd
+import django
+
+
+@pytest.mark.django_db
+def test_PriceEstimateViewSet():
+    print("Start")
+    from rest_framework.test import APIClient
+    from econdata.models import Listing, Product, ProductsInListing
+    from econdata.prices import estimate_cache
+    
+    Product.objects.create(id='a', name='Product a')
+    for lid, time, price in [('l1', '2017-01-03', 10.), 
+                             ('l2', '2017-01-04', 14.)]:
+        Listing.objects.create(id=lid, site='ebay', id_site=lid, title=lid, 
+                               time=pd.Timestamp(time, tz='UTC'), 
+                               currency='EUR', price=price, is_sold=True,
+                               condition='new')
+        ProductsInListing.objects.create(listing_id=lid, product_id='a')
+    estimate_cache.clear()
+    
+    client = APIClient()
+    url = '/econdata/api/price-estimates/'
+    response = client.get(url, {'products': 'a', 'start': '2017-01-02', 
+                                'end': '2017-01-09'})
+    print(response.data)
+    assert response.status_code == 200
+    avg_prices = [p for p in response.data if p['price_type'] == 'average']
+    assert len(avg_prices) == 1
+    assert avg_prices[0]['product'] == 'a'
+    #Least square solution of the scaled equations: 1 = x / 10, 1 = x / 14 
+    x = (1/10 + 1/14) / (1/10**2 + 1/14**2)
+    assert avg_prices[0]['price'] == pytest.approx(0.7 * x)
+    assert avg_prices[0]['time'] == '2017-01-05T12:00:00+00:00'
+    assert len(response.data) == 3
+    
+    #Second query is answered from the cache.
+    response = client.get(url, {'products': 'a', 'start': '2017-01-02', 
+                                'end': '2017-01-09'})
+    assert response.status_code == 200
+    assert estimate_cache.hits == 1
+    
+    response = client.get(url, {'products': 'a', 'start': '2017-01-02'})
+    assert response.status_code == 400
+    response = client.get(url, {'products': 'a', 'start': '2017-01-02', 
+                                'end': '2017-01-09', 'avg_period': 'year'})
+    assert response.status_code == 400
+    for params in [{'start': '', 'end': '2017-01-09'}, 
+                   {'start': '2017-01-09', 'end': '2017-01-02'}, 
+                   {'start': '2017-01-02', 'end': '2017-01-02'}, 
+                   {'start': '2017-01-02', 'end': '2017-01-09', 'products': ''},
+                   {'start': '2017-01-02', 'end': '2017-01-09', 'products': 'x'}]:
+        response = client.get(url, dict({'products': 'a'}, **params))
+        print(params, response.data)
+        assert response.status_code == 400
+
+
+if __name__ == "__main__":
+    #One can't use models without this
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'clairweb.settings'
+    django.setup()
+
+    test_PriceEstimateViewSet()
+    
+    pass #IGNORE:W0107
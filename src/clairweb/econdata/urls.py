@@ -9,7 +9,8 @@ router = routers.DefaultRouter()
 router.register(r'listings', views.ListingViewSet)
 router.register(r'products', views.ProductViewSet)
 router.register(r'prices', views.PriceViewSet)
-router.register(r'products-in-listings', views.ProductsInListingViewSet, base_name='ProductsInListing')
+router.register(r'products-in-listings', views.ProductsInListingViewSet, basename='ProductsInListing')
+router.register(r'price-estimates', views.PriceEstimateViewSet, basename='PriceEstimate')
 
 urlpatterns = [
     url(r'^$', views.index),
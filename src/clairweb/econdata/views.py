@@ -1,13 +1,16 @@
 from django.shortcuts import render
 from django.forms import ModelForm
 #from django.http import HttpResponse
-from rest_framework import viewsets
+import pandas as pd
+from rest_framework import viewsets, status
+from rest_framework.response import Response
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit
 
 from econdata.models import Listing, Product, Price, ProductsInListing
 from econdata.serializers import ListingSerializer, ProductSerializer, PriceSerializer, \
                          ProductsInListingSerializer
+from econdata.prices import estimate_prices, to_utc
 
 
 # Regular Pages ---------------------------------------------------------------
@@ -111,3 +114,63 @@ class ProductsInListingViewSet(viewsets.ModelViewSet):
         else:
             # Return all records
             return ProductsInListing.objects.all()
+
+
+class PriceEstimateViewSet(viewsets.ViewSet):
+    """
+    API endpoint that estimates prices on demand, from the listings. 
+    Repeated queries are answered from a cache, until listings are written.
+    
+    Query parameters: 
+    
+    * ``products``: Comma separated product IDs.
+    * ``start``, ``end``: Time range, for example ``2017-01-01``. 
+      It is extended to whole averaging periods.
+    * ``avg_period``: "day", "week" (default), "month", "rolling-30d", ...
+    """
+    price_fields = ['id', 'price', 'currency', 'condition', 'time', 'product', 
+                    'listing', 'price_type', 'avg_period', 'avg_num_listings']
+    
+    def list(self, request):
+        params = request.query_params
+        try:
+            product_ids = [pid for pid in params['products'].split(',') 
+                           if pid]
+            time_start = pd.Timestamp(params['start'])
+            time_end = pd.Timestamp(params['end'])
+        except (KeyError, ValueError) as err:
+            return Response({'detail': 'Missing or invalid parameter: {}'
+                                       .format(err)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if pd.isnull(time_start) or pd.isnull(time_end):
+            return Response({'detail': 'Parameters "start" and "end" '
+                                       'must not be empty.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if to_utc(time_start) >= to_utc(time_end):
+            return Response({'detail': 'Parameter "start" must be before '
+                                       '"end".'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not product_ids:
+            return Response({'detail': 'Parameter "products" is empty.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        unknown_ids = set(product_ids) - set(
+                                Product.objects.filter(id__in=product_ids)
+                                               .values_list('id', flat=True))
+        if unknown_ids:
+            return Response({'detail': 'Unknown products: {}'
+                                       .format(', '.join(sorted(unknown_ids)))},
+                            status=status.HTTP_400_BAD_REQUEST)
+        avg_period = params.get('avg_period', 'week')
+        
+        try:
+            prices = estimate_prices(product_ids, time_start, time_end, 
+                                     avg_period)
+        except NotImplementedError as err:
+            return Response({'detail': str(err)}, 
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        prices = prices.rename(columns={'type': 'price_type'})
+        prices = prices[self.price_fields].sort_values(['time', 'product'])
+        prices['time'] = [time.isoformat() for time in prices['time']]
+        prices = prices.astype(object).where(prices.notnull(), None)
+        return Response(prices.to_dict('records'))
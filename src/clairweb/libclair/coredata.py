@@ -25,6 +25,9 @@ Central data structures and basic operations on them.
 """
 
 
+import numpy as np
+import pandas as pd
+
 from libclair.descriptors import (
                     BoolD, StrD, IntD, FloatD, DateTimeD, 
                     ListD, # DictD,
@@ -205,3 +208,77 @@ UPDATE_TASK_DESCRIPTOR = TableDescriptor(
      FD("listings", ListD(StrD), None,
         "List of listing IDs. The listings that should be updated."),
      ])
+
+
+def make_price_frame(nrows=None, index=None):
+    """
+    Create empty ``pandas.DataFrame`` for prices. 
+    The columns are described by ``PRICE_DESCRIPTOR``.
+    """
+    from libclair.dataframes import make_data_frame
+    return make_data_frame(PRICE_DESCRIPTOR, nrows, index)
+
+
+def make_price_id(price_data):
+    """
+    Create a unique ID for a price.
+    
+    The ID consists of the price's time, product, listing, and type. 
+    ``price_data`` is a ``dict`` or a ``pandas.Series``.
+    """
+    return "{time}-{product}-{listing}-{type}".format(
+                    time=pd.Timestamp(price_data["time"]).isoformat(), 
+                    product=price_data["product"], 
+                    listing=price_data["listing"], 
+                    type=price_data["type"])
+
+
+def make_price_ids(prices):
+    """
+    Create unique IDs for many prices. Vectorized version of 
+    ``make_price_id``, that creates the same IDs.
+    
+    ``prices`` is a ``pandas.DataFrame`` with (at least) the columns "time", 
+    "product", "listing", "type". Returns a ``pandas.Series`` of strings,
+    with the index of ``prices``.
+    """
+    #Convert each distinct time only once to a string. 
+    #All prices from a listing have the same time.
+    codes, times = pd.factorize(prices["time"])
+    #Code -1 (``NaT``) selects the last element.
+    time_strs = np.append(_format_times_iso(times), "NaT").astype(object)
+    time_strs = time_strs[codes]
+    return (time_strs + "-" + prices["product"].astype(str) + 
+            "-" + prices["listing"].astype(str) + "-" + prices["type"])
+
+
+def _format_times_iso(times):
+    """
+    Convert times to strings with ``Timestamp.isoformat``. 
+    
+    Fast path for times without time zone or in UTC: the strings are 
+    created by ``np.datetime_as_string``. Times with nanoseconds, and 
+    other time zones, are converted one by one.
+    """
+    try:
+        times = pd.DatetimeIndex(times)
+    except (TypeError, ValueError):
+        #Different time zones
+        return np.array([pd.Timestamp(t).isoformat() for t in times], 
+                        dtype=object)
+    if times.tz is not None and str(times.tz) != "UTC":
+        return np.array([t.isoformat() for t in times], dtype=object)
+    
+    suffix = "" if times.tz is None else "+00:00"
+    if times.tz is not None:
+        times = times.tz_localize(None)
+    values = times.values
+    #Like ``isoformat``: microseconds only if they are not 0.
+    time_strs = np.datetime_as_string(values, unit="s").astype(object)
+    has_micros = values.astype("int64") % 10**9 != 0
+    time_strs[has_micros] = np.datetime_as_string(values[has_micros], 
+                                                  unit="us")
+    has_nanos = values.astype("int64") % 10**3 != 0
+    time_strs[has_nanos] = [pd.Timestamp(t).isoformat() 
+                            for t in values[has_nanos]]
+    return time_strs + suffix
@@ -31,15 +31,25 @@ Algorithms that involve multiple rows of a table are implemented with
 ``DataFrame`` objects.
 """
 
+import itertools
+
 import numpy as np
 import pandas  as pd
-from django.db import models, transaction
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Cast
 # from django.db.models import QuerySet
 # from django.db import models.query.QuerySet
 
 from libclair import descriptors 
 
 
+CATEGORY_FIELDS = ['currency']
+"""
+Names of ``CharField`` columns without ``choices``, that contain short codes, 
+for example 'EUR'. ``read_frame`` can store them as categories.
+"""
+
 
 def convert_model_to_descriptor(dj_model):
     """
@@ -65,6 +75,7 @@ def _convert_field_to_descriptor(dj_field):
     
     type_trans = {
         models.CharField: descriptors.StrD,
+        models.TextField: descriptors.StrD,
         models.URLField: descriptors.StrD,
         models.FloatField: descriptors.FloatD,
         models.IntegerField: descriptors.IntD,
@@ -119,7 +130,7 @@ def make_data_series(descr, nrows=None, index=None):
     default_val = descr.default_val
     
     if descr.data_type == descriptors.DateTimeD:
-        temp = pd.Series(data=default_val, index=index, dtype=pd.Timestamp)
+        temp = pd.Series(data=default_val, index=index, dtype=object)
         return pd.to_datetime(temp)
         
     if   descr.data_type == descriptors.BoolD:
@@ -181,7 +192,8 @@ def make_data_frame(descr, nrows=None, index=None):
     return dframe
 
 
-def write_frame_create(pd_frame, db_model, fieldnames=None, delete=False):
+def write_frame_create(pd_frame, db_model, fieldnames=None, delete=False,
+                       chunksize=1000):
     """
     Write a Pandas ``DataFrame`` into Django's database, as new records.
     
@@ -191,11 +203,14 @@ def write_frame_create(pd_frame, db_model, fieldnames=None, delete=False):
     
     Columns that are not in the database are ignored.
     
-    The fastest way to write new records into the database.
+    The fastest way to write new records into the database. The records are
+    created with ``bulk_create`` in chunks of ``chunksize`` rows. 
+    Missing values (``nan``, ``NaT``) are written as ``NULL``.
     """
     assert isinstance(pd_frame, pd.DataFrame)
     assert issubclass(db_model, models.Model)
     assert isinstance(fieldnames, (set, list, tuple, type(None)))
+    assert isinstance(chunksize, int) and chunksize > 0
     
     # If no field names given, try to write all of the frame's columns
     if fieldnames is None:
@@ -223,11 +238,11 @@ def write_frame_create(pd_frame, db_model, fieldnames=None, delete=False):
                 db_model.objects.filter(**delete_kwargs).delete()
 
         # Create the rows in the DataFrame as new records in the database.
-        rows = []
-        for i in range(len(wr_frame)):
-            kwargs = dict(wr_frame.iloc[i])
-            rows.append(db_model(**kwargs))
-        db_model.objects.bulk_create(rows)
+        for i_start in range(0, len(wr_frame), chunksize):
+            chunk = wr_frame.iloc[i_start:i_start + chunksize]
+            rows = [db_model(**kwargs) 
+                    for kwargs in _convert_frame_to_records(chunk)]
+            db_model.objects.bulk_create(rows)
 
 
 def write_frame(pd_frame, db_model, fieldnames=None, idnames=None):
@@ -237,6 +252,186 @@ def write_frame(pd_frame, db_model, fieldnames=None, idnames=None):
     The algorithm updates existing records, or creates new records if necessary.
     Columns that are not in the database table are ignored.
     """
+    pd_frame, fieldnames, idnames = _check_write_args(pd_frame, db_model, 
+                                                      fieldnames, idnames)
+    
+    # 'defaults' is a special argument of Django's function `update_or_create`
+    if 'defaults' in fieldnames:
+        raise KeyError('Column name "defaults" is illegal in this algorithm.')
+    
+    with transaction.atomic():
+        for i in range(len(pd_frame)):
+            record = pd_frame.iloc[i]
+            kwargs = {name: record[name] for name in idnames}
+            kwargs['defaults'] = dict(record)
+            db_model.objects.update_or_create(**kwargs)
+
+
+def write_frame_bulk(pd_frame, db_model, fieldnames=None, idnames=None, 
+                     chunksize=1000, update_batch_size=100):
+    """
+    Write a Pandas ``DataFrame`` into Django's database, with few queries.
+    
+    Has the same semantics as ``write_frame``: existing records are updated, 
+    new records are created. Records are identified by the columns in 
+    ``idnames``. Columns that are not in the database table are ignored.
+    If several rows have the same ID, the last row is written.
+    
+    If the database supports ``INSERT ... ON CONFLICT ... DO UPDATE`` 
+    (SQLite 3.24 or newer, PostgreSQL), and ``idnames`` are unique in the 
+    model, each chunk of ``chunksize`` rows is written with native upsert
+    statements, see ``_upsert_records``. 
+    
+    Otherwise the already existing records of each chunk are searched with 
+    one query, then the new records are inserted with ``bulk_create`` and 
+    the existing records are updated with ``bulk_update``, in batches of 
+    ``update_batch_size`` rows. (Each batch is one ``UPDATE`` with ``CASE`` 
+    expressions, which become slow for large batches.) 
+    
+    Missing values (``nan``, ``NaT``) are written as ``NULL``.
+    """
+    assert isinstance(chunksize, int) and chunksize > 0
+    assert isinstance(update_batch_size, int) and update_batch_size > 0
+    pd_frame, fieldnames, idnames = _check_write_args(pd_frame, db_model, 
+                                                      fieldnames, idnames)
+    idnames = sorted(idnames)
+    pk_name = db_model._meta.pk.name
+    update_names = sorted(fieldnames - set(idnames) - {pk_name})
+    
+    # The last row wins, as with ``write_frame``.
+    pd_frame = pd_frame.drop_duplicates(subset=idnames, keep='last')
+    
+    db_alias = router.db_for_write(db_model)
+    use_upsert = (_supports_native_upsert(connections[db_alias]) and 
+                  _is_unique_key(db_model, idnames))
+
+    with transaction.atomic(using=db_alias):
+        for i_start in range(0, len(pd_frame), chunksize):
+            chunk = pd_frame.iloc[i_start:i_start + chunksize]
+            records = _convert_frame_to_records(chunk)
+            
+            if use_upsert:
+                _upsert_records(records, db_model, connections[db_alias], 
+                                idnames, update_names)
+                continue
+            
+            # Split the chunk into new and existing records.
+            pks = _find_existing_pks(chunk, db_model, idnames)
+            new_objs, old_objs = [], []
+            for kwargs, pk in zip(records, pks):
+                obj = db_model(**kwargs)
+                if pk is None:
+                    new_objs.append(obj)
+                else:
+                    obj.pk = pk
+                    old_objs.append(obj)
+            
+            db_model.objects.bulk_create(new_objs)
+            if old_objs and update_names:
+                db_model.objects.bulk_update(old_objs, update_names, 
+                                             batch_size=update_batch_size)
+
+
+def _supports_native_upsert(connection):
+    "Test if the database understands ``INSERT ... ON CONFLICT``."
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 24, 0)
+    return False
+
+
+def _is_unique_key(db_model, idnames):
+    """
+    Test if the fields ``idnames`` have a unique constraint in the database,
+    which ``INSERT ... ON CONFLICT (idnames)`` needs.
+    """
+    idnames = set(idnames)
+    opts = db_model._meta
+    if len(idnames) == 1:
+        field = opts.get_field(next(iter(idnames)))
+        if field.primary_key or field.unique:
+            return True
+    unique_sets = [set(names) for names in opts.unique_together]
+    unique_sets += [set(constr.fields) for constr in opts.constraints 
+                    if isinstance(constr, models.UniqueConstraint) and 
+                       constr.condition is None]
+    return idnames in unique_sets
+
+
+def _upsert_records(records, db_model, connection, idnames, update_names):
+    """
+    Write records with ``INSERT ... ON CONFLICT (idnames) DO UPDATE``. 
+    
+    New records get all fields of the model; the fields that are not in 
+    the records get their default values, like with ``bulk_create``. 
+    Existing records get only the fields ``update_names``, like with 
+    ``bulk_update``. The values are converted like Django's own queries do 
+    it (``get_db_prep_save``). 
+    
+    Parameters
+    ----------
+    
+    records : list[dict]
+        The rows, as returned by ``_convert_frame_to_records``.
+    """
+    if not records:
+        return
+    opts = db_model._meta
+    rec_names = set(records[0].keys())
+    # An automatic primary key that is not in the records is created by 
+    # the database.
+    fields = [f for f in opts.concrete_fields 
+              if f.name in rec_names or 
+                 not (f.primary_key and isinstance(f, models.AutoField))]
+    defaults = {f.name: f.get_default() for f in fields 
+                if f.name not in rec_names}
+    
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(f.column) for f in fields)
+    conflict = ', '.join(qn(opts.get_field(name).column) for name in idnames)
+    if update_names:
+        update_cols = [qn(opts.get_field(name).column) 
+                       for name in update_names]
+        action = 'DO UPDATE SET ' + ', '.join(
+                        '{c} = EXCLUDED.{c}'.format(c=col) 
+                        for col in update_cols)
+    else:
+        action = 'DO NOTHING'
+    
+    batch_size = max(connection.ops.bulk_batch_size(fields, records), 1)
+    with connection.cursor() as cursor:
+        for i_start in range(0, len(records), batch_size):
+            batch = records[i_start:i_start + batch_size]
+            params = []
+            for record in batch:
+                for field in fields:
+                    value = record[field.name] if field.name in rec_names \
+                            else defaults[field.name]
+                    params.append(field.get_db_prep_save(value, connection))
+            row_sql = '(' + ', '.join(['%s'] * len(fields)) + ')'
+            sql = ('INSERT INTO {table} ({columns}) VALUES {rows} '
+                   'ON CONFLICT ({conflict}) {action}'
+                   .format(table=qn(opts.db_table), columns=columns, 
+                           rows=', '.join([row_sql] * len(batch)), 
+                           conflict=conflict, action=action))
+            cursor.execute(sql, params)
+
+
+def _check_write_args(pd_frame, db_model, fieldnames, idnames):
+    """
+    Check and normalize the arguments of the ``write_frame*`` functions.
+    
+    Returns
+    -------
+    
+    pd_frame : pandas.DataFrame
+        The columns of ``pd_frame`` that can be written to the database.
+        
+    fieldnames, idnames : set[str]
+        Names of the columns that are written, and names of the columns
+        that identify existing records.
+    """
     assert isinstance(pd_frame, pd.DataFrame)
     assert issubclass(db_model, models.Model)
     assert isinstance(fieldnames, (set, list, tuple, type(None)))
@@ -255,10 +450,6 @@ def write_frame(pd_frame, db_model, fieldnames=None, idnames=None):
     else:
         idnames = set(idnames)
     
-    # 'defaults' is a special argument of Django's function `update_or_create`
-    if 'defaults' in fieldnames:
-        raise KeyError('Column name "defaults" is illegal in this algorithm.')
-    
     # Drop all columns that have no corresponding field in the database
     db_all_fields = db_model._meta.get_fields()
     db_all_fieldnames = set([f.name for f in db_all_fields
@@ -277,33 +468,176 @@ def write_frame(pd_frame, db_model, fieldnames=None, idnames=None):
             'Offending columns: {err_names}'
             .format(err_names=idnames.difference(fieldnames)))
     
-    with transaction.atomic():
-        for i in range(len(pd_frame)):
-            record = pd_frame.iloc[i]
-            kwargs = {name: record[name] for name in idnames}
-            kwargs['defaults'] = dict(record)
-            db_model.objects.update_or_create(**kwargs)
+    return pd_frame, fieldnames, idnames
+
+
+def _find_existing_pks(pd_frame, db_model, idnames):
+    """
+    Find the primary keys of the rows that already exist in the database.
+    
+    Uses a single query. Rows are identified by the columns ``idnames``.
+    
+    Returns
+    -------
+    
+    list
+        The primary key of each row in ``pd_frame``, or ``None`` if the row 
+        is not yet in the database.
+    """
+    pk_name = db_model._meta.pk.name
+    # Programatically create argument like: ``.filter(id__in=ids)``
+    filter_kwargs = {name + '__in': pd_frame[name].unique().tolist() 
+                     for name in idnames}
+    key_vals = db_model.objects.filter(**filter_kwargs) \
+                               .values_list(pk_name, *idnames)
+    existing = pd.DataFrame(list(key_vals), columns=['_pk'] + idnames)
+    if len(existing) == 0:
+        return [None] * len(pd_frame)
+    
+    # Match the IDs of the frame with the IDs from the database.
+    existing['_pk'] = existing['_pk'].astype(object)
+    existing = existing.drop_duplicates(subset=idnames, keep='last')
+    matched = pd_frame[idnames].merge(existing, how='left', on=idnames)
+    pks = matched['_pk'].where(matched['_pk'].notnull(), None)
+    return pks.tolist()
+
+
+def _convert_frame_to_records(pd_frame):
+    """
+    Convert a ``DataFrame`` to a list of ``dict``, one ``dict`` for each row.
+    
+    Missing values (``nan``, ``NaT``) are converted to ``None``.
+    The conversion is done column by column, rows are never accessed as 
+    ``pandas.Series`` objects.
+    """
+    names = pd_frame.columns.tolist()
+    columns = []
+    for name in names:
+        col = pd_frame[name]
+        if col.hasnans:
+            col = col.astype(object).where(col.notnull(), None)
+        columns.append(col.tolist())
+    return [dict(zip(names, row)) for row in zip(*columns)]
 
 
-def read_frame(queryset, fieldnames=None):
+def read_frame(queryset, fieldnames=None, compact=False):
     """
     Read subset of a database table from the Database.
+    
+    Parameters
+    ----------
+    
+    queryset : django.db.models.QuerySet
+        The records that are read.
+        
+    fieldnames : list[str]
+        Names of the columns that are read. If ``None``, all columns are read.
+        
+    compact : bool
+        If ``True`` create a frame that needs less memory, and that is 
+        loaded faster. The values are written directly into pre-allocated, 
+        typed arrays, no intermediate frame of Python objects is created. 
+        See ``bench_dataframes.test_read_frame``. Data types: 
+        
+        * Integer columns are stored as ``int32`` if all values fit.
+        * Integer and boolean columns that can contain ``NULL`` are stored 
+          with Pandas' nullable types (``Int32``/``Int64``) and ``boolean``. 
+        * Short codes, ``CharField`` with ``choices`` or whose name is in 
+          ``CATEGORY_FIELDS``, are stored as ``category``.
+          For example ``Listing.currency`` or ``Listing.status``.
     """
     assert isinstance(queryset, models.QuerySet)
     assert isinstance(fieldnames, (list, tuple, type(None)))
 
-    all_fields = queryset.model._meta.get_fields()
+    fields, fieldnames = _select_read_fields(queryset.model, fieldnames)
+    if compact:
+        return _read_frame_compact(queryset, fields, fieldnames)
+
+    # Get data from database and construct the dataframe.
+    vals = list(queryset.values_list(*fieldnames))
+    frame = pd.DataFrame(vals, columns=fieldnames)
+    return _convert_read_types(frame, fields)
+
+
+def read_frame_chunks(queryset, fieldnames=None, chunksize=10000, 
+                      defer_text=False):
+    """
+    Read a database table from the Database, in chunks of ``chunksize`` rows.
+    
+    A generator that yields ``pandas.DataFrame`` objects. The data types are 
+    the same as those of ``read_frame``. The index labels continue from 
+    chunk to chunk, concatenating all chunks gives the same frame as 
+    ``read_frame``. 
+    
+    The rows are fetched with a server side cursor (if the database supports
+    it); the memory consumption depends only on ``chunksize``, not on the 
+    size of the table.
+    
+    Parameters
+    ----------
+    
+    queryset : django.db.models.QuerySet
+        The records that are read.
+        
+    fieldnames : list[str]
+        Names of the columns that are read. If ``None``, all columns are read.
+        
+    chunksize : int
+        Maximum number of rows in each yielded ``DataFrame``.
+        
+    defer_text : bool
+        If ``True``, and ``fieldnames`` is ``None``, large text columns 
+        (``TextField``, for example ``Listing.description``) are not read.
+    """
+    assert isinstance(queryset, models.QuerySet)
+    assert isinstance(fieldnames, (list, tuple, type(None)))
+    assert isinstance(chunksize, int) and chunksize > 0
+
+    fields, fieldnames = _select_read_fields(queryset.model, fieldnames, 
+                                             defer_text)
+    
+    rows = queryset.values_list(*fieldnames).iterator(chunk_size=chunksize)
+    i_start = 0
+    while True:
+        vals = list(itertools.islice(rows, chunksize))
+        if len(vals) == 0:
+            break
+        index = pd.RangeIndex(i_start, i_start + len(vals))
+        frame = pd.DataFrame(vals, columns=fieldnames, index=index)
+        i_start += len(vals)
+        yield _convert_read_types(frame, fields)
+
+
+def _select_read_fields(db_model, fieldnames, defer_text=False):
+    """
+    Find the fields that are read by the ``read_frame*`` functions.
+    
+    Returns
+    -------
+    
+    fields : list[django.db.models.Field]
+        The model's fields, that are read.
+        
+    fieldnames : list[str]
+        Names of the columns that are read, in the order of the frame's columns.
+    """
+    all_fields = db_model._meta.get_fields()
     if fieldnames is None:
         fields = [f for f in all_fields if f.auto_created == False]
+        if defer_text:
+            fields = [f for f in fields if not isinstance(f, models.TextField)]
         fieldnames = [f.name for f in fields]
     else:
         fields = [f for f in all_fields if f.auto_created == False and f.name in fieldnames]
         fieldnames = list(fieldnames)
+    return fields, fieldnames
 
-    # Get data from database and construct the dataframe.
-    vals = list(queryset.values_list(*fieldnames))
-    frame = pd.DataFrame(vals, columns=fieldnames)
 
+def _convert_read_types(frame, fields):
+    """
+    Convert the columns of a frame, that was read from the database, 
+    to the data types of the model's fields.
+    """
     # Convert date and time fields to ``datetime64`` even in edge cases.
     for field in fields:
         if isinstance(field, (models.DateField, models.DateTimeField)):
@@ -315,3 +649,168 @@ def read_frame(queryset, fieldnames=None):
         
     return frame
 
+
+
+def _read_frame_compact(queryset, fields, fieldnames, chunksize=10000):
+    """
+    Read a frame from the database into pre-allocated, typed arrays.
+    
+    The data types are derived from the model with 
+    ``convert_model_to_descriptor``. See ``read_frame`` for details.
+    """
+    # The number of rows is needed to allocate the arrays.
+    n_rows = queryset.count()
+    
+    descrs = {d.name: d for d in 
+              convert_model_to_descriptor(queryset.model).column_descriptors}
+    fields_by_name = {f.name: f for f in fields}
+    builders = [_ColumnBuilder(fields_by_name[name], descrs[name], n_rows) 
+                for name in fieldnames]
+    
+    # Fetch the rows in chunks; each chunk is transposed into columns.
+    exprs = [builder.expression for builder in builders]
+    rows = queryset.values_list(*exprs).iterator(chunk_size=chunksize)
+    rows = itertools.islice(rows, n_rows)
+    n_read = 0
+    while True:
+        vals = list(itertools.islice(rows, chunksize))
+        if len(vals) == 0:
+            break
+        for builder, col_vals in zip(builders, zip(*vals)):
+            builder.put(n_read, col_vals)
+        n_read += len(vals)
+    
+    frame = pd.DataFrame({name: builder.finish(n_read) 
+                          for name, builder in zip(fieldnames, builders)},
+                         columns=fieldnames)
+    return frame
+
+
+class _ColumnBuilder(object):
+    """
+    Pre-allocated, typed storage for one column of ``read_frame``.
+    
+    Date-times and booleans are read in the database's raw representation,
+    (``expression``) and converted a whole chunk at a time. Django's 
+    converters work row by row, which is slow.
+    
+    Parameters
+    ----------
+    
+    dj_field : django.db.models.Field
+        The field that is read. Determines nullability and categories.
+        
+    descr : descriptors.FieldDescriptor
+        Determines the basic data type of the column.
+        
+    n_rows : int
+        Number of rows, that will be stored.
+    """
+    def __init__(self, dj_field, descr, n_rows):
+        assert isinstance(dj_field, models.Field)
+        assert isinstance(descr, descriptors.FieldDescriptor)
+        
+        data_type = descr.data_type
+        self.expression = dj_field.name
+        self.mask = None
+        self.categories = None
+        if data_type == descriptors.FloatD:
+            self.kind = 'float'
+            self.data = np.full(n_rows, np.nan, dtype=np.float64)
+        elif data_type in (descriptors.IntD, descriptors.BoolD):
+            self.kind = 'int' if data_type == descriptors.IntD else 'bool'
+            dtype = np.int64 if data_type == descriptors.IntD else np.bool_
+            self.data = np.zeros(n_rows, dtype=dtype)
+            if dj_field.null or isinstance(dj_field, models.NullBooleanField):
+                self.mask = np.zeros(n_rows, dtype=np.bool_)
+            if self.kind == 'bool':
+                self.expression = Cast(dj_field.name, models.IntegerField())
+        elif data_type == descriptors.DateTimeD:
+            self.kind = 'datetime'
+            self.data = np.full(n_rows, np.datetime64('NaT'), 
+                                dtype='datetime64[ns]')
+            self.expression = Cast(dj_field.name, models.TextField())
+        elif data_type == descriptors.StrD and _is_category_field(dj_field):
+            self.kind = 'category'
+            self.data = np.full(n_rows, -1, dtype=np.int32)
+            # Known categories first, so that all frames have the same 
+            # category codes.
+            self.categories = {}
+            for val, _ in dj_field.flatchoices:
+                self.categories.setdefault(val, len(self.categories))
+        else:
+            self.kind = 'object'
+            self.data = np.empty(n_rows, dtype=object)
+    
+    def put(self, i_start, values):
+        """Store ``values`` (a sequence) at positions ``i_start, ...``."""
+        slc = slice(i_start, i_start + len(values))
+        if self.kind == 'float':
+            # ``None`` is converted to ``nan``
+            self.data[slc] = np.array(values, dtype=np.float64)
+        elif self.kind in ('int', 'bool'):
+            if self.mask is not None:
+                # ``None`` is converted to ``nan``
+                vals = np.array(values, dtype=np.float64)
+                nulls = np.isnan(vals)
+                self.mask[slc] = nulls
+                vals[nulls] = 0
+                self.data[slc] = vals
+            else:
+                self.data[slc] = values
+        elif self.kind == 'datetime':
+            # ``DatetimeIndex.values`` is in UTC, without time zone.
+            times = pd.to_datetime(pd.Index(values, dtype=object), 
+                                   utc=settings.USE_TZ)
+            self.data[slc] = times.values
+        elif self.kind == 'category':
+            # ``None`` gets code -1; the last entry of ``glob_codes`` maps it 
+            # to -1 too.
+            codes, uniques = pd.factorize(np.array(values, dtype=object))
+            cats = self.categories
+            glob_codes = [cats.setdefault(u, len(cats)) for u in uniques] + [-1]
+            self.data[slc] = np.array(glob_codes, dtype=np.int32)[codes]
+        else:
+            self.data[slc] = values
+    
+    def finish(self, n_rows):
+        """Create the column (an array) from the first ``n_rows`` values."""
+        data = self.data[:n_rows]
+        mask = self.mask[:n_rows] if self.mask is not None else None
+        if self.kind == 'int':
+            data = _downcast_int(data)
+        if self.kind == 'int' and mask is not None:
+            return pd.arrays.IntegerArray(data, mask)
+        elif self.kind == 'bool' and mask is not None:
+            return pd.arrays.BooleanArray(data, mask)
+        elif self.kind == 'datetime':
+            times = pd.DatetimeIndex(data)
+            return times.tz_localize('UTC') if settings.USE_TZ else times
+        elif self.kind == 'category':
+            return pd.Categorical.from_codes(data, categories=list(self.categories))
+        return data
+
+
+def _downcast_int(data):
+    """
+    Convert an ``int64`` array to ``int32``, if all values fit. 
+    
+    Smaller types are not used, arithmetic with them overflows too easily.
+    """
+    info = np.iinfo(np.int32)
+    if len(data) == 0 or (data.min() >= info.min and data.max() <= info.max):
+        return data.astype(np.int32)
+    return data
+
+
+def _is_category_field(dj_field):
+    """
+    Return ``True`` if ``dj_field`` contains short codes, that should be 
+    stored as ``pandas.Categorical``.
+    
+    These are ``CharField`` objects with ``choices``, and those whose name is
+    in ``CATEGORY_FIELDS``.
+    """
+    if not isinstance(dj_field, models.CharField):
+        return False
+    return bool(dj_field.choices) or dj_field.name in CATEGORY_FIELDS
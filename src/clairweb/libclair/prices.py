@@ -28,15 +28,224 @@ from __future__ import division
 from __future__ import absolute_import              
 
 import logging
+import re
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import repeat
 
 import pandas as pd
 import numpy as np
 from numpy import NaN, newaxis
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+from scipy.sparse import csgraph
 
-from clair.coredata import make_price_frame, make_price_id
+from libclair.coredata import make_price_frame, make_price_ids
 
 
+class PriceStatistics(object):
+    """
+    Sufficient statistics of the price equations for each day. 
+    
+    The statistics of several days can be summed. The average prices of any 
+    period (month, rolling window, ...) can be computed from the sums, 
+    without the listings. See ``PriceEstimator.compute_daily_statistics``
+    and ``PriceEstimator.compute_average_prices``.
+    
+    ``A_d * x = b_d`` is the (row scaled) equation system of the listings 
+    of day ``d``, as in ``PriceEstimator.solve_prices_lstsq``.
+    
+    Attributes
+    ----------
+    product_ids : np.array[basestring]
+        Sorted product IDs.
+    
+    days : pd.DatetimeIndex
+        Sorted days (midnight) that have listings.
+    
+    gram : scipy.sparse.csr_matrix
+        shape = (number days, number products ** 2)
+        Row ``d`` is the flattened matrix ``A_d.T * A_d``.
+    
+    rhs : np.array[float]
+        shape = (number days, number products)
+        Row ``d`` is the vector ``A_d.T * b_d``.
+    
+    counts : np.array[int]
+        shape = (number days, number products)
+        Number of listings of each day, that contain each product.
+    
+    n_listings : np.array[int]
+        Number of listings of each day.
+    """
+    def __init__(self, product_ids, days, gram, rhs, counts, n_listings):
+        n_days, n_products = len(days), len(product_ids)
+        assert gram.shape == (n_days, n_products ** 2)
+        assert rhs.shape == counts.shape == (n_days, n_products)
+        assert n_listings.shape == (n_days,)
+        
+        self.product_ids = product_ids
+        self.days = days
+        self.gram = gram
+        self.rhs = rhs
+        self.counts = counts
+        self.n_listings = n_listings
+        
+    def sum_windows(self, starts, ends):
+        """
+        Sum the statistics of the days in time windows. 
+        
+        Parameters
+        ----------
+        starts, ends : pd.DatetimeIndex
+            Start (inclusive) and end (exclusive) of each window.
+        
+        Returns
+        -------
+        gram : scipy.sparse.csr_matrix
+        rhs, counts, n_listings : np.array
+            The sums, one row for each window. 
+        """
+        i_starts = self.days.searchsorted(starts, side="left")
+        i_ends = self.days.searchsorted(ends, side="left")
+        #Matrix with a 1 for each day of each window; the sums of all 
+        #windows are computed by a single matrix product.
+        lengths = np.maximum(i_ends - i_starts, 0)
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        indices = (np.repeat(i_starts - indptr[:-1], lengths) + 
+                   np.arange(indptr[-1]))
+        windows = sparse.csr_matrix(
+                        (np.ones(indptr[-1]), indices, indptr), 
+                        shape=(len(i_starts), len(self.days)))
+        gram = (windows @ self.gram).tocsr()
+        rhs = windows @ self.rhs
+        counts = np.rint(windows @ self.counts).astype(int)
+        n_listings = np.rint(windows @ self.n_listings).astype(int)
+        return gram, rhs, counts, n_listings
+    
+    
+    def unflatten_gram(self, gram_row):
+        """
+        Convert one row of ``gram``, or of the sums of ``sum_windows``, 
+        into a square sparse matrix. The matrix is never made dense.
+        
+        Parameters
+        ----------
+        gram_row : scipy.sparse.spmatrix
+            shape = (1, number products ** 2)
+        
+        Returns
+        -------
+        gram : scipy.sparse.csr_matrix
+            shape = (number products, number products)
+        """
+        n_products = len(self.product_ids)
+        gram_row = sparse.csr_matrix(gram_row)
+        gram_row.eliminate_zeros()
+        return sparse.csr_matrix(
+                    (gram_row.data, (gram_row.indices // n_products, 
+                                     gram_row.indices % n_products)), 
+                    shape=(n_products, n_products))
+    
+    
+    def find_components(self, gram):
+        """
+        Find the connected components of the products in a square sparse 
+        matrix ``A.T * A``. Products without listings (zero diagonal) are 
+        omitted.
+        
+        Returns
+        -------
+        components : list[np.array[int]]
+            Column indices of the products of each component.
+        """
+        active = np.flatnonzero(gram.diagonal() > 0)
+        if len(active) == 0:
+            return []
+        _, labels = csgraph.connected_components(gram[active][:, active], 
+                                                 directed=False)
+        order = np.argsort(labels, kind="stable")
+        splits = np.flatnonzero(np.diff(labels[order])) + 1
+        return np.split(active[order], splits)
+    
+    
+    def iter_blocks(self):
+        """
+        Split the statistics into independent blocks: one block for each 
+        connected component of products, of each day. Products that appear 
+        in no listing of a day are omitted.
+        
+        Only the blocks are converted to dense matrices.
+        
+        Yields
+        ------
+        day : pd.Timestamp
+        
+        block_product_ids : np.array[basestring]
+        
+        gram : np.array[float]
+            shape = (number block products, number block products)
+        
+        rhs : np.array[float]
+        
+        counts : np.array[int]
+        """
+        for i_day, day in enumerate(self.days):
+            day_gram = self.unflatten_gram(self.gram[i_day])
+            for cols in self.find_components(day_gram):
+                yield (day, self.product_ids[cols], 
+                       day_gram[cols][:, cols].toarray(), 
+                       self.rhs[i_day, cols], self.counts[i_day, cols])
+    
+    
+    @classmethod
+    def from_blocks(cls, product_ids, days, n_listings, blocks):
+        """
+        Create the statistics from blocks, the inverse of ``iter_blocks``.
+        
+        Parameters
+        ----------
+        product_ids : list[basestring]
+            IDs of all products. Must contain the products of all blocks.
+        
+        days : pd.DatetimeIndex
+            Sorted days. 
+        
+        n_listings : np.array[int]
+            Number of listings of each day.
+        
+        blocks : iterable[tuple]
+            ``(day, block_product_ids, gram, rhs, counts)``, like the 
+            results of ``iter_blocks``.
+        """
+        product_ids = np.asarray(sorted(set(product_ids)), dtype=object)
+        n_days, n_products = len(days), len(product_ids)
+        rhs = np.zeros((n_days, n_products))
+        counts = np.zeros((n_days, n_products), dtype=int)
+        gram_rows, gram_cols, gram_data = [], [], []
+        for day, block_product_ids, block_gram, block_rhs, block_counts \
+                                                                in blocks:
+            i_day = days.get_loc(day)
+            cols = np.searchsorted(product_ids, block_product_ids)
+            assert all(product_ids[cols] == block_product_ids), \
+                   "Unknown product ID in block."
+            rhs[i_day, cols] = block_rhs
+            counts[i_day, cols] = block_counts
+            gram_rows.append(np.full(len(cols) ** 2, i_day))
+            gram_cols.append((cols[:, newaxis] * n_products + 
+                              cols[newaxis, :]).ravel())
+            gram_data.append(np.asarray(block_gram, dtype=float).ravel())
+        if len(gram_data) > 0:
+            gram_rows = np.concatenate(gram_rows)
+            gram_cols = np.concatenate(gram_cols)
+            gram_data = np.concatenate(gram_data)
+        gram = sparse.csr_matrix((gram_data, (gram_rows, gram_cols)), 
+                                 shape=(n_days, n_products ** 2))
+        gram.eliminate_zeros()
+        return cls(product_ids, days, gram, rhs, counts, 
+                   np.asarray(n_listings, dtype=int))
+    
+    
 class PriceEstimator(object):
     """
     Estimate product prices from listings.
@@ -51,43 +260,42 @@ class PriceEstimator(object):
         self.default_condition = 0.7 #used, very good condition
         self.average_mid_time = datetime(2000, 1, 15)
         self.avg_period = "week"
+        self.use_sparse = False #Use sparse matrices for the price equations
+        self.min_block_size = 50 #Minimal number of products in a block
+        self.n_threads = 1 #Number of threads that solve blocks in parallel
+        self.n_processes = 1 #Number of processes that compute intervals
+        self.robust_method = None #None, "huber", "tukey": weigh outliers low
+        self.robust_max_iter = 20 #Maximum number of reweighting iterations
     
     def find_observed_prices(self, listings_frame):
         """
         Search listings_frame with only one product, and create prices from them.
         These prices are called 'observed' prices here.
         """
-        #Price data is first collected in list of dicts, that is later 
-        #converted to a ``DataFrame``. Each dict is a row of the ``DataFrame``.
-        price_data = []
-        for _, listing in listings_frame.iterrows():
-            #Select sold listings with only one product
-            curr_prods = listing["products"]
-            if len(curr_prods) != 1:
-                continue
-            if listing["sold"] != 1.:
-                continue
-            #Put the price data into dict
-            single_price_data = {}
-            single_price_data["price"] = listing["price"]
-            single_price_data["currency"] = listing["currency"]
-            single_price_data["condition"] = listing["condition"]
-            single_price_data["time"] = listing["time"]
-            single_price_data["product"] = curr_prods[0]
-            single_price_data["listing"] = listing["id"]
-            single_price_data["type"] = "observed"
-            single_price_data["avg_period"] = "none"
-            single_price_data["avg_num_listings"] = 1
-            single_price_data["id"] = make_price_id(single_price_data)
-            price_data.append(single_price_data)
-
-        price_frame = pd.DataFrame(price_data)
+        #Select sold listings with only one product
+        n_products = listings_frame["products"].str.len()
+        is_observed = (n_products == 1) & (listings_frame["sold"] == 1.)
+        listings = listings_frame[is_observed]
+        
+        price_frame = pd.DataFrame({
+            "price": listings["price"].values,
+            "currency": listings["currency"].values,
+            "condition": listings["condition"].values,
+            "time": listings["time"].array,
+            "product": listings["products"].str[0].values,
+            "listing": listings["id"].values,
+            "type": "observed",
+            "avg_period": "none",
+            "avg_num_listings": 1, 
+            }, index=range(len(listings)))
+        price_frame["id"] = make_price_ids(price_frame)
         price_frame.set_index("id", drop=False, inplace=True, 
                               verify_integrity=True)
         return price_frame
 
 
-    def compute_product_occurrence_matrix(self, listings, product_ids):
+    def compute_product_occurrence_matrix(self, listings, product_ids, 
+                                          use_sparse=False):
         """
         Compute matrix that shows which product occurs in which listing,
         And in which condition.
@@ -100,9 +308,17 @@ class PriceEstimator(object):
             
         Where ``pp`` is the unknown vector of product listing_prices.
         
+        Parameters
+        ----------
+        use_sparse : bool
+            If ``True`` return a ``scipy.sparse.csr_matrix``, otherwise a 
+            dense ``np.array``. Most entries of the matrix are 0, because each
+            listing contains only a few products. The sparse matrix needs 
+            memory proportional to the number of non zero entries.
+        
         Returns
         -------
-        matrix : np.array [float]
+        matrix : np.array [float], scipy.sparse.csr_matrix
             Array that records which product is present in which listing.
              
             shape = (number listings, number products)
@@ -128,14 +344,12 @@ class PriceEstimator(object):
         prod_list.sort()
         prod_inds = dict(zip(prod_list, range(len(prod_list))))
         
-        matrix = np.zeros((len(listings), len(products)))
-        listing_prices = np.empty(len(listings))
-        listing_prices.fill(NaN)
-        listing_ids = np.empty(len(listings), dtype=object)
-        listing_ids.fill(None)
-        product_ids = np.array(prod_list, dtype=object)
-        
-        for il, (idx, listing) in enumerate(listings.iterrows()):
+        #The matrix is first collected as (row, column, condition) triplets.
+        #Only valid listings get a row.
+        rows, cols, conditions = [], [], []
+        listing_prices = []
+        listing_ids = []
+        for idx, listing in listings.iterrows():
             curr_prods = listing["products"]
             if curr_prods is None:
                 logging.error("Undefined field 'products'. Listing ID: {}."
@@ -149,17 +363,143 @@ class PriceEstimator(object):
                 continue
             if listing["sold"] != 1.:
                 continue
-            listing_prices[il] = listing["price"]
-            listing_ids[il] = idx
+            if pd.isnull(listing["price"]):
+                continue
+            il = len(listing_prices)
+            listing_prices.append(listing["price"])
+            listing_ids.append(idx)
             curr_condition = listing["condition"]
-            for prod in curr_prods:
-                ip = prod_inds[prod]
-                matrix[il, ip] = curr_condition
+            for prod in set(curr_prods):
+                rows.append(il)
+                cols.append(prod_inds[prod])
+                conditions.append(curr_condition)
         
-        valid = ~ np.isnan(listing_prices)
-        matrix = matrix[valid, :]
-        listing_prices = listing_prices[valid]
-        listing_ids = listing_ids[valid]        
+        shape = (len(listing_prices), len(products))
+        if use_sparse:
+            matrix = sparse.csr_matrix((conditions, (rows, cols)), 
+                                       shape=shape, dtype=float)
+        else:
+            matrix = np.zeros(shape)
+            matrix[rows, cols] = conditions
+        listing_prices = np.array(listing_prices, dtype=float)
+        listing_ids = np.array(listing_ids, dtype=object)
+        product_ids = np.array(prod_list, dtype=object)
+        
+        return matrix, listing_prices, listing_ids, product_ids
+    
+    
+    def convert_listings_to_long(self, listings):
+        """
+        Convert listings to long format: one row for each product in each 
+        listing.
+        
+        Parameters
+        ----------
+        listings : pd.DataFrame
+            Listings with the columns "products", "price", "sold", 
+            "condition". The index contains the listing IDs.
+        
+        Returns
+        -------
+        listing_products : pd.DataFrame
+            Columns "listing", "product", "condition", "price", "sold". 
+            The rows of each listing are consecutive, in the order of 
+            ``listings``. Listings without products have no rows.
+        """
+        no_prods = listings["products"].isnull()
+        if no_prods.any():
+            logging.error("Undefined field 'products'. Listing IDs: {}."
+                          .format(list(listings.index[no_prods])))
+        
+        wide = listings.loc[~no_prods, ["products", "condition", 
+                                        "price", "sold"]].copy()
+        wide["listing"] = wide.index
+        listing_products = wide.explode("products")
+        #Empty lists become a single row with product NaN.
+        listing_products = listing_products[
+                                    listing_products["products"].notnull()]
+        listing_products = listing_products.rename(
+                                    columns={"products": "product"})
+        listing_products = listing_products[["listing", "product", 
+                                             "condition", "price", "sold"]]
+        return listing_products.reset_index(drop=True)
+    
+    
+    def compute_product_occurrence_matrix_long(self, listing_products, 
+                                               product_ids, use_sparse=False):
+        """
+        Compute matrix that shows which product occurs in which listing,
+        And in which condition. Vectorized version of 
+        ``compute_product_occurrence_matrix`` that works on data in long 
+        format.
+        
+        Row and column indices are computed with ``pd.factorize`` and 
+        ``pd.Categorical``, there is no loop over the listings.
+        
+        Parameters
+        ----------
+        listing_products : pd.DataFrame
+            One row for each product in each listing. Columns "listing", 
+            "product", "condition", "price", "sold". 
+            See ``convert_listings_to_long``.
+        
+        product_ids : list [basestring]
+            IDs of the products that can appear in the matrix. Listings that 
+            contain other products are ignored.
+        
+        use_sparse : bool
+            If ``True`` return a ``scipy.sparse.csr_matrix``, otherwise a 
+            dense ``np.array``.
+        
+        Returns
+        -------
+        matrix : np.array [float], scipy.sparse.csr_matrix
+            shape = (number listings, number products)
+            Same as ``compute_product_occurrence_matrix``.
+             
+        listing_prices : np.array [float]
+            Vector of known listing prices.
+        
+        listing_ids : np.array [basestring]
+            Listing IDs, corresponds to `listing_prices` and rows of `matrix`.
+            In the order of their first appearance in ``listing_products``.
+        
+        product_ids : np.array [basestring]
+            Sorted product IDs, corresponds to columns of `matrix`.
+        """
+        prod_list = sorted(set(product_ids))
+        
+        #A product that appears twice in a listing gets only one entry.
+        lprods = listing_products.drop_duplicates(["listing", "product"])
+        
+        #Remove all rows of listings that are not usable: 
+        #unknown products, not sold, no price.
+        unknown = ~lprods["product"].isin(prod_list)
+        if unknown.any():
+            logging.debug("Unknown product(s) {u}. Number of listings: {n}."
+                          .format(u=set(lprods.loc[unknown, "product"]),
+                                  n=lprods.loc[unknown, "listing"].nunique()))
+        invalid = unknown | (lprods["sold"] != 1.) | lprods["price"].isnull()
+        bad_listings = lprods.loc[invalid, "listing"].unique()
+        lprods = lprods[~lprods["listing"].isin(bad_listings)]
+        
+        rows, listing_ids = pd.factorize(lprods["listing"])
+        cols = pd.Categorical(lprods["product"], categories=prod_list).codes
+        conditions = lprods["condition"].values.astype(float)
+        #``drop_duplicates`` keeps the order of first appearance, 
+        #like ``factorize``.
+        listing_prices = lprods.drop_duplicates("listing")["price"]
+        
+        shape = (len(listing_ids), len(prod_list))
+        if use_sparse:
+            matrix = sparse.csr_matrix((conditions, (rows, cols)), 
+                                       shape=shape, dtype=float)
+        else:
+            matrix = np.zeros(shape)
+            matrix[rows, cols] = conditions
+        listing_prices = np.asarray(listing_prices, dtype=float)
+        listing_ids = np.asarray(listing_ids, dtype=object)
+        product_ids = np.array(prod_list, dtype=object)
         
         return matrix, listing_prices, listing_ids, product_ids
     
@@ -170,10 +510,10 @@ class PriceEstimator(object):
         If these rows and columns are deleted the remaining matrix has full 
         rank.
         
+        ``matrix`` can be a dense ``np.array`` or a ``scipy.sparse`` matrix.
+        
         Returns
         -------
-        matrix_new : np.array[float]
-            Modified matrix 
         good_rows, good_cols : np.array[bool]
             Index arrays to access affected rows and columns
         problem_products : list[int]
@@ -185,42 +525,104 @@ class PriceEstimator(object):
         if product_ids is None:
             product_ids = [str(i) for i in range(n_products)]
         
-        start_rank = np.linalg.matrix_rank(matrix)
-        #Find problematic columns (products): 
-        # * Add an additional row to the matrix with a single `1` 
-        #   in the column that is currently tested.
-        # * Compute the matrix rank.
-        # * If this additional `1` increases the matrix rank, this column is 
-        #   problematic. The price of its associated product can't be 
-        #   determined with linear least square algorithm.
+        #Find problematic columns (products) with a single factorization:
+        # * The price of a product can be determined, if the unit vector of 
+        #   its column is in the row space of the matrix.
+        # * The row space is the orthogonal complement of the null space.
+        #   The unit vector of a column is in the row space, if all vectors 
+        #   of the null space are 0 in this column.
+        # * The null space is spanned by the right singular vectors with 
+        #   (nearly) zero singular values.
+        null_space = self.compute_null_space(matrix)
+        null_norms = np.sqrt((null_space ** 2).sum(axis=1))
+        good_cols = null_norms <= np.sqrt(np.finfo(float).eps)
+        
+        #Problematic rows are those, where the problematic columns 
+        #have non zero entries.
+        bad_entries = abs(matrix[:, ~good_cols]).sum(axis=1)
+        good_rows = np.asarray(bad_entries).ravel() == 0
+        
         problem_products = []
-        #Vectors for fancy indexing: True for good, False for bad row/column
-        good_cols = np.ones((n_products), dtype=bool)
-        good_rows = np.ones((n_listings), dtype=bool)
-        for i_col in range(n_products):
-            addrow = np.zeros((n_products,))
-            addrow[i_col] = 1
-            new_mat = np.vstack((matrix, addrow))
-            new_rank = np.linalg.matrix_rank(new_mat)
-            if new_rank > start_rank:
-                problem_products.append(product_ids[i_col])
-                good_cols[i_col] = False
-                #Problematic rows are those, where the problematic column 
-                #has non zero entries.
-                bad_rows = matrix[:, i_col] != 0
-                good_rows = good_rows & (~bad_rows)
-                logging.debug("Product {p} (column {c}) is problematic "
-                              "for price estimation."
-                              .format(p=product_ids[i_col], c=i_col))
+        for i_col in np.flatnonzero(~good_cols):
+            problem_products.append(product_ids[i_col])
+            logging.debug("Product {p} (column {c}) is problematic "
+                          "for price estimation."
+                          .format(p=product_ids[i_col], c=i_col))
                 
         return good_rows, good_cols, problem_products
     
     
+    def compute_null_space(self, matrix):
+        """
+        Compute an orthonormal basis of the null space of a matrix.
+        
+        Dense matrices are factorized with a singular value decomposition, 
+        the tolerance is the same as in ``np.linalg.matrix_rank``. 
+        Sparse matrices are treated like in ``compute_rank_sparse``, with the 
+        eigenvalues of the small matrix ``matrix.T * matrix``.
+        
+        Returns
+        -------
+        null_space : np.array[float]
+            shape = (number columns, dimension of null space)
+            Each column is a vector of the basis.
+        """
+        n_rows, n_cols = matrix.shape
+        if sparse.issparse(matrix):
+            gram = (matrix.T @ matrix).toarray()
+            eig_vals, eig_vecs = np.linalg.eigh(gram)
+            sing_vals = np.sqrt(np.maximum(eig_vals, 0))
+            tol = sing_vals.max(initial=0) * np.sqrt(max(matrix.shape) * 
+                                                     np.finfo(float).eps)
+            return eig_vecs[:, sing_vals <= tol]
+        
+        #The full matrix `vt` is only needed when there are more columns 
+        #than rows. Otherwise it would create a huge unused matrix `u`.
+        _u, sing_vals, vt = np.linalg.svd(matrix, 
+                                          full_matrices=(n_rows < n_cols))
+        tol = sing_vals.max(initial=0) * max(matrix.shape) * np.finfo(float).eps
+        #Columns beyond the number of rows have no singular values, 
+        #they are in the null space.
+        is_null = np.ones(n_cols, dtype=bool)
+        is_null[:len(sing_vals)] = sing_vals <= tol
+        return vt[is_null, :].T
+    
+    
+    def compute_rank_sparse(self, matrix):
+        """
+        Compute the rank of a sparse matrix.
+        
+        Uses the eigenvalues of the small matrix ``matrix.T * matrix``
+        (shape: number products * number products). Its eigenvalues are the 
+        squares of the singular values of ``matrix``. 
+        The tolerance is larger than that of ``np.linalg.matrix_rank``, 
+        because squaring loses half of the significant digits.
+        """
+        gram = (matrix.T @ matrix).toarray()
+        eig_vals = np.linalg.eigvalsh(gram)
+        sing_vals = np.sqrt(np.maximum(eig_vals, 0))
+        if len(sing_vals) == 0 or sing_vals.max() == 0:
+            return 0
+        tol = sing_vals.max() * np.sqrt(max(matrix.shape) * 
+                                        np.finfo(float).eps)
+        return int(np.sum(sing_vals > tol))
+    
+    
     def solve_prices_lstsq(self, matrix, listing_prices, 
-                           listing_ids, product_ids):
+                           listing_ids, product_ids, return_weights=False):
         """
         Compute average product prices. 
         Uses linear least square algorithm.
+        
+        ``matrix`` can be a dense ``np.array`` or a ``scipy.sparse`` matrix.
+        Sparse matrices are solved with the iterative LSMR algorithm.
+        
+        If ``self.robust_method`` is set, outliers are weighted low with 
+        iteratively reweighted least squares (see ``reweight_prices_irls``).
+        
+        If ``return_weights`` is ``True``, the weight of each listing 
+        (row of ``matrix``) is returned as additional fifth value. 
+        The weights are 1 without ``self.robust_method``.
         """
         #Assert correct shapes of all matrices and vectors.
         assert len(matrix.shape) == 2, "matrix must be 2D array"
@@ -258,10 +660,18 @@ class PriceEstimator(object):
         # This algorithm effectively assigns low weights to expensive listings.
         scale_facts = 1/np.maximum(listing_prices, 0.01)
         listing_prices_s = listing_prices * scale_facts
-        matrix_s = matrix * scale_facts[:, newaxis]
-        #Compute least square solution to equation system
-        product_prices, _resid, rank, _sing_vals = np.linalg.lstsq(
-                                                    matrix_s, listing_prices_s)
+        matrix_s = self.scale_rows(matrix, scale_facts)
+        product_prices, rank = self.solve_lstsq_system(matrix_s, 
+                                                       listing_prices_s)
+        
+        #Weigh outliers low. Listings with weight 0 are effectively removed 
+        #from the equation system; the rank is computed without them.
+        listing_weights = np.ones(matrix.shape[0])
+        if self.robust_method is not None:
+            product_prices, listing_weights, rank = self.reweight_prices_irls(
+                                matrix_s, listing_prices_s, product_prices)
+            matrix = self.scale_rows(matrix, listing_weights)
+        
         #If matrix rank is too low to compute all prices, find problematic 
         #columns. These column are zero or collinear. 
         #The associated prices are later excluded from the result.
@@ -276,20 +686,282 @@ class PriceEstimator(object):
             good_cols = np.ones(matrix.shape[1], dtype=bool)
             problem_products = []
         
-        #TODO: loop for removal of outliers by weighting them low 
-        #      http://en.wikipedia.org/wiki/Outlier
-        #      One method may be an adaption of Cook's Distance:
-        #      * Try to remove rows that have large errors one by one. 
-        #      * If the estimated values change much after the row is removed,
-        #        then this row is an outlier. 
-        #      http://en.wikipedia.org/wiki/Cook%27s_distance
+        if return_weights:
+            return (product_prices, good_rows, good_cols, problem_products, 
+                    listing_weights)
+        return product_prices, good_rows, good_cols, problem_products
+    
+    
+    def scale_rows(self, matrix, factors):
+        "Multiply each row of a dense or sparse matrix with a factor."
+        if sparse.issparse(matrix):
+            return sparse.diags(factors) @ matrix
+        else:
+            return matrix * factors[:, newaxis]
+    
+    
+    def solve_lstsq_system(self, matrix, rhs, x0=None, tol=1e-12, 
+                           compute_rank=True):
+        """
+        Solve ``matrix * x = rhs`` with a linear least square algorithm.
+        
+        Sparse matrices are solved with the iterative LSMR algorithm, which 
+        can start from an approximate solution ``x0``, and stops at the 
+        relative tolerance ``tol``. Dense matrices are solved with 
+        ``np.linalg.lstsq``, ``x0`` and ``tol`` are ignored.
+        
+        Returns
+        -------
+        x : np.array[float]
+            The solution.
+        
+        rank : int, None
+            Rank of ``matrix``; ``None`` if ``compute_rank`` is ``False``.
+        """
+        if sparse.issparse(matrix):
+            #Iterative least square solver, needs only products of `matrix`
+            #with vectors. Converges to the minimum norm solution, like 
+            #`np.linalg.lstsq`.
+            x = sparse_linalg.lsmr(matrix, rhs, x0=x0,
+                                   atol=tol, btol=tol, conlim=1e12,
+                                   maxiter=10 * max(matrix.shape))[0]
+            rank = self.compute_rank_sparse(matrix) if compute_rank else None
+        else:
+            #Compute least square solution to equation system
+            x, _resid, rank, _sing_vals = np.linalg.lstsq(matrix, rhs, 
+                                                          rcond=-1)
+        return x, rank
+    
+    
+    def compute_robust_weights(self, resid):
+        """
+        Compute weights for iteratively reweighted least squares from the 
+        residuals. Large residuals get low weights.
+        
+        The residuals are standardized with the median absolute deviation.
+        ``self.robust_method`` selects the weight function:
+        
+        "huber"
+            ``w = min(1, k / |u|)``, with ``k = 1.345``. Outliers keep a 
+            small influence.
+        "tukey"
+            ``w = (1 - (u / c)**2)**2`` for ``|u| < c``, else 0, with 
+            ``c = 4.685``. Gross outliers are removed completely.
+        
+        If more than half of the residuals are 0 (many listings fit exactly),
+        the median absolute deviation is 0. Then the mean absolute deviation
+        is used instead, so that the remaining outliers are still 
+        down-weighted. Returns ``None`` if the residuals are (nearly) all 0.
+        """
+        abs_resid = np.abs(resid)
+        #The residuals are relative to the listing prices (scaled rows); 
+        #smaller residuals are exact fits with rounding errors.
+        tol = np.sqrt(np.finfo(float).eps)
+        scale = np.median(abs_resid) / 0.6745
+        if scale <= tol:
+            #Mean absolute deviation, scaled like the standard deviation
+            #of a normal distribution.
+            scale = np.mean(abs_resid) * np.sqrt(np.pi / 2)
+        if scale <= tol:
+            return None
+        u = abs_resid / scale
+        if self.robust_method == "huber":
+            return np.minimum(1, 1.345 / np.maximum(u, 1e-300))
+        elif self.robust_method == "tukey":
+            return np.where(u < 4.685, (1 - (u / 4.685)**2)**2, 0.)
+        else:
+            raise ValueError("Unknown robust method: {}"
+                             .format(self.robust_method))
+    
+    
+    def reweight_prices_irls(self, matrix_s, listing_prices_s, product_prices):
+        """
+        Make a least square solution robust against outliers, with 
+        iteratively reweighted least squares (IRLS).
+        
+        Listings whose prices don't fit to the other listings, for example 
+        listings with wrongly recognized products, get low weights. The 
+        weights are computed from the residuals of the previous solution 
+        (``compute_robust_weights``), then the weighted equation system is 
+        solved again. 
+        
+        The weighted systems are solved as sparse systems with LSMR, 
+        starting from the previous solution (warm start), with a moderate 
+        tolerance. The iterations need little work when the weights change 
+        little. Only the last solve uses the full tolerance.
+        
+        Parameters
+        ----------
+        matrix_s, listing_prices_s
+            The scaled equation system from ``solve_prices_lstsq``.
+        
+        product_prices : np.array[float]
+            The (unweighted) least square solution.
+        
+        Returns
+        -------
+        product_prices : np.array[float]
+            The robust solution.
+        
+        listing_weights : np.array[float]
+            Weight of each listing (row), between 0 and 1.
+        
+        rank : int
+            Rank of the weighted matrix.
+        """
+        is_dense = not sparse.issparse(matrix_s)
+        matrix_sp = sparse.csr_matrix(matrix_s)
+        listing_weights = np.ones(matrix_s.shape[0])
+        n_iter = 0
+        for n_iter in range(1, self.robust_max_iter + 1):
+            resid = listing_prices_s - matrix_sp @ product_prices
+            new_weights = self.compute_robust_weights(resid)
+            if new_weights is None:
+                break
+            change = np.abs(new_weights - listing_weights).max()
+            listing_weights = new_weights
+            sqrt_weights = np.sqrt(listing_weights)
+            product_prices, _ = self.solve_lstsq_system(
+                                self.scale_rows(matrix_sp, sqrt_weights), 
+                                listing_prices_s * sqrt_weights, 
+                                x0=product_prices, tol=1e-8, 
+                                compute_rank=False)
+            if change < 1e-3:
+                break
+        logging.debug("IRLS: {i} iterations, {n} listings with weight < 0.5."
+                      .format(i=n_iter, n=np.sum(listing_weights < 0.5)))
+        
+        #Final solution with full accuracy, and rank of weighted matrix.
+        sqrt_weights = np.sqrt(listing_weights)
+        if is_dense:
+            product_prices, rank = self.solve_lstsq_system(
+                                self.scale_rows(matrix_s, sqrt_weights), 
+                                listing_prices_s * sqrt_weights)
+        else:
+            product_prices, rank = self.solve_lstsq_system(
+                                self.scale_rows(matrix_sp, sqrt_weights), 
+                                listing_prices_s * sqrt_weights, 
+                                x0=product_prices)
+        return product_prices, listing_weights, rank
+        
+        
+    def find_connected_components(self, matrix):
+        """
+        Find groups of products that never appear together in a listing.
+        
+        Products and listings form a bipartite graph: a listing is connected 
+        to the products it contains. Each connected component of this graph 
+        is an independent block of the equation system 
+        ``matrix * pp = listing_prices``.
+        
+        Returns
+        -------
+        n_components : int
+            Number of connected components.
+        
+        product_labels : np.array[int]
+            Component of each product (column of ``matrix``).
+        
+        listing_labels : np.array[int]
+            Component of each listing (row of ``matrix``).
+        """
+        #Products are connected if they appear together in a listing.
+        occurs = sparse.csr_matrix(matrix != 0, dtype=float)
+        product_graph = occurs.T @ occurs
+        n_components, product_labels = csgraph.connected_components(
+                                                product_graph, directed=False)
+        #All products of a listing are in the same component. 
+        #Each listing has at least one product.
+        first_product = np.asarray(occurs.argmax(axis=1)).ravel()
+        listing_labels = product_labels[first_product]
+        return n_components, product_labels, listing_labels
+    
+    
+    def solve_prices_lstsq_blocks(self, matrix, listing_prices, 
+                                  listing_ids, product_ids, 
+                                  return_weights=False):
+        """
+        Compute average product prices. Splits the equation system into 
+        independent blocks, and solves them separately with 
+        ``solve_prices_lstsq``.
+        
+        Each connected component (see ``find_connected_components``) is 
+        independent from the others. Small components are combined into 
+        blocks of at least ``self.min_block_size`` products, to reduce the 
+        overhead. The blocks are solved by ``self.n_threads`` threads in 
+        parallel, the linear algebra libraries release the GIL.
+        
+        Returns the same results as ``solve_prices_lstsq``, including the 
+        listing weights if ``return_weights`` is ``True``. Products that 
+        appear in no listing are problematic, their prices are 0.
+        """
+        n_listings, n_products = matrix.shape
+        n_components, product_labels, listing_labels = \
+                                    self.find_connected_components(matrix)
+        logging.debug("Equation system has {n} connected components."
+                      .format(n=n_components))
+        
+        #Assign components to blocks: large components get their own block,
+        #small components are packed together.
+        comp_sizes = np.bincount(product_labels, minlength=n_components)
+        is_large = comp_sizes >= self.min_block_size
+        comp_blocks = np.zeros(n_components, dtype=int)
+        comp_blocks[is_large] = np.arange(is_large.sum())
+        small_sizes = np.cumsum(comp_sizes[~is_large])
+        comp_blocks[~is_large] = (is_large.sum() + 
+                                  (small_sizes - 1) // self.min_block_size)
+        product_blocks = comp_blocks[product_labels]
+        listing_blocks = comp_blocks[listing_labels]
+        
+        #Split the equation system into blocks. 
+        blocks = []
+        for i_block in np.unique(product_blocks):
+            cols = np.flatnonzero(product_blocks == i_block)
+            rows = np.flatnonzero(listing_blocks == i_block)
+            if len(rows) == 0:
+                continue
+            if sparse.issparse(matrix):
+                block_matrix = matrix[rows][:, cols]
+            else:
+                block_matrix = matrix[np.ix_(rows, cols)]
+            blocks.append((rows, cols, block_matrix))
+        
+        def solve_block(block):
+            rows, cols, block_matrix = block
+            return self.solve_prices_lstsq(block_matrix, listing_prices[rows], 
+                                           listing_ids[rows], product_ids[cols],
+                                           return_weights=True)
+        
+        if self.n_threads > 1:
+            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                solutions = list(executor.map(solve_block, blocks))
+        else:
+            solutions = [solve_block(block) for block in blocks]
+        
+        #Assemble the solution. Products without listings stay problematic.
+        product_prices = np.zeros(n_products)
+        good_rows = np.ones(n_listings, dtype=bool)
+        good_cols = np.zeros(n_products, dtype=bool)
+        listing_weights = np.ones(n_listings)
+        for (rows, cols, _), solution in zip(blocks, solutions):
+            blk_prices, blk_good_rows, blk_good_cols, _, blk_weights = solution
+            product_prices[cols] = blk_prices
+            good_rows[rows] = blk_good_rows
+            good_cols[cols] = blk_good_cols
+            listing_weights[rows] = blk_weights
+        problem_products = list(product_ids[~good_cols])
+        
+        if return_weights:
+            return (product_prices, good_rows, good_cols, problem_products, 
+                    listing_weights)
         return product_prices, good_rows, good_cols, problem_products
         
         
     def create_prices_lstsq_soln(self, matrix, 
                                  listing_prices, listing_ids,
                                  product_prices, product_ids,
-                                 good_rows, good_cols, listings=None):
+                                 good_rows, good_cols, listings=None,
+                                 listing_weights=None):
         """
         Create product prices from the results of the linear least 
         square algorithm.
@@ -326,6 +998,11 @@ class PriceEstimator(object):
             The listings from which the the system of equations was generated.
             Will usually contain additional listings.
             
+        listing_weights : np.array[float]
+            Weights of the listings, from the robust solver. If given, the 
+            prices of the listings get an additional column "weight". 
+            Average prices have weight ``NaN``.
+            
         Returns
         -------
         prices : pd.DataFrame
@@ -334,101 +1011,242 @@ class PriceEstimator(object):
         assert matrix.shape[0] == len(listing_prices) == len(listing_ids)
         assert matrix.shape[1] == len(product_prices) == len(product_ids)
         
-        good_prod_idxs = np.argwhere(good_cols)[:, 0]
+        product_ids = np.asarray(product_ids, dtype=object)
+        listing_ids = np.asarray(listing_ids, dtype=object)
+        #Get number of listings that were used for each average price, from 
+        #the system matrix. Count non-zero entries in the price's column. 
+        #Works for dense and sparse matrices.
+        n_listings_prod = np.asarray((matrix > 0).sum(axis=0)).ravel()
         
         #Create the average prices
-        #Price data is first collected in list of dicts, that is later 
-        #converted to a ``DataFrame``. Each dict is a row of the ``DataFrame``.
-        prices = make_price_frame(0)
-        price_data = []
-        for iprod in range(len(product_prices)):
-            if iprod not in good_prod_idxs:
-                continue
-            single_price_data = {}
-            #Multiply with condition, solver returns prices for condition "new".
-            single_price_data["price"] = \
-                            product_prices[iprod] * self.default_condition
-            single_price_data["currency"] = self.default_currency
-            single_price_data["condition"] = self.default_condition
-            single_price_data["time"] = self.average_mid_time
-            single_price_data["product"] = product_ids[iprod]
-            single_price_data["listing"] = u"{}-average".format(
-                                                        self.average_mid_time)
-            single_price_data["type"] = "average"
-            single_price_data["avg_period"] = self.avg_period
-            #Get number of listings that were used for this average price, from 
-            #the system matrix. Count non-zero entries in the price's column. 
-            prod_col = matrix[:, iprod]
-            prod_col = np.where(prod_col > 0, 1, 0) #Don't count NaNs
-            n_listings = np.sum(prod_col)
-            single_price_data["avg_num_listings"] = n_listings
-            single_price_data["id"] = make_price_id(single_price_data)
-            price_data.append(single_price_data)
-        
-        avg_prices = pd.DataFrame(price_data)
-        prices = prices.append(
-                        avg_prices, ignore_index=True, verify_integrity=False)
+        avg_prices = self.create_average_prices(product_prices, product_ids, 
+                                                good_cols, n_listings_prod)
+        n_avg = len(avg_prices)
         
         #Create prices for each item of each listing 
         #Protect against prices that are NaN
         good_prod_prices = np.where(np.isnan(product_prices), 
                                     0, product_prices)
-        #Price data is first collected in list of dicts. Each dict is a price.
-        price_data = []
-        for ilist in range(len(listing_prices)):
-            #Each row of `matrix` represents a listing
-            row = matrix[ilist, :]
-            
-            #compute percentage of each product on total listing price 
-            #from average prices.
-            virt_prod_prices = row * good_prod_prices
-            list_prod_percent = virt_prod_prices / virt_prod_prices.sum()
-            #compute price of each item in listing based on these percentages
-            listing_price = listing_prices[ilist]
-            list_prod_prices = list_prod_percent * listing_price
+        #Split the price of each listing proportionally to the average 
+        #prices of its products. For all listings at once: 
+        #    row * good_prod_prices / rowsum * listing_price
+        #Computed only for the items (non zero entries) of the matrix.
+        if sparse.issparse(matrix):
+            item_coo = sparse.csr_matrix(matrix).sorted_indices().tocoo()
+            item_rows, item_cols = item_coo.row, item_coo.col
+            item_conditions = item_coo.data
+        else:
+            item_rows, item_cols = np.nonzero(matrix)
+            item_conditions = matrix[item_rows, item_cols]
+        virt_prod_prices = item_conditions * good_prod_prices[item_cols]
+        row_sums = np.bincount(item_rows, weights=virt_prod_prices, 
+                               minlength=matrix.shape[0])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            item_prices = (virt_prod_prices / row_sums[item_rows] * 
+                           listing_prices[item_rows])
+        
+        #Listings with only one product contain observed prices.
+        is_item = item_conditions > 0
+        n_items_row = np.bincount(item_rows[is_item], 
+                                  minlength=matrix.shape[0])
+        is_observed = n_items_row[item_rows] == 1
+        #Only items whose prices could be computed.
+        use_item = is_item & good_cols[item_cols]
+        item_rows = item_rows[use_item]
+        item_cols = item_cols[use_item]
+        is_observed = is_observed[use_item]
+        
+        #`listings` data frame can be `None` for more easy testing.
+        if listings is not None:
+            #Get currency and time of all listings with one indexed lookup.
+            list_data = listings[["currency", "time"]].reindex(listing_ids)
+            list_currencies = list_data["currency"].array
+            list_times = list_data["time"].array
+        else:
+            list_currencies = np.array(["Unknown Currency"] * len(listing_ids), 
+                                       dtype=object)
+            list_times = np.array([datetime(2000, 1, 1)] * len(listing_ids), 
+                                  dtype=object)
+        
+        list_prices = pd.DataFrame({
+            "price": item_prices[use_item],
+            "currency": list_currencies[item_rows],
+            "condition": item_conditions[use_item],
+            "time": list_times[item_rows],
+            "product": product_ids[item_cols],
+            "listing": listing_ids[item_rows],
+            "type": np.where(is_observed, "observed", "estimated"),
+            "avg_period": np.where(is_observed, "none", self.avg_period),
+            #TODO: Better algorithm, analogous to algorithm above for average prices.
+            "avg_num_listings": len(listing_prices),
+            }, index=range(n_avg, n_avg + len(item_rows)))
+        if listing_weights is not None:
+            list_prices["weight"] = listing_weights[item_rows]
+        
+        prices = pd.concat([make_price_frame(0), avg_prices, list_prices])
+        prices["id"] = make_price_ids(prices)
+        prices.set_index("id", drop=False, inplace=True, verify_integrity=True)
+        return prices
+    
+    
+    def create_average_prices(self, product_prices, product_ids, good_cols, 
+                              n_listings_prod):
+        """
+        Create the average prices of the products, at 
+        ``self.average_mid_time``.
+        
+        Parameters
+        ----------
+        product_prices : np.array[float]
+            Average price of each product, for condition "new".
+        
+        product_ids : np.array[basestring]
+            IDs of the products.
+        
+        good_cols : np.array[bool]
+            Where `True` prices could be computed.
+        
+        n_listings_prod : np.array[int]
+            Number of listings that were used for each average price.
             
-            #`listings` data frame can be `None` for more easy testing.
-            if listings is not None:
-                list_id = listing_ids[ilist]
-                list_currency = listings.ix[list_id, "currency"]
-                list_time = listings.ix[list_id, "time"]
-            else:
-                list_id = listing_ids[ilist]
-                list_currency = "Unknown Currency"
-                list_time = datetime(2000, 1, 1)
-            prod_idxs = np.argwhere(row > 0)[:, 0]
-            if len(prod_idxs) == 1:
-                price_type = "observed"
-                avg_period = "none"
-            else:
-                price_type = "estimated"
-                avg_period = self.avg_period
+        Returns
+        -------
+        avg_prices : pd.DataFrame
+            The average prices, without column "id". 
+        """
+        #Multiply with condition, solver returns prices for condition "new".
+        n_avg = int(good_cols.sum())
+        avg_prices = pd.DataFrame({
+            "price": product_prices[good_cols] * self.default_condition,
+            "currency": self.default_currency,
+            "condition": self.default_condition,
+            "time": [self.average_mid_time] * n_avg,
+            "product": product_ids[good_cols],
+            "listing": u"{}-average".format(self.average_mid_time),
+            "type": "average",
+            "avg_period": self.avg_period,
+            "avg_num_listings": n_listings_prod[good_cols], 
+            }, index=range(n_avg))
+        return avg_prices
+    
+    
+    def compute_prices_interval(self, intv_listings, product_ids, 
+                                intv_start, intv_end):
+        """
+        Compute prices from the listings of a single interval. 
+        
+        Parameters
+        ----------
+        intv_listings : pd.DataFrame
+            Listings with times in the interval ``[intv_start, intv_end)``.
+        
+        product_ids : list[basestring]
+            IDs of the products whose prices are computed.
+        
+        intv_start, intv_end : datetime
+            Start and end of the interval. 
             
-            #Create a price record for each of the estimated product prices
-            for iprod in prod_idxs:
-                if iprod not in good_prod_idxs:
-                    continue
-                single_price_data = {}
-                single_price_data["price"] = list_prod_prices[iprod]
-                single_price_data["currency"] = list_currency
-                single_price_data["condition"] = row[iprod]
-                single_price_data["time"] = list_time
-                single_price_data["product"] = product_ids[iprod]
-                single_price_data["listing"] = list_id
-                single_price_data["type"] = price_type
-                single_price_data["avg_period"] = avg_period
-                #TODO: Better algorithm, analogous to algorithm above for average prices.
-                single_price_data["avg_num_listings"] = len(listing_prices)
-                single_price_data["id"] = make_price_id(single_price_data)
-                price_data.append(single_price_data)
-        
-        list_prices = pd.DataFrame(price_data)
-        prices = prices.append(
-                        list_prices, ignore_index=True, verify_integrity=False)
-        prices.set_index("id", drop=False, inplace=True, verify_integrity=True)
+        Returns
+        -------
+        prices : pd.DataFrame, None
+            The computed prices, ``None`` if there are no valid listings.
+        """
+        offset_mid = timedelta(
+                        seconds=(intv_end - intv_start).total_seconds() / 2)
+        self.average_mid_time = intv_start + offset_mid
+        
+        logging.debug("Interval start: {s}, end: {e}, n listings: {n}."
+                      .format(s=intv_start, e=intv_end, n=len(intv_listings)))
+        if len(intv_listings) == 0:
+            return None
+        
+        listing_products = self.convert_listings_to_long(intv_listings)
+        matrix, listing_prices, listing_ids, matrix_product_ids = \
+            self.compute_product_occurrence_matrix_long(
+                            listing_products, product_ids, self.use_sparse)
+        if matrix.shape[0] == 0:
+            logging.debug("No valid listing prices.")
+            return None
+        intv_prices = self.compute_prices_system(
+                                    matrix, listing_prices, listing_ids, 
+                                    matrix_product_ids, intv_listings)
+        return intv_prices
+    
+    
+    def compute_prices_system(self, matrix, listing_prices, listing_ids, 
+                              product_ids, listings):
+        """
+        Solve an equation system for the prices, and create the price 
+        records from the solution. 
+        
+        If ``self.robust_method`` is set, the listing prices get an 
+        additional column "weight", that shows which listings were weighted 
+        low as outliers.
+        """
+        product_prices, good_rows, good_cols, _problem_products, weights = \
+            self.solve_prices_lstsq_blocks(
+                        matrix, listing_prices, listing_ids, product_ids, 
+                        return_weights=True)
+        if self.robust_method is None:
+            weights = None
+        prices = self.create_prices_lstsq_soln(
+                                    matrix, listing_prices, listing_ids, 
+                                    product_prices, product_ids, 
+                                    good_rows, good_cols, listings, weights)
         return prices
     
     
+    def get_period_offset(self, avg_period):
+        """
+        Get the ``pandas`` offset of an averaging period. 
+        Periods are "day", "week" (starting on Monday), and "month".
+        """
+        if avg_period == "day":
+            return pd.offsets.Day()
+        elif avg_period == "week":
+            return pd.offsets.Week(weekday=0)
+        elif avg_period == "month":
+            return pd.offsets.MonthBegin()
+        else:
+            raise NotImplementedError("Unknown averaging period: {}"
+                                      .format(avg_period))
+    
+    
+    def parse_rolling_period(self, avg_period):
+        """
+        Get the length in days of a rolling averaging period, for example 
+        "rolling-30d". Returns ``None`` for all other periods.
+        """
+        match = re.match(r"rolling-(\d+)d$", avg_period)
+        if match is None:
+            return None
+        return int(match.group(1))
+    
+    
+    def find_interval_starts(self, times, avg_period):
+        """
+        Find the start of the interval that contains each time. The 
+        intervals start at midnight, like in ``compute_prices``.
+        
+        Parameters
+        ----------
+        times : pd.Series[datetime]
+        
+        avg_period : str
+            "day", "week" or "month".
+        """
+        days = times.dt.normalize()
+        if avg_period == "day":
+            return days
+        elif avg_period == "week":
+            return days - pd.to_timedelta(days.dt.weekday, unit="D")
+        elif avg_period == "month":
+            return days - pd.to_timedelta(days.dt.day - 1, unit="D")
+        else:
+            raise NotImplementedError("Unknown averaging period: {}"
+                                      .format(avg_period))
+    
+    
     def compute_prices(self, listings, products,
                        time_start=None, time_end=None, 
                        avg_period="week"):
@@ -439,69 +1257,397 @@ class PriceEstimator(object):
         sold together with other items. This is equivalent to averaging, to
         prices over the listings that were used to compute the prices.
         
+        The listings are split into intervals once, with ``searchsorted``
+        on the sorted times. If ``self.n_processes > 1`` the intervals are 
+        computed in parallel by a pool of processes. The prices of all 
+        intervals are concatenated at the end.
+        
+        ``avg_period`` can be "day", "week", "month", or a rolling window 
+        like "rolling-30d". A listing belongs to many rolling windows, 
+        therefore rolling windows create only average prices, from the 
+        summed daily statistics (see ``compute_average_prices``).
+        
         TODO: Delete old prices.
         """
         logging.info("Starting to compute prices...")
         
-        if avg_period == "week":
-            offset = pd.datetools.Week(weekday=0)
-            self.avg_period = "week"
-        else:
-            raise NotImplementedError()
+        prices = make_price_frame(0)
+        #Create list of product IDs. Exclude the place holders the have 
+        #names"xxx-unknown" starting with
+        product_ids = [p.id for p in products 
+                       if not p.id.startswith("xxx-unknown")]
+        if len(product_ids) == 0:
+            logging.error("Empty product list.")
+            return prices
+        
+        if self.parse_rolling_period(avg_period) is not None:
+            stats = self.compute_daily_statistics(listings, product_ids)
+            return self.compute_average_prices(stats, avg_period, 
+                                               time_start, time_end)
+        
+        offset = self.get_period_offset(avg_period)
+        self.avg_period = avg_period
         
         #If no start- or end-points are given start or end of listing sequence
         #Include listings in incomplete periods at start and end of sequence.
+        #Intervals start at midnight, so that incremental computations 
+        #(``compute_prices_incremental``) use the same intervals.
         if time_start is None:
-            time_start = listings["time"].min()
+            time_start = listings["time"].min().normalize()
             time_start = offset.rollback(time_start)
         if time_end is None:
-            time_end = listings["time"].max()
+            time_end = listings["time"].max().normalize() + timedelta(days=1)
             time_end = offset.rollforward(time_end)
         
         #Create start and end of desired intervals.
         intervals = pd.date_range(time_start, time_end, freq=offset)
+        
+        #Chop listings into intervals: find the first listing of each 
+        #interval in the sorted times. 
+        listings = listings.sort_values("time", kind="mergesort")
+        bounds = listings["time"].searchsorted(intervals, side="left")
+        intv_listings = [listings.iloc[bounds[i]:bounds[i + 1]] 
+                         for i in range(len(intervals) - 1)]
+        intv_starts = intervals[:-1]
+        intv_ends = intervals[1:]
+        
+        if self.n_processes > 1:
+            with ProcessPoolExecutor(max_workers=self.n_processes) as executor:
+                intv_prices = list(executor.map(
+                                        self.compute_prices_interval, 
+                                        intv_listings, repeat(product_ids), 
+                                        intv_starts, intv_ends))
+        else:
+            intv_prices = list(map(self.compute_prices_interval, 
+                                   intv_listings, repeat(product_ids), 
+                                   intv_starts, intv_ends))
+        
+        intv_prices = [p for p in intv_prices if p is not None]
+        if len(intv_prices) == 0:
+            return prices
+        prices = pd.concat([prices] + intv_prices)
+        return prices
+    
+    
+    def find_dirty_components(self, matrix, product_ids, dirty_products):
+        """
+        Find the connected components that contain dirty products. Only the 
+        prices of these components need to be recomputed.
+        
+        Parameters
+        ----------
+        matrix : np.array[float], scipy.sparse matrix
+            System matrix of linear least square problem.
+            
+        product_ids : np.array[basestring]
+            IDs of the products, columns of `matrix`.
+            
+        dirty_products : set[basestring]
+            IDs of the products whose prices have changed.
+            
+        Returns
+        -------
+        dirty_rows, dirty_cols : np.array[bool]
+            Rows (listings) and columns (products) of the dirty components.
+        """
+        _, product_labels, listing_labels = \
+                                    self.find_connected_components(matrix)
+        is_dirty = np.isin(product_ids, list(dirty_products))
+        dirty_labels = np.unique(product_labels[is_dirty])
+        dirty_rows = np.isin(listing_labels, dirty_labels)
+        dirty_cols = np.isin(product_labels, dirty_labels)
+        return dirty_rows, dirty_cols
+    
+    
+    def compute_prices_incremental(self, listings, products, dirty_listings,
+                                   avg_period="week"):
+        """
+        Recompute only the prices that are affected by changed listings. 
+        
+        The prices of a product in an interval depend only on the listings 
+        of the same interval, and the same connected component (see 
+        ``find_connected_components``). Only these (interval, component) 
+        blocks are recomputed. The computation time is proportional to the 
+        number of changed listings, not to the length of the history.
+        
+        Parameters
+        ----------
+        listings : pd.DataFrame
+            The listings of (at least) all intervals that contain dirty 
+            listings. Listings in other intervals are ignored.
+            
+        products : list[econdata.models.Product]
+            Products whose prices are computed.
+            
+        dirty_listings : pd.DataFrame
+            Listings that were written or changed, columns "time" and 
+            "products". "products" should also contain the products that the 
+            listing contained before it was changed.
+            
+        avg_period : str
+            "day", "week" or "month". 
+            
+        Returns
+        -------
+        prices : pd.DataFrame
+            New prices of the dirty blocks.
+            
+        dirty_blocks : pd.DataFrame
+            Columns "start", "end", "product". The old prices of these 
+            products, between "start" (inclusive) and "end" (exclusive), must 
+            be replaced by ``prices``.
+        """
+        logging.info("Starting to compute prices incrementally...")
+        
+        offset = self.get_period_offset(avg_period)
+        self.avg_period = avg_period
+        
         prices = make_price_frame(0)
-
-        #Create list of product IDs. Exclude the place holders the have 
-        #names"xxx-unknown" starting with
+        dirty_blocks = pd.DataFrame({"start": [], "end": [], "product": []})
         product_ids = [p.id for p in products 
                        if not p.id.startswith("xxx-unknown")]
-        if len(product_ids) == 0:
-            logging.error("Empty product list.")
-            return prices
+        if len(product_ids) == 0 or len(dirty_listings) == 0:
+            return prices, dirty_blocks
+        
+        #Intervals start at 0:00, like in ``compute_prices``.
+        dirty_products = dirty_listings[["time", "products"]].copy()
+        dirty_products["start"] = self.find_interval_starts(
+                                        dirty_products["time"], avg_period)
+        dirty_products = dirty_products.explode("products").dropna()
+        listing_starts = self.find_interval_starts(listings["time"], 
+                                                   avg_period)
         
-        #Chop listings into intervals and loop over them.
-        listings = listings.sort("time")
-        for i in range(len(intervals) - 1):
-            intv_start = intervals[i]
-            intv_end = intervals[i + 1]
+        intv_prices_all = []
+        dirty_blocks_all = []
+        for intv_start, intv_dirty in dirty_products.groupby("start"):
+            intv_end = intv_start + offset
+            self.average_mid_time = intv_start + (intv_end - intv_start) / 2
+            intv_dirty_products = set(intv_dirty["products"])
+            intv_listings = listings[listing_starts == intv_start]
             
-            offset_mid = timedelta(
-                            seconds=(intv_end - intv_start).total_seconds() / 2)
-            self.average_mid_time = intv_start + offset_mid
+            #Solve only the components that contain dirty products.
+            block_products = intv_dirty_products
+            if len(intv_listings) > 0:
+                listing_products = self.convert_listings_to_long(intv_listings)
+                matrix, listing_prices, listing_ids, matrix_product_ids = \
+                    self.compute_product_occurrence_matrix_long(
+                                listing_products, product_ids, self.use_sparse)
+                dirty_rows, dirty_cols = self.find_dirty_components(
+                                matrix, matrix_product_ids, intv_dirty_products)
+                if dirty_rows.any():
+                    matrix = matrix[dirty_rows][:, dirty_cols]
+                    listing_prices = listing_prices[dirty_rows]
+                    listing_ids = listing_ids[dirty_rows]
+                    matrix_product_ids = matrix_product_ids[dirty_cols]
+                    intv_prices = self.compute_prices_system(
+                                    matrix, listing_prices, listing_ids, 
+                                    matrix_product_ids, intv_listings)
+                    intv_prices_all.append(intv_prices)
+                    block_products = block_products | set(matrix_product_ids)
             
-            intv_listings = listings.ix[(listings["time"] >= intervals[i]) &
-                                        (listings["time"] < intervals[i + 1])]
-            logging.debug("Interval start: {s}, end: {e}, n listings: {n}."
-                          .format(s=intervals[i], e=intervals[i + 1],
-                                  n=len(intv_listings)))
-            if len(intv_listings) == 0:
-                continue
+            logging.debug("Interval start: {s}, n dirty products: {n}."
+                          .format(s=intv_start, n=len(block_products)))
+            dirty_blocks_all.append(pd.DataFrame(
+                                    {"start": intv_start, "end": intv_end,
+                                     "product": sorted(block_products)}))
+        
+        prices = pd.concat([prices] + intv_prices_all)
+        dirty_blocks = pd.concat(dirty_blocks_all, ignore_index=True)
+        return prices, dirty_blocks
+    
+    
+    def compute_daily_statistics(self, listings, product_ids):
+        """
+        Compute the sufficient statistics of the price equations for each 
+        day: the normal equations ``A_d.T * A_d`` and ``A_d.T * b_d``, and 
+        the number of listings.
+        
+        The rows are scaled like in ``solve_prices_lstsq``. The statistics 
+        of all days are computed with a single sparse matrix product. 
+        
+        Parameters
+        ----------
+        listings : pd.DataFrame
+            Listings with the columns "products", "price", "sold", 
+            "condition", "time". The index contains the listing IDs.
             
-            matrix, listing_prices, listing_ids, product_ids = \
-                self.compute_product_occurrence_matrix(
-                                                    intv_listings, product_ids)
-            if matrix.shape[0] == 0:
-                logging.debug("No valid listing prices.")
-                continue
-            product_prices, good_rows, good_cols, problem_products = \
-                self.solve_prices_lstsq(
-                            matrix, listing_prices, listing_ids, product_ids)
-            intv_prices = self.create_prices_lstsq_soln(
-                                        matrix, listing_prices, listing_ids, 
-                                        product_prices, product_ids, 
-                                        good_rows, good_cols, listings)
-            prices = prices.append(intv_prices)
+        product_ids : list[basestring]
+            IDs of the products whose prices are computed.
+        
+        Returns
+        -------
+        stats : PriceStatistics
+        """
+        listing_products = self.convert_listings_to_long(listings)
+        matrix, listing_prices, listing_ids, product_ids = \
+            self.compute_product_occurrence_matrix_long(
+                            listing_products, product_ids, use_sparse=True)
+        n_listings, n_products = matrix.shape
+        
+        #Same scaling of the rows as in ``solve_prices_lstsq``.
+        scale_facts = 1/np.maximum(listing_prices, 0.01)
+        listing_prices_s = listing_prices * scale_facts
+        matrix_s = sparse.csr_matrix(self.scale_rows(matrix, scale_facts))
+        
+        list_times = pd.DatetimeIndex(listings["time"].reindex(listing_ids))
+        day_codes, days = pd.factorize(list_times.normalize(), sort=True)
+        n_days = len(days)
+        
+        #Move the entries of each row into the block of its day: 
+        #column ``day * n_products + product``. The product of this matrix 
+        #with ``matrix_s`` contains the matrices ``A_d.T * A_d`` of all days,
+        #stacked vertically.
+        entries = matrix_s.tocoo()
+        day_cols = day_codes[entries.row] * n_products + entries.col
+        day_matrix = sparse.csr_matrix(
+                        (entries.data, (entries.row, day_cols)), 
+                        shape=(n_listings, n_days * n_products))
+        grams = (day_matrix.T @ matrix_s).tocoo()
+        gram = sparse.csr_matrix(
+                    (grams.data, (grams.row // n_products, 
+                                  (grams.row % n_products) * n_products + 
+                                  grams.col)), 
+                    shape=(n_days, n_products ** 2))
+        rhs = (day_matrix.T @ listing_prices_s).reshape(n_days, n_products)
+        day_occurs = sparse.csr_matrix(
+                        ((entries.data > 0).astype(float), 
+                         (entries.row, day_cols)), 
+                        shape=(n_listings, n_days * n_products))
+        counts = np.rint(day_occurs.T @ np.ones(n_listings)).astype(int)
+        counts = counts.reshape(n_days, n_products)
+        n_day_listings = np.bincount(day_codes, minlength=n_days)
+        
+        return PriceStatistics(product_ids, days, gram, rhs, counts, 
+                               n_day_listings)
+    
+    
+    def solve_prices_normal_equations(self, gram, rhs, n_listings):
+        """
+        Compute average product prices from the normal equations 
+        ``gram * x = rhs`` of the least square problem, with 
+        ``gram = A.T * A`` and ``rhs = A.T * b``.
+        
+        The solution is the minimum norm solution, like the one of 
+        ``solve_prices_lstsq`` without ``self.robust_method``. It is 
+        computed with the eigen-decomposition of ``gram``. Products with 
+        components in the null space of ``gram`` are problematic, like in 
+        ``find_problems_rank_deficient_matrix``.
+        
+        Parameters
+        ----------
+        gram : np.array[float]
+            shape = (number products, number products)
+            
+        rhs : np.array[float]
+        
+        n_listings : int
+            Number of listings (rows of ``A``), for the tolerance.
+        
+        Returns
+        -------
+        product_prices : np.array[float]
+            Prices of the products, for condition "new".
+            
+        good_cols : np.array[bool]
+            Where `True` prices could be computed.
+        """
+        n_products = len(rhs)
+        product_prices = np.zeros(n_products)
+        good_cols = np.zeros(n_products, dtype=bool)
+        #Products without listings have zero rows and columns.
+        active = np.diag(gram) > 0
+        if not active.any():
+            return product_prices, good_cols
+        
+        #Same tolerance as in ``compute_null_space`` for sparse matrices.
+        eig_vals, eig_vecs = np.linalg.eigh(gram[np.ix_(active, active)])
+        sing_vals = np.sqrt(np.maximum(eig_vals, 0))
+        tol = sing_vals.max() * np.sqrt(max(n_listings, active.sum()) * 
+                                        np.finfo(float).eps)
+        is_null = sing_vals <= tol
+        null_norms = np.sqrt((eig_vecs[:, is_null] ** 2).sum(axis=1))
+        good_cols[active] = null_norms <= np.sqrt(np.finfo(float).eps)
+        
+        range_vecs = eig_vecs[:, ~is_null]
+        product_prices[active] = range_vecs @ (
+                        (range_vecs.T @ rhs[active]) / eig_vals[~is_null])
+        return product_prices, good_cols
+    
+    
+    def compute_average_prices(self, stats, avg_period="week", 
+                               time_start=None, time_end=None):
+        """
+        Compute average prices from the daily statistics. 
+        
+        The statistics of the days of each period are summed, then only a 
+        small equation system is solved for each connected component of 
+        products, of each period; the 
+        listings are not needed. Only average prices are created.
+        
+        Parameters
+        ----------
+        stats : PriceStatistics
+            Daily statistics, see ``compute_daily_statistics``.
+            
+        avg_period : str
+            "day", "week", "month", or a rolling window like "rolling-30d". 
+            Rolling windows end at midnight of each day. 
+            
+        time_start, time_end : datetime
+            Start and end of the computed periods. By default all days of 
+            ``stats``.
             
+        Returns
+        -------
+        prices : pd.DataFrame
+            The average prices.
+        """
+        prices = make_price_frame(0)
+        if len(stats.days) == 0:
+            return prices
+        self.avg_period = avg_period
+        
+        rolling_days = self.parse_rolling_period(avg_period)
+        if rolling_days is None:
+            offset = self.get_period_offset(avg_period)
+            if time_start is None:
+                time_start = offset.rollback(stats.days[0])
+            if time_end is None:
+                time_end = offset.rollforward(stats.days[-1] + 
+                                              timedelta(days=1))
+            intervals = pd.date_range(time_start, time_end, freq=offset)
+            starts, ends = intervals[:-1], intervals[1:]
+        else:
+            if time_start is None:
+                time_start = stats.days[0]
+            if time_end is None:
+                time_end = stats.days[-1] + timedelta(days=1)
+            ends = pd.date_range(time_start, time_end, freq="D")[1:]
+            starts = ends - timedelta(days=rolling_days)
+        
+        gram, rhs, counts, n_listings = stats.sum_windows(starts, ends)
+        n_products = len(stats.product_ids)
+        avg_prices_all = []
+        for i_wnd in np.flatnonzero(n_listings > 0):
+            #Solve the system of each connected component separately, like 
+            #``solve_prices_lstsq_blocks``. Only the blocks are dense.
+            wnd_gram = stats.unflatten_gram(gram[i_wnd])
+            product_prices = np.zeros(n_products)
+            good_cols = np.zeros(n_products, dtype=bool)
+            for cols in stats.find_components(wnd_gram):
+                product_prices[cols], good_cols[cols] = \
+                    self.solve_prices_normal_equations(
+                                wnd_gram[cols][:, cols].toarray(), 
+                                rhs[i_wnd, cols], n_listings[i_wnd])
+            self.average_mid_time = (starts[i_wnd] + 
+                                     (ends[i_wnd] - starts[i_wnd]) / 2)
+            avg_prices_all.append(self.create_average_prices(
+                        product_prices, stats.product_ids, good_cols, 
+                        counts[i_wnd]))
+        
+        if len(avg_prices_all) == 0:
+            return prices
+        prices = pd.concat([prices] + avg_prices_all, ignore_index=True)
+        prices["id"] = make_price_ids(prices)
+        prices.set_index("id", drop=False, inplace=True, verify_integrity=True)
         return prices
-    
\ No newline at end of file
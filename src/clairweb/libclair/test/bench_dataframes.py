@@ -0,0 +1,191 @@
+###############################################################################
+#    Clair - Project to discover prices on e-commerce sites.                  #
+#                                                                             #
+#    Copyright (C) 2017 by Eike Welk                                          #
+#    eike.welk@gmx.net                                                        #
+#                                                                             #
+#    License: GPL Version 3                                                   #
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+"""
+Benchmarks for module ``dataframes``.
+
+The benchmarks are not collected by a plain ``pytest`` run, because they take
+long. Run them explicitly, they need a (test) database::
+
+    pytest -s libclair/test/bench_dataframes.py
+"""
+
+import time
+
+import pytest #contains `skip`, `fail`, `raises`, `config` #IGNORE:W0611
+import numpy as np
+import pandas as pd
+from django.db import transaction
+
+
+N_ROWS = 20000
+"Number of rows of the synthetic frames."
+
+
+def make_listing_frame(n_rows, start=0):
+    """
+    Create a synthetic frame of listings, with the columns of
+    ``econdata.models.Listing``. Some values are missing.
+    """
+    ids = np.arange(start, start + n_rows)
+    id_strs = pd.Series(ids).astype(str)
+    prices = np.round(np.random.uniform(10, 500, n_rows), 2)
+    prices[::7] = np.nan
+    times = pd.Series(pd.date_range('2017-01-01', periods=n_rows, freq='min',
+                                    tz='UTC'))
+    times[::11] = pd.NaT
+    frame = pd.DataFrame({
+        'id': '2017-01-01-ebay-' + id_strs,
+        'site': 'ebay',
+        'id_site': id_strs,
+        'title': 'Nikon D90 with lens, listing ' + id_strs,
+        'description': 'A long description of the listing. ' * 20,
+        'prod_spec': '{"megapixel": "12"}',
+        'condition': np.random.choice(['new', 'used', 'not-working'], n_rows),
+        'time': times,
+        'currency': np.random.choice(['EUR', 'USD'], n_rows),
+        'price': prices,
+        'shipping_price': 5.,
+        'is_real': True,
+        'is_sold': np.random.choice([True, False], n_rows),
+        'location': 'Pensacola, FL, USA',
+        'shipping_locations': 'Worldwide',
+        'seller': 'seller',
+        'buyer': '',
+        'item_url': 'http://www.ebay.com/itm/' + id_strs,
+        'status': np.random.choice(['active', 'ended'], n_rows),
+        'listing_type': np.random.choice(['auction', 'fixed-price'], n_rows),
+        })
+    return frame
+
+
+def write_frame_create_iloc(pd_frame, db_model):
+    """
+    The previous implementation of ``write_frame_create``, for comparison.
+    Creates one ``pandas.Series`` for each row.
+    """
+    with transaction.atomic():
+        rows = []
+        for i in range(len(pd_frame)):
+            kwargs = dict(pd_frame.iloc[i])
+            rows.append(db_model(**kwargs))
+        db_model.objects.bulk_create(rows)
+
+
+@pytest.mark.django_db
+def test_write_frame_create():
+    """Compare rows/second of ``write_frame_create`` with the old algorithm."""
+    from econdata.models import Listing
+    from libclair.dataframes import write_frame_create
+
+    # The old algorithm can't write ``NaT``; it gets a frame without them.
+    frame_old = make_listing_frame(N_ROWS, start=0)
+    frame_old['time'] = frame_old['time'].fillna(pd.Timestamp('2017-01-01', tz='UTC'))
+    start = time.perf_counter()
+    write_frame_create_iloc(frame_old, Listing)
+    dur_old = time.perf_counter() - start
+
+    frame_new = make_listing_frame(N_ROWS, start=N_ROWS)
+    start = time.perf_counter()
+    write_frame_create(frame_new, Listing)
+    dur_new = time.perf_counter() - start
+
+    print()
+    print('write_frame_create, {n} rows:'.format(n=N_ROWS))
+    print('    old (iloc):     {r:10.0f} rows/s'.format(r=N_ROWS / dur_old))
+    print('    new (columns):  {r:10.0f} rows/s'.format(r=N_ROWS / dur_new))
+    print('    speedup:        {s:10.1f}'.format(s=dur_old / dur_new))
+    assert Listing.objects.count() == 2 * N_ROWS
+
+
+@pytest.mark.django_db
+def test_write_frame_bulk():
+    """
+    Compare rows/second of ``write_frame_bulk`` with ``write_frame``, for 
+    new and for existing records. The daemon writes its listings with 
+    ``write_frame_bulk``, it must be faster.
+    """
+    from econdata.models import Listing
+    from libclair.dataframes import write_frame, write_frame_bulk
+
+    n_rows = N_ROWS // 10
+    frame = make_listing_frame(n_rows)
+    frame['time'] = frame['time'].fillna(pd.Timestamp('2017-01-01', tz='UTC'))
+    frame['price'] = frame['price'].fillna(0.)
+
+    print()
+    for case in ['insert', 'update']:
+        durations = []
+        for write in [write_frame, write_frame_bulk]:
+            if case == 'insert':
+                Listing.objects.all().delete()
+            else:
+                write_frame_bulk(frame, Listing)
+            start = time.perf_counter()
+            write(frame, Listing)
+            durations.append(time.perf_counter() - start)
+        dur_old, dur_new = durations
+        
+        print('write_frame ({c}), {n} rows:'.format(c=case, n=n_rows))
+        print('    write_frame:      {r:10.0f} rows/s'
+              .format(r=n_rows / dur_old))
+        print('    write_frame_bulk: {r:10.0f} rows/s'
+              .format(r=n_rows / dur_new))
+        print('    speedup:          {s:10.1f}'.format(s=dur_old / dur_new))
+        assert Listing.objects.count() == n_rows
+        assert dur_new < dur_old
+
+
+@pytest.mark.django_db
+def test_read_frame():
+    """Compare time and memory of ``read_frame`` with and without ``compact``."""
+    from econdata.models import Listing
+    from libclair.dataframes import write_frame_create, read_frame
+
+    write_frame_create(make_listing_frame(N_ROWS), Listing)
+    qset = Listing.objects.all()
+    fieldnames = [f.name for f in Listing._meta.get_fields() 
+                  if f.auto_created == False and f.name != 'description']
+
+    # Best of several runs, the first run fills the database's caches.
+    dur_old, dur_new = np.inf, np.inf
+    for _ in range(3):
+        start = time.perf_counter()
+        frame_old = read_frame(qset, fieldnames)
+        dur_old = min(time.perf_counter() - start, dur_old)
+        
+        start = time.perf_counter()
+        frame_new = read_frame(qset, fieldnames, compact=True)
+        dur_new = min(time.perf_counter() - start, dur_new)
+    mem_old = frame_old.memory_usage(deep=True).sum()
+    mem_new = frame_new.memory_usage(deep=True).sum()
+
+    print()
+    print('read_frame, {n} rows, without description:'.format(n=N_ROWS))
+    print('    default: {r:10.0f} rows/s, {m:8.1f} MB'
+          .format(r=N_ROWS / dur_old, m=mem_old / 1e6))
+    print('    compact: {r:10.0f} rows/s, {m:8.1f} MB'
+          .format(r=N_ROWS / dur_new, m=mem_new / 1e6))
+    print('    compact/default: time {t:.2f}, memory {m:.2f}'
+          .format(t=dur_new / dur_old, m=mem_new / mem_old))
+    assert len(frame_old) == len(frame_new) == N_ROWS
+    assert dur_new < dur_old
+    assert mem_new < mem_old
@@ -0,0 +1,305 @@
+###############################################################################
+#    Clair - Project to discover prices on e-commerce sites.                  #
+#                                                                             #
+#    Copyright (C) 2017 by Eike Welk                                          #
+#    eike.welk@gmx.net                                                        #
+#                                                                             #
+#    License: GPL Version 3                                                   #
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+"""
+Benchmarks for module ``prices``.
+
+The benchmarks are not collected by a plain ``pytest`` run, because they take
+long. Run them explicitly::
+
+    pytest -s libclair/test/bench_prices.py
+"""
+
+import time
+from types import SimpleNamespace
+
+import pytest #contains `skip`, `fail`, `raises`, `config` #IGNORE:W0611
+import numpy as np
+import pandas as pd
+
+
+N_LISTINGS = 50000
+"Number of listings of the synthetic frame."
+
+N_PRODUCTS = 200
+"Number of products in the synthetic frame."
+
+
+def make_listing_frame(n_listings, n_products, seed=42):
+    """
+    Create a synthetic frame of listings, with the columns that 
+    ``PriceEstimator`` needs. Each listing contains 1 to 4 products.
+    Some listings are not sold, have no price, or contain unknown products.
+    """
+    rng = np.random.RandomState(seed)
+    product_ids = ["prod-{:04d}".format(i) for i in range(n_products)]
+    all_ids = product_ids + ["xxx-unknown"]
+    n_prods = rng.randint(1, 5, n_listings)
+    products = [list(rng.choice(all_ids, n)) for n in n_prods]
+    prices = np.round(rng.uniform(10, 500, n_listings), 2)
+    prices[::13] = np.nan
+    listings = pd.DataFrame(
+        {"products": products,
+         "price": prices,
+         "sold": rng.choice([1., 0.], n_listings, p=[0.8, 0.2]),
+         "condition": rng.choice([1., 0.7, 0.1], n_listings),
+         "currency": "EUR",
+         "time": pd.Timestamp("2016-01-01") + 
+                 pd.to_timedelta(rng.uniform(0, 365, n_listings), unit="D"),
+         },
+        index=["listing-{}".format(i) for i in range(n_listings)])
+    return listings, product_ids
+
+
+def test_compute_product_occurrence_matrix_long():
+    """
+    Compare ``compute_product_occurrence_matrix`` (loop over rows) with 
+    ``compute_product_occurrence_matrix_long`` (vectorized).
+    """
+    from libclair.prices import PriceEstimator
+    
+    listings, product_ids = make_listing_frame(N_LISTINGS, N_PRODUCTS)
+    estimator = PriceEstimator()
+    
+    start = time.perf_counter()
+    matrix_o, prices_o, lids_o, pids_o = \
+        estimator.compute_product_occurrence_matrix(listings, product_ids, 
+                                                    use_sparse=True)
+    dur_old = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    listing_products = estimator.convert_listings_to_long(listings)
+    dur_conv = time.perf_counter() - start
+    matrix_n, prices_n, lids_n, pids_n = \
+        estimator.compute_product_occurrence_matrix_long(
+                                listing_products, product_ids, use_sparse=True)
+    dur_new = time.perf_counter() - start
+    
+    print()
+    print("compute_product_occurrence_matrix, {n} listings, {m} valid:"
+          .format(n=N_LISTINGS, m=matrix_n.shape[0]))
+    print("    old (iterrows):    {t:8.3f} s".format(t=dur_old))
+    print("    new (long format): {t:8.3f} s, conversion {c:8.3f} s"
+          .format(t=dur_new, c=dur_conv))
+    print("    speedup:           {s:8.1f}".format(s=dur_old / dur_new))
+    
+    assert (matrix_o != matrix_n).nnz == 0
+    np.testing.assert_array_equal(prices_o, prices_n)
+    np.testing.assert_array_equal(lids_o, lids_n)
+    np.testing.assert_array_equal(pids_o, pids_n)
+
+
+def test_solve_prices_lstsq_blocks():
+    """
+    Compare ``solve_prices_lstsq`` (one big equation system) with 
+    ``solve_prices_lstsq_blocks`` (one system per connected component).
+    """
+    from libclair.prices import PriceEstimator
+    
+    #Products in different groups never appear in the same listing.
+    n_groups, n_group_prods, n_group_listings = 40, 30, 200
+    rng = np.random.RandomState(42)
+    rows = []
+    for i_group in range(n_groups):
+        for _ in range(n_group_listings):
+            prods = rng.choice(n_group_prods, rng.randint(1, 4), replace=False)
+            row = np.zeros(n_groups * n_group_prods)
+            row[i_group * n_group_prods + prods] = 1.
+            rows.append(row)
+    matrix = np.array(rows)
+    real_prices = rng.uniform(5, 500, matrix.shape[1])
+    listing_prices = matrix.dot(real_prices)
+    listing_ids = np.array(["l{}".format(i) for i in range(matrix.shape[0])],
+                           dtype=object)
+    product_ids = np.array(["p{}".format(i) for i in range(matrix.shape[1])],
+                           dtype=object)
+    
+    estimator = PriceEstimator()
+    start = time.perf_counter()
+    prices_o, _, good_cols_o, _ = estimator.solve_prices_lstsq(
+                        matrix, listing_prices, listing_ids, product_ids)
+    dur_old = time.perf_counter() - start
+    
+    durs_new = []
+    for n_threads in [1, 4]:
+        estimator.n_threads = n_threads
+        start = time.perf_counter()
+        prices_n, _, good_cols_n, _ = estimator.solve_prices_lstsq_blocks(
+                        matrix, listing_prices, listing_ids, product_ids)
+        durs_new.append(time.perf_counter() - start)
+    
+    print()
+    print("solve_prices_lstsq, matrix shape {s}, {n} components:"
+          .format(s=matrix.shape, n=n_groups))
+    print("    one system:           {t:8.3f} s".format(t=dur_old))
+    print("    blocks, 1 thread:     {t:8.3f} s".format(t=durs_new[0]))
+    print("    blocks, 4 threads:    {t:8.3f} s".format(t=durs_new[1]))
+    
+    assert all(good_cols_o == good_cols_n)
+    np.testing.assert_allclose(prices_o, prices_n)
+    np.testing.assert_allclose(prices_n, real_prices)
+
+
+def test_compute_prices_processes():
+    """
+    Compare ``compute_prices`` with one process and with several processes.
+    """
+    from libclair.prices import PriceEstimator
+    
+    listings, product_ids = make_listing_frame(N_LISTINGS // 5, N_PRODUCTS)
+    products = [SimpleNamespace(id=pid) for pid in product_ids]
+    estimator = PriceEstimator()
+    
+    start = time.perf_counter()
+    prices_1 = estimator.compute_prices(listings, products)
+    dur_1 = time.perf_counter() - start
+    
+    estimator.n_processes = 4
+    start = time.perf_counter()
+    prices_4 = estimator.compute_prices(listings, products)
+    dur_4 = time.perf_counter() - start
+    
+    print()
+    print("compute_prices, {n} listings, one year, {p} prices:"
+          .format(n=len(listings), p=len(prices_1)))
+    print("    1 process:   {t:8.3f} s".format(t=dur_1))
+    print("    4 processes: {t:8.3f} s".format(t=dur_4))
+    
+    pd.testing.assert_frame_equal(prices_1, prices_4)
+
+
+def test_create_prices_lstsq_soln():
+    """
+    Measure the speed of ``create_prices_lstsq_soln``, with all listings 
+    in one week.
+    """
+    from libclair.prices import PriceEstimator
+    
+    listings, product_ids = make_listing_frame(N_LISTINGS, N_PRODUCTS)
+    listings["time"] = listings["time"].dt.floor("s")
+    estimator = PriceEstimator()
+    estimator.average_mid_time = pd.Timestamp("2016-06-01")
+    listing_products = estimator.convert_listings_to_long(listings)
+    matrix, listing_prices, listing_ids, product_ids = \
+        estimator.compute_product_occurrence_matrix_long(
+                                listing_products, product_ids, use_sparse=True)
+    product_prices, good_rows, good_cols, _ = \
+        estimator.solve_prices_lstsq_blocks(
+                                matrix, listing_prices, listing_ids, product_ids)
+    
+    start = time.perf_counter()
+    prices = estimator.create_prices_lstsq_soln(
+                                matrix, listing_prices, listing_ids, 
+                                product_prices, product_ids, 
+                                good_rows, good_cols, listings)
+    dur = time.perf_counter() - start
+    
+    print()
+    print("create_prices_lstsq_soln, {n} listings:".format(n=matrix.shape[0]))
+    print("    {p} prices in {t:8.3f} s".format(p=len(prices), t=dur))
+    assert prices.index.is_unique
+
+
+def test_solve_prices_lstsq_robust():
+    """
+    Compare the plain least square solution with the robust (IRLS) 
+    solutions, on a system with outliers. 
+    """
+    from scipy import sparse
+    from libclair.prices import PriceEstimator
+    
+    n_listings, n_products = 20000, 300
+    rng = np.random.RandomState(42)
+    matrix = np.zeros((n_listings, n_products))
+    for i_row in range(n_listings):
+        prods = rng.choice(n_products, rng.randint(1, 4), replace=False)
+        matrix[i_row, prods] = 1.
+    real_prices = rng.uniform(5, 500, n_products)
+    listing_prices = matrix.dot(real_prices) * rng.normal(1, 0.05, n_listings)
+    #3% outliers: mislabeled listings, bundles with unknown items
+    i_outl = rng.choice(n_listings, n_listings * 3 // 100, replace=False)
+    listing_prices[i_outl] *= rng.uniform(3, 10, len(i_outl))
+    listing_ids = np.array(["l{}".format(i) for i in range(n_listings)],
+                           dtype=object)
+    product_ids = np.array(["p{}".format(i) for i in range(n_products)],
+                           dtype=object)
+    
+    print()
+    print("solve_prices_lstsq, matrix shape {s}, {n} outliers:"
+          .format(s=matrix.shape, n=len(i_outl)))
+    estimator = PriceEstimator()
+    for mat_name, mat in [("dense", matrix), 
+                          ("sparse", sparse.csr_matrix(matrix))]:
+        for robust_method in [None, "huber", "tukey"]:
+            estimator.robust_method = robust_method
+            start = time.perf_counter()
+            prices, _, _, _, weights = estimator.solve_prices_lstsq(
+                            mat, listing_prices, listing_ids, product_ids,
+                            return_weights=True)
+            dur = time.perf_counter() - start
+            err = np.max(np.abs(prices - real_prices) / real_prices)
+            print("    {m:6} {r:6}: {t:8.3f} s, max. rel. error {e:6.3f}, "
+                  "mean outlier weight {w:5.2f}"
+                  .format(m=mat_name, r=str(robust_method), t=dur, e=err,
+                          w=np.mean(weights[i_outl])))
+
+
+def test_compute_average_prices():
+    """
+    Compare ``compute_prices`` (solve the listings' equations of each 
+    period) with ``compute_average_prices`` (sum daily statistics).
+    """
+    from libclair.prices import PriceEstimator
+    
+    listings, product_ids = make_listing_frame(N_LISTINGS // 2, N_PRODUCTS)
+    products = [SimpleNamespace(id=pid) for pid in product_ids]
+    estimator = PriceEstimator()
+    estimator.use_sparse = True
+    
+    start = time.perf_counter()
+    stats = estimator.compute_daily_statistics(listings, product_ids)
+    dur_stats = time.perf_counter() - start
+    
+    print()
+    print("average prices, {n} listings, one year, {p} products:"
+          .format(n=len(listings), p=N_PRODUCTS))
+    print("    daily statistics:      {t:8.3f} s".format(t=dur_stats))
+    for avg_period in ["week", "month"]:
+        start = time.perf_counter()
+        prices = estimator.compute_prices(listings, products, 
+                                          avg_period=avg_period)
+        dur_old = time.perf_counter() - start
+        start = time.perf_counter()
+        avg_prices = estimator.compute_average_prices(stats, avg_period)
+        dur_new = time.perf_counter() - start
+        print("    {a:5}, listings:       {t:8.3f} s".format(a=avg_period, 
+                                                          t=dur_old))
+        print("    {a:5}, statistics:     {t:8.3f} s".format(a=avg_period, 
+                                                          t=dur_new))
+        avg_prices_o = prices[prices["type"] == "average"].sort_index()
+        np.testing.assert_allclose(avg_prices.sort_index()["price"], 
+                                   avg_prices_o["price"], rtol=1e-4)
+    
+    start = time.perf_counter()
+    avg_prices = estimator.compute_average_prices(stats, "rolling-30d")
+    dur_new = time.perf_counter() - start
+    print("    rolling-30d, statistics: {t:6.3f} s, {n} prices"
+          .format(t=dur_new, n=len(avg_prices)))
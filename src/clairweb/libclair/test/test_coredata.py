@@ -55,7 +55,32 @@ def test_import():
     assert SEARCH_TASK_DESCRIPTOR
     assert UPDATE_TASK_DESCRIPTOR
 
+
+def test_make_price_ids():
+    print('Start...')
+    from datetime import datetime
+    import pandas as pd
+    from libclair.coredata import make_price_id, make_price_ids
+    
+    times_naive = [pd.Timestamp("2017-01-02 10:00:01"), 
+                   pd.Timestamp("2017-01-02 10:00:01.5"), 
+                   datetime(2000, 1, 1), pd.NaT]
+    times_utc = [pd.Timestamp("2017-01-02 10:00:01", tz="UTC"), 
+                 pd.Timestamp("2017-01-02 10:00:01.000000005", tz="UTC"), 
+                 None, None]
+    times_berlin = [pd.Timestamp("2017-07-02 10:00:01", tz="Europe/Berlin"), 
+                    pd.Timestamp("2017-01-02 10:00:01", tz="Europe/Berlin"), 
+                    pd.NaT, pd.NaT]
+    for times in [times_naive, times_utc, times_berlin]:
+        prices = pd.DataFrame({"time": times, "product": ["a", "b", "a", "c"],
+                               "listing": "l1", "type": "observed"})
+        ids = make_price_ids(prices)
+        print(ids)
+        assert list(ids) == [make_price_id(row) for _, row in prices.iterrows()]
+    assert ids[0] == "2017-07-02T10:00:01+02:00-a-l1-observed"
+
     
 if __name__ == "__main__":
+    test_make_price_ids()
     
     pass
@@ -318,6 +318,133 @@ def test__write_frame__read_frame():
     assert_frames_equal(fr2, fr3)
 
 
+@pytest.mark.django_db
+def test_write_frame_bulk():
+    print("Start")
+    from econdata.models import Listing
+    from collect.models import ListingFoundBy
+    from django.db import connection
+    from libclair.dataframes import (write_frame_bulk, read_frame, 
+                                     _supports_native_upsert)
+    
+    # Create new records. The duplicate ID must be written only once, 
+    # the last row wins.
+    fr1 = pd.DataFrame([{'id':'foo-1', 'site':'a', 'id_site':'1', 'title':'The 1st record.', 'price':1.},
+                        {'id':'foo-2', 'site':'a', 'id_site':'2', 'title':'The 2nd record.', 'price':np.nan},
+                        {'id':'foo-2', 'site':'a', 'id_site':'2', 'title':'The 2nd record, again.', 'price':np.nan}])
+    print('\nfr1:\n', fr1)
+    write_frame_bulk(fr1, Listing, chunksize=2)
+    
+    qset = Listing.objects.filter(id__in=['foo-1', 'foo-2']).order_by('id')
+    fr2 = read_frame(qset, ['id', 'title', 'price'])
+    print('\nfr2:\n', fr2)
+    assert len(fr2) == 2
+    assert fr2['title'][1] == 'The 2nd record, again.'
+    assert np.isnan(fr2['price'][1])
+    
+    # Update one existing record and create a new record.
+    fr3 = pd.DataFrame([{'id':'foo-2', 'site':'a', 'id_site':'2', 'title':'The 2nd record, updated.', 'price':2.},
+                        {'id':'foo-3', 'site':'a', 'id_site':'3', 'title':'The 3rd record.', 'price':3.}])
+    write_frame_bulk(fr3, Listing, chunksize=2)
+    
+    qset = Listing.objects.filter(id__in=['foo-1', 'foo-2', 'foo-3']).order_by('id')
+    fr4 = read_frame(qset, ['id', 'title', 'price'])
+    print('\nfr4:\n', fr4)
+    assert list(fr4['id']) == ['foo-1', 'foo-2', 'foo-3']
+    assert list(fr4['title']) == ['The 1st record.', 'The 2nd record, updated.', 'The 3rd record.']
+    assert list(fr4['price']) == [1., 2., 3.]
+    
+    # Only the written columns are updated, the others keep their values.
+    # SQLite 3.24+ uses ``INSERT ... ON CONFLICT``.
+    assert _supports_native_upsert(connection)
+    fr5 = pd.DataFrame([{'id':'foo-1', 'time':pd.Timestamp('2017-01-01 12:00+0')}])
+    write_frame_bulk(fr5, Listing)
+    rec = Listing.objects.get(id='foo-1')
+    assert rec.title == 'The 1st record.'
+    assert rec.price == 1.
+    assert rec.time == pd.Timestamp('2017-01-01 12:00+0')
+    
+    # Records that are identified by several columns, and not by primary key.
+    fr5 = pd.DataFrame({'task': [1, 1, 2], 'listing': ['foo-1', 'foo-2', 'foo-1']})
+    write_frame_bulk(fr5, ListingFoundBy, idnames=['task', 'listing'])
+    write_frame_bulk(fr5, ListingFoundBy, idnames=['task', 'listing'])
+    assert ListingFoundBy.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_read_frame_chunks():
+    print("Start")
+    from econdata.models import Listing
+    from libclair.dataframes import write_frame_create, read_frame, read_frame_chunks
+    
+    fr1 = pd.DataFrame([{'id':'foo-1', 'site':'a', 'id_site':'1', 'title':'The 1st record.', 
+                         'description':'Long text 1', 'time':pd.Timestamp('2017-01-01 12:00+0'), 'price':1.},
+                        {'id':'foo-2', 'site':'a', 'id_site':'2', 'title':'The 2nd record.', 
+                         'description':'Long text 2', 'time':pd.Timestamp('2017-01-02 12:00+0'), 'price':2.},
+                        {'id':'foo-3', 'site':'a', 'id_site':'3', 'title':'The 3rd record.', 
+                         'description':'Long text 3', 'time':pd.Timestamp('2017-01-03 12:00+0'), 'price':np.nan}])
+    write_frame_create(fr1, Listing)
+    
+    qset = Listing.objects.all().order_by('id')
+    chunks = list(read_frame_chunks(qset, ['id', 'title', 'time', 'price'], chunksize=2))
+    print('\nchunks:\n', chunks)
+    assert [len(c) for c in chunks] == [2, 1]
+    for chunk in chunks:
+        assert pd_types.is_datetime64_any_dtype(chunk['time'])
+        assert pd_types.is_float_dtype(chunk['price'])
+    
+    # All chunks together are equal to the result of ``read_frame``.
+    fr2 = pd.concat(chunks)
+    fr3 = read_frame(qset, ['id', 'title', 'time', 'price'])
+    assert_frames_equal(fr2, fr3)
+    
+    # Large text columns can be left out.
+    chunks = list(read_frame_chunks(qset, chunksize=2, defer_text=True))
+    assert 'description' not in chunks[0].columns
+    assert 'title' in chunks[0].columns
+
+
+@pytest.mark.django_db
+def test_read_frame_compact():
+    print("Start")
+    from econdata.models import Listing
+    from libclair.dataframes import write_frame_create, read_frame
+    
+    fr1 = pd.DataFrame([{'id':'foo-1', 'site':'a', 'id_site':'1', 'title':'The 1st record.', 
+                         'time':pd.Timestamp('2017-01-01 12:00+0'), 'price':1., 
+                         'currency':'EUR', 'status':'ended', 'is_sold':True},
+                        {'id':'foo-2', 'site':'a', 'id_site':'2', 'title':'The 2nd record.', 
+                         'time':pd.NaT, 'price':np.nan, 
+                         'currency':'USD', 'status':'active', 'is_sold':None},
+                        {'id':'foo-3', 'site':'a', 'id_site':'3', 'title':'The 3rd record.', 
+                         'time':pd.Timestamp('2017-01-03 12:00+0'), 'price':3., 
+                         'currency':'EUR', 'status':'ended', 'is_sold':False}])
+    write_frame_create(fr1, Listing)
+    
+    qset = Listing.objects.all().order_by('id')
+    fr2 = read_frame(qset, compact=True)
+    print('\nfr2:\n', fr2)
+    print("dtypes:\n", fr2.dtypes)
+    
+    assert list(fr2.columns) == list(read_frame(qset).columns)
+    assert pd_types.is_categorical_dtype(fr2['currency'])
+    assert pd_types.is_categorical_dtype(fr2['status'])
+    assert pd_types.is_object_dtype(fr2['site'])
+    assert pd_types.is_object_dtype(fr2['title'])
+    assert pd_types.is_datetime64_any_dtype(fr2['time'])
+    assert fr2['is_sold'].dtype == 'boolean'
+    assert list(fr2['currency']) == ['EUR', 'USD', 'EUR']
+    assert list(fr2['status']) == ['ended', 'active', 'ended']
+    assert list(fr2['title']) == ['The 1st record.', 'The 2nd record.', 'The 3rd record.']
+    assert fr2['time'][0] == pd.Timestamp('2017-01-01 12:00+0')
+    assert pd.isnull(fr2['time'][1])
+    assert fr2['price'][0] == 1.
+    assert np.isnan(fr2['price'][1])
+    assert fr2['is_sold'][0] == True
+    assert pd.isnull(fr2['is_sold'][1])
+    assert fr2['is_sold'][2] == False
+
+
 
 if __name__ == "__main__":
     #One can't use models without this
@@ -330,5 +457,8 @@ if __name__ == "__main__":
     test_make_data_frame_2()
     test_convert_model_to_descriptor()
     test__write_frame__read_frame()
+    test_write_frame_bulk()
+    test_read_frame_chunks()
+    test_read_frame_compact()
     
     pass #IGNORE:W0107
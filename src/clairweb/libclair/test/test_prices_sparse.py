@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#    Clair - Project to discover prices on e-commerce sites.                  #
+#                                                                             #
+#    Copyright (C) 2013 by Eike Welk                                          #
+#    eike.welk@gmx.net                                                        #
+#                                                                             #
+#    License: GPL Version 3                                                   #
+#                                                                             #
+#    This program is free software: you can redistribute it and/or modify     #
+#    it under the terms of the GNU General Public License as published by     #
+#    the Free Software Foundation, either version 3 of the License, or        #
+#    (at your option) any later version.                                      #
+#                                                                             #
+#    This program is distributed in the hope that it will be useful,          #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of           #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the            #
+#    GNU General Public License for more details.                             #
+#                                                                             #
+#    You should have received a copy of the GNU General Public License        #
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.    #
+###############################################################################
+"""
+Tests for the price estimation algorithms in ``libclair.prices``: sparse 
+matrices, independent blocks, robust solutions, and daily statistics.
+
+The older tests in ``test_prices.py`` need the former ``clair`` package and 
+Python 2; these tests run with the current code.
+"""
+
+import time
+
+import numpy as np
+from numpy import array, dot
+
+#Set up logging fore useful debug output, and time stamps in UTC.
+import logging
+logging.basicConfig(format='%(asctime)s: %(levelname)s: %(message)s', 
+                    level=logging.DEBUG)
+#Time stamps must be in UTC
+logging.Formatter.converter = time.gmtime
+
+
+def test_PriceEstimator_compute_product_occurrence_matrix_long():
+    "Test vectorized construction of the matrix from data in long format."
+    import pandas as pd
+    from libclair.prices import PriceEstimator
+    
+    listings = pd.DataFrame(
+        {"products":  [["a", "b"], ["c"], ["a", "x"], [], None, 
+                       ["b", "b"], ["c"], ["a"]],
+         "price":     [10., 20., 30., 40., 50., 60., np.nan, 80.],
+         "sold":      [1., 1., 1., 1., 1., 1., 1., 0.],
+         "condition": [1., 0.7, 1., 1., 1., 0.1, 1., 1.]},
+        index=["l1", "l2", "l3", "l4", "l5", "l6", "l7", "l8"])
+    product_ids = ["c", "b", "a"]
+    
+    estimator = PriceEstimator()
+    listing_products = estimator.convert_listings_to_long(listings)
+    print(listing_products)
+    assert len(listing_products) == 9
+    
+    for use_sparse in [False, True]:
+        matrix, prices, listing_ids, product_ids_m = \
+            estimator.compute_product_occurrence_matrix_long(
+                                listing_products, product_ids, use_sparse)
+        if use_sparse:
+            matrix = matrix.toarray()
+        print("matrix:\n", matrix)
+        np.testing.assert_array_equal(matrix, [[1.,  1.,  0. ],
+                                               [0.,  0.,  0.7],
+                                               [0.,  0.1, 0. ]])
+        np.testing.assert_array_equal(prices, [10., 20., 60.])
+        assert list(listing_ids) == ["l1", "l2", "l6"]
+        assert list(product_ids_m) == ["a", "b", "c"]
+
+
+def test_PriceEstimator_solve_prices_lstsq_sparse():
+    "Test linear least square algorithm with sparse matrices."
+    from scipy import sparse
+    from libclair.prices import PriceEstimator
+    
+    estimator = PriceEstimator()
+    
+    listing_ids = array(["l1", "l2", "l3", "l4", "l5", 
+                        "l6", "l7", "l8", "l9", "l10"])
+    product_ids = array(["a", "b", "c", "d", "e"])
+    real_prices = array([500, 200, 100, 50.,  5.])
+    
+    print("Matrix has full rank, no noise ---------------------------------")
+    matrix =     array([[ 1.,  0.,  0.,  0.,  0.,],
+                        [ 1.,  0.,  0.,  0.,  0.,],
+                        [ 0.,  1.,  0.,  0.,  0.,],
+                        [ 0.,  1.,  0.,  0.,  0.,],
+                        [ 1.,  1.,  0.,  0.,  0.,],
+                        [ 1.,  0.,  1.,  0.,  0.,],
+                        [ 0.,  0.,  1.,  1.,  0.,],
+                        [ 0.,  0.,  1.,  0.,  1.,],
+                        [ 0.,  0.,  0.,  1.,  1.,],
+                        [ 1.,  1.,  1.,  1.,  1.,],
+                        ])
+    listing_prices = dot(matrix, real_prices)
+    product_prices, good_rows, good_cols, problem_products = \
+                estimator.solve_prices_lstsq(sparse.csr_matrix(matrix), 
+                                             listing_prices, 
+                                             listing_ids, product_ids)
+    print("product_prices:", product_prices)
+    np.testing.assert_allclose(product_prices, real_prices)
+    assert all(good_cols)
+    assert problem_products == []
+    
+    print("Matrix has insufficient rank, no noise -------------------------")
+    matrix =     array([[ 1.,  0.,  0.,  0.,  0.,],
+                        [ 1.,  0.,  0.,  0.,  0.,],
+                        [ 0.,  1.,  0.,  0.,  0.,],
+                        [ 0.,  1.,  0.,  0.,  0.,],
+                        [ 1.,  1.,  0.,  0.,  0.,],
+                        [ 1.,  0.,  1.,  0.,  0.,],
+                        [ 0.,  0.,  0.,  1.,  1.,],
+                        [ 0.,  0.,  0.,  1.,  1.,],
+                        [ 0.,  0.,  0.,  1.,  1.,],
+                        [ 1.,  1.,  1.,  0.,  0.,], 
+                        ])
+    listing_prices = dot(matrix, real_prices)
+    product_prices, good_rows, good_cols, problem_products = \
+                estimator.solve_prices_lstsq(sparse.csr_matrix(matrix), 
+                                             listing_prices, 
+                                             listing_ids, product_ids)
+    print("product_prices:", product_prices)
+    np.testing.assert_allclose(product_prices[0:3], real_prices[0:3])
+    assert all(good_cols == [True, True, True, False, False])
+    assert list(problem_products) == ["d", "e"]
+
+
+def test_PriceEstimator_solve_prices_lstsq_blocks():
+    "Test solving the independent blocks of the equation system separately."
+    from libclair.prices import PriceEstimator
+    
+    estimator = PriceEstimator()
+    estimator.min_block_size = 1
+    
+    listing_ids = array(["l1", "l2", "l3", "l4", "l5", "l6", "l7"])
+    product_ids = array(["a", "b", "c", "d", "e", "f"])
+    real_prices = array([500, 200, 100, 50.,  5., 1.])
+    #Blocks: (a, b), (c), (d, e); f appears in no listing.
+    matrix =     array([[ 1.,  0.,  0.,  0.,  0.,  0.,],
+                        [ 1.,  1.,  0.,  0.,  0.,  0.,],
+                        [ 0.,  1.,  0.,  0.,  0.,  0.,],
+                        [ 0.,  0.,  1.,  0.,  0.,  0.,],
+                        [ 0.,  0.,  0.,  1.,  1.,  0.,],
+                        [ 0.,  0.,  0.,  1.,  1.,  0.,],
+                        [ 0.,  0.,  1.,  0.,  0.,  0.,],
+                        ])
+    listing_prices = dot(matrix, real_prices)
+    
+    n_components, product_labels, listing_labels = \
+                            estimator.find_connected_components(matrix)
+    print("product_labels:", product_labels)
+    print("listing_labels:", listing_labels)
+    assert n_components == 4
+    assert list(product_labels) == [0, 0, 1, 2, 2, 3]
+    assert list(listing_labels) == [0, 0, 0, 1, 2, 2, 1]
+    
+    for n_threads in [1, 2]:
+        estimator.n_threads = n_threads
+        product_prices, good_rows, good_cols, problem_products = \
+            estimator.solve_prices_lstsq_blocks(matrix, listing_prices, 
+                                                listing_ids, product_ids)
+        print("product_prices:", product_prices)
+        np.testing.assert_allclose(product_prices[0:3], real_prices[0:3])
+        assert all(good_cols == [True, True, True, False, False, False])
+        assert all(good_rows == [True, True, True, True, False, False, True])
+        assert problem_products == ["d", "e", "f"]
+
+
+def test_PriceEstimator_solve_prices_lstsq_robust():
+    "Test robust linear least square algorithm, with an outlier."
+    from scipy import sparse
+    from libclair.prices import PriceEstimator
+    
+    listing_ids = array(["l1", "l2", "l3", "l4", "l5", "l6", "l7", "l8"])
+    product_ids = array(["a", "b"])
+    real_prices = array([100., 20.])
+    matrix =     array([[ 1.,  0.,],
+                        [ 1.,  0.,],
+                        [ 1.,  0.,],
+                        [ 1.,  0.,],
+                        [ 1.,  1.,],
+                        [ 0.,  1.,],
+                        [ 0.,  1.,],
+                        [ 0.,  1.,],
+                        ])
+    listing_prices = dot(matrix, real_prices) * \
+                     array([1.01, 0.99, 1.02, 0.98, 1., 1.01, 0.99, 1.])
+    #Listing "l8" is a mislabeled listing, that contains product "a".
+    listing_prices[7] = 100.
+    
+    estimator = PriceEstimator()
+    product_prices = estimator.solve_prices_lstsq(
+                        matrix, listing_prices, listing_ids, product_ids)[0]
+    print("product_prices, plain:", product_prices)
+    assert abs(product_prices[1] - 20.) > 1.
+    
+    for robust_method in ["huber", "tukey"]:
+        estimator.robust_method = robust_method
+        for mat in [matrix, sparse.csr_matrix(matrix)]:
+            product_prices, good_rows, good_cols, problem_products, weights = \
+                estimator.solve_prices_lstsq(mat, listing_prices, listing_ids, 
+                                             product_ids, return_weights=True)
+            print("product_prices, {}:".format(robust_method), product_prices)
+            print("weights:", weights)
+            np.testing.assert_allclose(product_prices, real_prices, rtol=0.03)
+            assert weights[7] < 0.1
+            assert all(weights[:7] > 0.5)
+            assert all(good_cols)
+
+
+def test_PriceEstimator_solve_prices_lstsq_robust_exact_fits():
+    "Test robust least square algorithm, most listings fit exactly."
+    from libclair.prices import PriceEstimator
+    
+    listing_ids = array(["l{}".format(i) for i in range(16)])
+    product_ids = array(["a", "b", "c"])
+    matrix = np.zeros((16, 3))
+    matrix[0:6, 0] = 1
+    matrix[6:11, 1] = 1
+    matrix[11:16, 2] = 1
+    listing_prices = dot(matrix, array([10., 20., 30.]))
+    #Listing "l5" is a mislabeled listing, the other listings fit exactly.
+    #The median absolute deviation of the residuals is 0.
+    listing_prices[5] = 1000.
+    
+    estimator = PriceEstimator()
+    for robust_method in ["huber", "tukey"]:
+        estimator.robust_method = robust_method
+        product_prices, _, good_cols, _, weights = \
+            estimator.solve_prices_lstsq(matrix, listing_prices, listing_ids, 
+                                         product_ids, return_weights=True)
+        print("product_prices, {}:".format(robust_method), product_prices)
+        print("weights:", weights)
+        np.testing.assert_allclose(product_prices, [10., 20., 30.], 
+                                   rtol=1e-3)
+        assert weights[5] < 0.2
+        assert all(np.delete(weights, 5) > 0.9)
+        assert all(good_cols)
+
+
+def test_PriceEstimator_find_problems_rank_deficient_matrix_sparse():
+    "Test finding the problematic products of a sparse matrix."
+    from scipy import sparse
+    from libclair.prices import PriceEstimator
+    
+    estimator = PriceEstimator()
+    matrix = array([[ 1.,  0.,  0.,  1.,  1.,],
+                    [ 0.,  1.,  0.,  1.,  1.,],
+                    [ 0.,  0.,  1.,  1.,  1.,],
+                    [ 0.,  0.,  0.,  1.,  1.,],
+                    [ 0.,  0.,  0.,  0.,  0.,],
+                    ])
+    good_rows, good_cols, problem_products = \
+        estimator.find_problems_rank_deficient_matrix(sparse.csr_matrix(matrix))
+    print("good_rows:", good_rows)
+    print("good_cols:", good_cols)
+    print("problem_products:", problem_products)
+    assert all(good_rows == [False, False, False, False, True])
+    assert all(good_cols == [True, True, True, False, False])
+    assert problem_products == ["3", "4"]
+
+
+def test_PriceEstimator_create_prices_lstsq_soln_sparse():
+    "Test creation of price records from dense and sparse matrices."
+    import pandas as pd
+    from scipy import sparse
+    from libclair.prices import PriceEstimator
+    
+    listings = make_test_listings()
+    listing_ids = array(["l1", "l2", "l3", "l6"], dtype=object)
+    product_ids = array(["a", "b", "c"], dtype=object)
+    matrix =     array([[ 1.,  0.,  0. ],
+                        [ 1.,  1.,  0. ],
+                        [ 0.,  1.,  0. ],
+                        [ 0.,  0.,  0.7]])
+    listing_prices = array([10., 30., 20., 5.])
+    product_prices = array([10., 20., 5. / 0.7])
+    good_rows = array([True, True, True, True])
+    good_cols = array([True, True, False])
+    
+    estimator = PriceEstimator()
+    prices = estimator.create_prices_lstsq_soln(
+                            matrix, listing_prices, listing_ids, 
+                            product_prices, product_ids, 
+                            good_rows, good_cols, listings)
+    prices_s = estimator.create_prices_lstsq_soln(
+                            sparse.csr_matrix(matrix), listing_prices, 
+                            listing_ids, product_prices, product_ids, 
+                            good_rows, good_cols, listings)
+    print(prices.to_string())
+    pd.testing.assert_frame_equal(prices, prices_s)
+    
+    assert list(prices["type"]) == ["average", "average", "observed", 
+                                    "estimated", "estimated", "observed"]
+    assert list(prices["listing"][2:]) == ["l1", "l2", "l2", "l3"]
+    np.testing.assert_allclose(prices["price"][2:], [10., 10., 20., 20.])
+    assert all(prices["currency"][2:] == "EUR")
+    assert prices["time"].iloc[3] == pd.Timestamp("2017-01-04")
+
+
+def make_test_listings():
+    "Create a small frame of listings in two weeks, for ``compute_prices``."
+    import pandas as pd
+    listings = pd.DataFrame(
+        {"products":  [["a"], ["a", "b"], ["b"], ["a"], ["a", "b"], ["c"]],
+         "price":     [10., 30., 20., 12., 34., 5.],
+         "sold":      [1., 1., 1., 1., 1., 1.],
+         "condition": [1., 1., 1., 1., 1., 1.],
+         "currency":  "EUR",
+         "time": pd.to_datetime(["2017-01-03", "2017-01-04", "2017-01-05", 
+                                 "2017-01-10", "2017-01-11", "2017-01-12"])},
+        index=["l1", "l2", "l3", "l4", "l5", "l6"])
+    return listings
+
+
+def test_PriceEstimator_compute_prices_processes():
+    "Test computing the intervals in parallel processes."
+    from types import SimpleNamespace
+    import pandas as pd
+    from libclair.prices import PriceEstimator
+    
+    listings = make_test_listings()
+    products = [SimpleNamespace(id=pid) for pid in ["a", "b", "c"]]
+    
+    estimator = PriceEstimator()
+    prices_1 = estimator.compute_prices(listings, products)
+    print(prices_1.to_string())
+    estimator.n_processes = 2
+    prices_2 = estimator.compute_prices(listings, products)
+    pd.testing.assert_frame_equal(prices_1, prices_2)
+    
+    avg_prices = prices_1[prices_1["type"] == "average"]
+    assert len(avg_prices) == 5 #2 weeks * (a, b) + c
+    assert set(prices_1["listing"]) >= set(listings.index)
+    
+    #Robust estimation: listing prices get a column "weight".
+    estimator.n_processes = 1
+    estimator.robust_method = "huber"
+    prices_r = estimator.compute_prices(listings, products)
+    print(prices_r.to_string())
+    assert "weight" in prices_r.columns
+    list_prices = prices_r[prices_r["type"] != "average"]
+    assert all((list_prices["weight"] >= 0) & (list_prices["weight"] <= 1))
+
+
+def test_PriceEstimator_compute_average_prices():
+    "Test average prices from summed daily statistics, rolling windows."
+    from types import SimpleNamespace
+    import pandas as pd
+    from libclair.prices import PriceEstimator
+    
+    listings = make_test_listings()
+    products = [SimpleNamespace(id=pid) for pid in ["a", "b", "c"]]
+    
+    estimator = PriceEstimator()
+    stats = estimator.compute_daily_statistics(listings, ["a", "b", "c"])
+    print(stats.days)
+    assert len(stats.days) == 6
+    assert stats.gram.shape == (6, 9)
+    assert list(stats.n_listings) == [1, 1, 1, 1, 1, 1]
+    
+    #Same average prices as the solution of the listings' equations.
+    for avg_period, n_avg in [("day", 4), ("week", 5), ("month", 3)]:
+        prices = estimator.compute_prices(listings, products, 
+                                          avg_period=avg_period)
+        avg_prices = prices[prices["type"] == "average"].sort_index()
+        avg_prices_s = estimator.compute_average_prices(stats, avg_period)
+        print(avg_prices_s.to_string())
+        assert len(avg_prices_s) == n_avg
+        assert all(avg_prices_s["avg_period"] == avg_period)
+        pd.testing.assert_frame_equal(avg_prices_s.sort_index(), 
+                                      avg_prices[avg_prices_s.columns], 
+                                      check_dtype=False, check_names=False)
+    
+    #Rolling window, with one window ending at each day.
+    prices = estimator.compute_prices(listings, products, 
+                                      avg_period="rolling-7d")
+    print(prices.to_string())
+    assert all(prices["type"] == "average")
+    assert len(set(prices["time"])) == 10
+    #Window from 2017-01-03 to 2017-01-10: listings l1, l2, l3
+    price_a = prices[(prices["product"] == "a") & 
+                     (prices["time"] == pd.Timestamp("2017-01-06 12:00"))]
+    assert list(price_a["avg_num_listings"]) == [2]
+    assert abs(price_a["price"].iloc[0] - 10 * 0.7) < 1e-6
+
+
+def test_PriceStatistics_blocks():
+    "Test splitting the daily statistics into blocks, and assembling them."
+    import pandas as pd
+    from libclair.prices import PriceEstimator, PriceStatistics
+    
+    listings = make_test_listings()
+    estimator = PriceEstimator()
+    stats = estimator.compute_daily_statistics(listings, ["a", "b", "c", "d"])
+    
+    blocks = list(stats.iter_blocks())
+    for block in blocks:
+        print(block)
+    assert len(blocks) == 6
+    assert [list(b[1]) for b in blocks if len(b[1]) > 1] == [["a", "b"]] * 2
+    
+    #Components of the sum of all days, without a dense matrix.
+    gram, _, _, _ = stats.sum_windows(stats.days[:1], 
+                                      stats.days[-1:] + pd.Timedelta("1D"))
+    all_gram = stats.unflatten_gram(gram[0])
+    assert all_gram.shape == (4, 4)
+    assert all_gram.format == "csr"
+    components = stats.find_components(all_gram)
+    assert sorted(list(stats.product_ids[c]) for c in components) == \
+           [["a", "b"], ["c"]]
+    
+    stats_b = PriceStatistics.from_blocks(["d", "c", "b", "a"], stats.days, 
+                                          stats.n_listings, blocks)
+    assert list(stats_b.product_ids) == ["a", "b", "c", "d"]
+    assert abs(stats_b.gram - stats.gram).max() == 0
+    assert (stats_b.rhs == stats.rhs).all()
+    assert (stats_b.counts == stats.counts).all()
+
+
+if __name__ == "__main__":
+#    test_PriceEstimator_compute_product_occurrence_matrix_long()
+#    test_PriceEstimator_solve_prices_lstsq_sparse()
+#    test_PriceEstimator_solve_prices_lstsq_blocks()
+#    test_PriceEstimator_solve_prices_lstsq_robust()
+#    test_PriceEstimator_solve_prices_lstsq_robust_exact_fits()
+#    test_PriceEstimator_create_prices_lstsq_soln_sparse()
+#    test_PriceEstimator_compute_prices_processes()
+#    test_PriceEstimator_compute_average_prices()
+#    test_PriceStatistics_blocks()
+#    test_PriceEstimator_find_problems_rank_deficient_matrix_sparse()
+    pass #IGNORE:W0107